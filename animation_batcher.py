@@ -0,0 +1,196 @@
+"""
+Cross-Request Dynamic Batching
+
+Most jobs use one of a few stock expression videos, so at busy times several
+workers animate different avatars with the same driving video. Instead of
+running them separately, the batcher holds each job for up to ``max_delay``
+seconds, groups pending jobs by driving video, and renders the whole group
+together: the driving keypoints are loaded once and every driving frame is
+generated for all avatars in a single forward pass.
+
+A job that arrives alone only pays the small ``max_delay`` before it runs.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from keypoint_cache import get_keypoint_cache
+from pipeline_metrics import StageTimer, stage, use_timer
+from service_metrics import register_collector, stats_families
+
+MAX_DELAY = 0.05     # Seconds a job waits for others sharing its driving video
+MAX_BATCH_SIZE = 8   # Avatars rendered together in one forward pass
+MAX_CONCURRENT = 2   # Groups rendered at the same time
+
+
+class _PendingJob:
+    def __init__(self, source_image_path, output_path, progress_callback, frame_callback, timer):
+        self.source_image_path = source_image_path
+        self.output_path = output_path
+        self.progress_callback = progress_callback
+        self.frame_callback = frame_callback
+        self.timer = timer
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class AnimationBatcher:
+    def __init__(self, max_delay=MAX_DELAY, max_batch_size=MAX_BATCH_SIZE,
+                 max_concurrent=MAX_CONCURRENT, keypoint_cache=None):
+        """
+        Scheduler that merges concurrent jobs sharing a driving video
+
+        Args:
+            max_delay: Seconds the oldest job in a group waits before it runs
+            max_batch_size: Most jobs rendered in one group
+            max_concurrent: Groups rendered in parallel
+            keypoint_cache: KeypointCache for driving keypoints (default: shared)
+        """
+        self.max_delay = max_delay
+        self.max_batch_size = max_batch_size
+        self.keypoint_cache = keypoint_cache or get_keypoint_cache()
+
+        self._groups = {}  # (generator id, driving video) -> (generator, [jobs])
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent,
+                                            thread_name_prefix='animation-batch')
+        self._dispatcher = threading.Thread(target=self._dispatch, name='animation-batcher', daemon=True)
+        self._dispatcher.start()
+
+        self.batches = 0
+        self.jobs = 0
+
+    def submit(self, generator, source_image_path, driving_video_path, output_path,
+               progress_callback=None, frame_callback=None, timer=None):
+        """
+        Queue a job to be rendered with others sharing its driving video
+
+        If a StageTimer is given, the job's wait for its group and the
+        group's shared stage times are recorded in it.
+
+        Returns:
+            Future: Resolves to output_path, or raises the job's error
+        """
+        job = _PendingJob(source_image_path, output_path, progress_callback, frame_callback, timer)
+        key = (id(generator), driving_video_path)
+
+        with self._condition:
+            group = self._groups.setdefault(key, (generator, []))
+            group[1].append(job)
+            self._condition.notify()
+        return job.future
+
+    def stats(self):
+        """Snapshot of batching counters"""
+        with self._condition:
+            return {
+                'batches': self.batches,
+                'jobs': self.jobs,
+                'pending': sum(len(jobs) for _, jobs in self._groups.values()),
+                'mean_batch_size': self.jobs / self.batches if self.batches else 0.0
+            }
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                ready, wait = self._take_ready_groups()
+                if not ready:
+                    self._condition.wait(wait)
+                    continue
+                self.batches += len(ready)
+                self.jobs += sum(len(jobs) for _, _, jobs in ready)
+
+            for driving_video_path, generator, jobs in ready:
+                self._executor.submit(self._run_group, generator, driving_video_path, jobs)
+
+    def _take_ready_groups(self):
+        # Caller holds self._condition. A group is ready once it is full or
+        # its oldest job has waited max_delay.
+        now = time.monotonic()
+        ready, wait = [], None
+
+        for key, (generator, jobs) in list(self._groups.items()):
+            deadline = jobs[0].enqueued_at + self.max_delay
+            if len(jobs) >= self.max_batch_size or deadline <= now:
+                batch, rest = jobs[:self.max_batch_size], jobs[self.max_batch_size:]
+                ready.append((key[1], generator, batch))
+                if rest:
+                    self._groups[key] = (generator, rest)
+                else:
+                    del self._groups[key]
+            else:
+                remaining = deadline - now
+                wait = remaining if wait is None else min(wait, remaining)
+
+        return ready, wait
+
+    def _run_group(self, generator, driving_video_path, jobs):
+        started = time.monotonic()
+        group_timer = StageTimer()
+        with use_timer(group_timer):
+            errors = self._render_group(generator, driving_video_path, jobs)
+
+        # Every job in the group shares the group's stage times. Recorded
+        # before the futures resolve, so waiting jobs see complete metrics.
+        for job in jobs:
+            if job.timer is not None:
+                job.timer.record('batch_wait', started - job.enqueued_at)
+                job.timer.merge(group_timer)
+                job.timer.info['group_size'] = len(jobs)
+
+        for job in jobs:
+            if job in errors:
+                job.future.set_exception(errors[job])
+            else:
+                job.future.set_result(job.output_path)
+
+    def _render_group(self, generator, driving_video_path, jobs):
+        # Returns {job: exception} for the jobs that failed
+        try:
+            with stage('keypoint_cache'):
+                driving_keypoints = self.keypoint_cache.get_or_build(driving_video_path, generator)
+        except Exception as e:
+            return {job: e for job in jobs}
+
+        # A bad avatar fails only its own job
+        sources, runnable, errors = [], [], {}
+        for job in jobs:
+            try:
+                with stage('source'):
+                    sources.append(generator.prepare_source(job.source_image_path))
+                runnable.append(job)
+            except Exception as e:
+                errors[job] = e
+
+        if not runnable:
+            return errors
+
+        try:
+            generator.animate_sources_with_keypoints(
+                sources,
+                driving_keypoints,
+                [job.output_path for job in runnable],
+                progress_callbacks=[job.progress_callback for job in runnable],
+                frame_callbacks=[job.frame_callback for job in runnable]
+            )
+        except Exception as e:
+            print(f"Batched animation error ({len(runnable)} jobs): {e}")
+            errors.update((job, e) for job in runnable)
+        return errors
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_animation_batcher():
+    """Return the process-wide AnimationBatcher"""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = AnimationBatcher()
+            register_collector('animation_batcher', lambda: stats_families(
+                'animation_batcher', _batcher.stats(), counters=('batches', 'jobs'),
+                gauges=('pending', 'mean_batch_size')))
+        return _batcher
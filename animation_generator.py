@@ -1,255 +1,697 @@
-"""
-First Order Model Integration for Face Animation
-This module handles the integration with the First Order Model from:
-https://github.com/AliaksandrSiarohin/first-order-model
-
-Prerequisites:
-1. Clone the first-order-model repository
-2. Download pre-trained models
-3. Install required dependencies: torch, torchvision, imageio, scikit-image, etc.
-"""
-
-import os
-import sys
-import yaml
-import imageio
-import numpy as np
-from skimage import img_as_ubyte
-from skimage.transform import resize
-import torch
-from scipy.spatial import ConvexHull
-import warnings
-warnings.filterwarnings("ignore")
-
-# Add first-order-model to path
-FIRST_ORDER_MODEL_PATH = './first-order-model'
-sys.path.insert(0, FIRST_ORDER_MODEL_PATH)
-
-try:
-    from demo import load_checkpoints, make_animation
-    from modules.generator import OcclusionAwareGenerator
-    from modules.keypoint_detector import KPDetector
-except ImportError:
-    print("Warning: First Order Model not found. Please clone the repository.")
-
-class FaceAnimationGenerator:
-    def __init__(self, config_path='./first-order-model/config/vox-256.yaml',
-                 checkpoint_path='./first-order-model/checkpoints/vox-cpk.pth.tar'):
-        """
-        Initialize the Face Animation Generator
-        
-        Args:
-            config_path: Path to the model configuration file
-            checkpoint_path: Path to the pre-trained model checkpoint
-        """
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        print(f"Using device: {self.device}")
-        
-        try:
-            # Load configuration
-            with open(config_path) as f:
-                self.config = yaml.safe_load(f)
-            
-            # Load checkpoint
-            self.generator, self.kp_detector = load_checkpoints(
-                config_path=config_path,
-                checkpoint_path=checkpoint_path,
-                device=self.device
-            )
-            
-            self.generator.eval()
-            self.kp_detector.eval()
-            
-            print("Model loaded successfully!")
-        
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            self.generator = None
-            self.kp_detector = None
-    
-    def generate_animation(self, source_image_path, driving_video_path, output_path, 
-                          relative=True, adapt_movement_scale=True, cpu=False):
-        """
-        Generate animation from source image and driving video
-        
-        Args:
-            source_image_path: Path to the source image (avatar)
-            driving_video_path: Path to the driving video
-            output_path: Path to save the output video
-            relative: Use relative or absolute keypoint coordinates
-            adapt_movement_scale: Adapt movement scale based on convex hull
-            cpu: Use CPU instead of GPU
-        
-        Returns:
-            str: Path to the generated animation
-        """
-        if self.generator is None or self.kp_detector is None:
-            raise Exception("Model not loaded. Please check the setup.")
-        
-        try:
-            # Read source image
-            source_image = imageio.imread(source_image_path)
-            source_image = resize(source_image, (256, 256))[..., :3]
-            
-            # Read driving video
-            reader = imageio.get_reader(driving_video_path)
-            fps = reader.get_meta_data()['fps']
-            driving_video = []
-            
-            try:
-                for im in reader:
-                    driving_video.append(im)
-            except RuntimeError:
-                pass
-            
-            reader.close()
-            
-            # Resize driving video
-            driving_video = [resize(frame, (256, 256))[..., :3] for frame in driving_video]
-            
-            # Generate predictions
-            predictions = make_animation(
-                source_image, 
-                driving_video, 
-                self.generator, 
-                self.kp_detector,
-                relative=relative,
-                adapt_movement_scale=adapt_movement_scale,
-                cpu=cpu
-            )
-            
-            # Save output
-            imageio.mimsave(output_path, [img_as_ubyte(frame) for frame in predictions], fps=fps)
-            
-            print(f"Animation saved to: {output_path}")
-            return output_path
-        
-        except Exception as e:
-            print(f"Error generating animation: {e}")
-            raise e
-    
-    def generate_expression_animation(self, source_image_path, expression_type, output_path):
-        """
-        Generate animation with predefined expression
-        
-        Args:
-            source_image_path: Path to the source image
-            expression_type: Type of expression (smile, angry, surprised, sad)
-            output_path: Path to save the output
-        
-        Returns:
-            str: Path to the generated animation
-        """
-        # Map expression types to driving videos
-        expression_videos = {
-            'smile': './expressions/smile.mp4',
-            'angry': './expressions/angry.mp4',
-            'surprised': './expressions/surprised.mp4',
-            'sad': './expressions/sad.mp4'
-        }
-        
-        if expression_type not in expression_videos:
-            raise ValueError(f"Unknown expression type: {expression_type}")
-        
-        driving_video_path = expression_videos.get(expression_type)
-        
-        if not os.path.exists(driving_video_path):
-            raise FileNotFoundError(f"Expression video not found: {driving_video_path}")
-        
-        return self.generate_animation(source_image_path, driving_video_path, output_path)
-
-
-# Utility functions for Flask integration
-def setup_first_order_model():
-    """
-    Setup function to download and prepare the First Order Model
-    Run this once during initial setup
-    """
-    import subprocess
-    
-    print("Setting up First Order Model...")
-    
-    # Clone repository if not exists
-    if not os.path.exists(FIRST_ORDER_MODEL_PATH):
-        print("Cloning first-order-model repository...")
-        subprocess.run([
-            'git', 'clone', 
-            'https://github.com/AliaksandrSiarohin/first-order-model.git'
-        ])
-    
-    # Download checkpoint
-    checkpoint_dir = os.path.join(FIRST_ORDER_MODEL_PATH, 'checkpoints')
-    os.makedirs(checkpoint_dir, exist_ok=True)
-    
-    checkpoint_file = os.path.join(checkpoint_dir, 'vox-cpk.pth.tar')
-    
-    if not os.path.exists(checkpoint_file):
-        print("Downloading pre-trained model...")
-        subprocess.run([
-            'wget', 
-            'https://cloud.tsinghua.edu.cn/f/00c0c9f0f9c04f5da14e/?dl=1',
-            '-O', checkpoint_file
-        ])
-    
-    print("Setup complete!")
-
-
-def process_animation_task(avatar_path, expression_or_video, output_path, task_type='expression'):
-    """
-    Process animation generation task
-    
-    Args:
-        avatar_path: Path to the avatar image
-        expression_or_video: Expression type or path to driving video
-        output_path: Path to save output
-        task_type: 'expression' or 'custom'
-    
-    Returns:
-        dict: Result with status and output path
-    """
-    try:
-        generator = FaceAnimationGenerator()
-        
-        if task_type == 'expression':
-            result_path = generator.generate_expression_animation(
-                avatar_path, 
-                expression_or_video, 
-                output_path
-            )
-        else:
-            result_path = generator.generate_animation(
-                avatar_path,
-                expression_or_video,
-                output_path
-            )
-        
-        return {
-            'status': 'success',
-            'output_path': result_path,
-            'message': 'Animation generated successfully'
-        }
-    
-    except Exception as e:
-        return {
-            'status': 'failed',
-            'error': str(e),
-            'message': 'Animation generation failed'
-        }
-
-
-# Example usage
-if __name__ == '__main__':
-    # Setup (run once)
-    # setup_first_order_model()
-    
-    # Test generation
-    generator = FaceAnimationGenerator()
-    
-    # Generate with expression
-    result = generator.generate_expression_animation(
-        source_image_path='./test_avatar.jpg',
-        expression_type='smile',
-        output_path='./test_output.mp4'
-    )
-    
+"""
+First Order Model Integration for Face Animation
+This module handles the integration with the First Order Model from:
+https://github.com/AliaksandrSiarohin/first-order-model
+
+Prerequisites:
+1. Clone the first-order-model repository
+2. Download pre-trained models
+3. Install required dependencies: torch, torchvision, imageio, scikit-image, etc.
+
+Only processes that run animation jobs import this module. The First Order
+Model code (and the scipy, scikit-image and matplotlib it pulls in) is
+imported on first use, so a worker loading an ONNX export never imports it.
+"""
+
+import os
+import sys
+import itertools
+import yaml
+import imageio
+import numpy as np
+import torch
+import warnings
+from model_registry import get_model_registry
+from keypoint_cache import get_keypoint_cache
+from animation_batcher import get_animation_batcher
+from frame_preprocessing import resize_batch, to_uint8_batch
+from expression_catalog import expression_video_path
+from avatar_ingest import load_source_features
+from inference_backends import load_backend
+from onnx_backend import export_onnx, is_exported, load_onnx_models
+from pipeline_metrics import StageTimer, current_timer, stage, timed_iter, use_timer
+warnings.filterwarnings("ignore")
+
+# Add first-order-model to path
+FIRST_ORDER_MODEL_PATH = './first-order-model'
+sys.path.insert(0, FIRST_ORDER_MODEL_PATH)
+
+
+def load_checkpoints(**kwargs):
+    """First Order Model demo.load_checkpoints, imported on first use"""
+    try:
+        from demo import load_checkpoints as fom_load_checkpoints
+    except ImportError:
+        print("Warning: First Order Model not found. Please clone the repository.")
+        raise
+    return fom_load_checkpoints(**kwargs)
+
+
+def normalize_kp(**kwargs):
+    """First Order Model animate.normalize_kp, imported on first use"""
+    from animate import normalize_kp as fom_normalize_kp
+    return fom_normalize_kp(**kwargs)
+
+
+def hull_area(points):
+    """Area of the convex hull of 2-D keypoints"""
+    from scipy.spatial import ConvexHull
+    return ConvexHull(points).volume
+
+STREAM_CHUNK_SIZE = 16  # Driving frames decoded/animated/encoded per step
+MAX_BATCH_SIZE = 16     # Upper bound for automatically chosen generator batches
+BATCH_FRAME_MEMORY = 256 * 1024 ** 2  # Rough peak bytes per frame in a generator batch
+
+
+def read_frames(reader):
+    """Yield decoded driving video frames, stopping quietly at a truncated end"""
+    try:
+        for im in reader:
+            yield im
+    except RuntimeError:
+        pass
+
+
+def iter_chunks(frames, chunk_size):
+    """Group a frame iterator into stacked arrays of up to chunk_size frames"""
+    frames = iter(frames)
+    while True:
+        chunk = list(itertools.islice(frames, chunk_size))
+        if not chunk:
+            return
+        yield np.stack(chunk)
+
+
+def available_memory(device):
+    """Free memory in bytes on the inference device, or None if unknown"""
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def auto_batch_size(device, frame_memory=BATCH_FRAME_MEMORY, max_batch_size=MAX_BATCH_SIZE):
+    """Largest generator batch that fits in half of the free device memory"""
+    free = available_memory(device)
+    if free is None:
+        return 1
+    return int(max(1, min(max_batch_size, free // 2 // frame_memory)))
+
+
+def estimate_frame_count(meta):
+    """Best-effort frame count from video metadata, or None if unknown"""
+    nframes = meta.get('nframes')
+    if isinstance(nframes, int) and nframes > 0:
+        return nframes
+    duration = meta.get('duration')
+    if duration and meta.get('fps'):
+        return int(duration * meta['fps'])
+    return None
+
+
+class FaceAnimationGenerator:
+    def __init__(self, config_path='./first-order-model/config/vox-256.yaml',
+                 checkpoint_path='./first-order-model/checkpoints/vox-cpk.pth.tar',
+                 batch_size='auto', backend='eager'):
+        """
+        Initialize the Face Animation Generator
+        
+        Args:
+            config_path: Path to the model configuration file
+            checkpoint_path: Path to the pre-trained model checkpoint
+            batch_size: Driving frames per generator forward pass, or 'auto'
+                        to size batches from the free device memory
+            backend: Generator execution backend (see inference_backends.BACKENDS);
+                     falls back to 'eager' if it can't be built
+        """
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.config_path = config_path
+        self.checkpoint_path = checkpoint_path
+        self.backend = 'eager'
+        # Only onnx replaces the keypoint detector; the other backends convert the generator alone
+        self.kp_backend = 'eager'
+        self.batch_size = auto_batch_size(self.device) if batch_size == 'auto' else max(1, int(batch_size))
+        print(f"Using device: {self.device} (batch size {self.batch_size})")
+        
+        try:
+            # Load configuration
+            with open(config_path) as f:
+                self.config = yaml.safe_load(f)
+            
+            if backend == 'onnx' and is_exported(checkpoint_path):
+                try:
+                    # The exported graphs replace both torch models; no checkpoint load needed
+                    self.generator, self.kp_detector = load_onnx_models(checkpoint_path)
+                    self.backend = self.kp_backend = 'onnx'
+                    print("Model loaded from ONNX export")
+                    return
+                except Exception as e:
+                    print(f"Error loading ONNX export, loading checkpoint instead: {e}")
+            
+            # Load checkpoint
+            self.generator, self.kp_detector = load_checkpoints(
+                config_path=config_path,
+                checkpoint_path=checkpoint_path,
+                device=self.device
+            )
+            
+            self.generator.eval()
+            self.kp_detector.eval()
+            
+            print("Model loaded successfully!")
+        
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            self.generator = None
+            self.kp_detector = None
+            return
+        
+        if backend == 'onnx':
+            try:
+                export_onnx(self)
+                self.generator, self.kp_detector = load_onnx_models(checkpoint_path)
+                self.backend = self.kp_backend = 'onnx'
+                print("Using onnx inference backend")
+            except Exception as e:
+                print(f"Inference backend onnx unavailable, using eager: {e}")
+        elif backend != 'eager':
+            try:
+                self.generator = load_backend(self, backend)
+                self.backend = backend
+                print(f"Using {backend} inference backend")
+            except Exception as e:
+                print(f"Inference backend {backend} unavailable, using eager: {e}")
+    
+    def generate_animation(self, source_image_path, driving_video_path, output_path, 
+                          relative=True, adapt_movement_scale=True, cpu=False,
+                          progress_callback=None, chunk_size=STREAM_CHUNK_SIZE, batch_size=None,
+                          frame_callback=None):
+        """
+        Generate animation from source image and driving video
+        
+        The driving video is streamed: frames are decoded, resized, animated
+        and appended to the output in chunks of ``chunk_size``, so memory use
+        doesn't grow with video length.
+        
+        Args:
+            source_image_path: Path to the source image (avatar)
+            driving_video_path: Path to the driving video
+            output_path: Path to save the output video
+            relative: Use relative or absolute keypoint coordinates
+            adapt_movement_scale: Adapt movement scale based on convex hull
+            cpu: Unused; the device is chosen when the model is loaded
+            progress_callback: Optional callable receiving progress (0-100)
+            chunk_size: Driving frames held in memory at a time
+            batch_size: Frames per generator forward pass (default: self.batch_size)
+            frame_callback: Optional callable receiving each block of uint8
+                            frames as it is written (live preview)
+        
+        Returns:
+            str: Path to the generated animation
+        """
+        if self.generator is None or self.kp_detector is None:
+            raise Exception("Model not loaded. Please check the setup.")
+        
+        batch_size = batch_size or self.batch_size
+        chunk_size = max(chunk_size, batch_size)
+        
+        try:
+            reader = imageio.get_reader(driving_video_path)
+            meta = reader.get_meta_data()
+            
+            try:
+                # Each chunk is resized to model input in one vectorised call
+                decoded = timed_iter('decode', iter_chunks(read_frames(reader), chunk_size))
+                frame_chunks = timed_iter('resize', (resize_batch(chunk) for chunk in decoded))
+                keypoint_chunks = timed_iter('keypoints', (self.detect_keypoints(chunk, batch_size=chunk_size)
+                                                           for chunk in frame_chunks))
+                predictions = self._animate(source_image_path, keypoint_chunks,
+                                            relative=relative,
+                                            adapt_movement_scale=adapt_movement_scale,
+                                            batch_size=batch_size)
+                self._write_video(predictions, output_path, meta['fps'],
+                                  estimate_frame_count(meta), progress_callback, frame_callback)
+            finally:
+                reader.close()
+            
+            print(f"Animation saved to: {output_path}")
+            return output_path
+        
+        except Exception as e:
+            print(f"Error generating animation: {e}")
+            raise e
+    
+    def detect_keypoints(self, frames, batch_size=16):
+        """
+        Run the keypoint detector over a sequence of preprocessed frames
+        
+        Args:
+            frames: Array of shape (N, 256, 256, 3) with values in [0, 1]
+            batch_size: Frames per detector forward pass
+        
+        Returns:
+            tuple: (values of shape (N, K, 2), jacobians of shape (N, K, 2, 2) or None)
+        """
+        values, jacobians = [], []
+        with torch.no_grad():
+            for start in range(0, len(frames), batch_size):
+                batch = np.asarray(frames[start:start + batch_size], dtype=np.float32)
+                batch = torch.from_numpy(batch).permute(0, 3, 1, 2).to(self.device)
+                kp = self.kp_detector(batch)
+                values.append(kp['value'].cpu().numpy())
+                if 'jacobian' in kp:
+                    jacobians.append(kp['jacobian'].cpu().numpy())
+        
+        return np.concatenate(values), (np.concatenate(jacobians) if jacobians else None)
+    
+    def animate_with_keypoints(self, source_image_path, driving_keypoints, output_path,
+                               relative=True, adapt_movement_scale=True, progress_callback=None,
+                               chunk_size=STREAM_CHUNK_SIZE, batch_size=None, frame_callback=None):
+        """
+        Generate animation from precomputed driving keypoints
+        
+        Skips decoding the driving video and running the keypoint detector
+        on it; only the source image and the generator are processed.
+        
+        Args:
+            source_image_path: Path to the source image (avatar)
+            driving_keypoints: DrivingKeypoints from the keypoint cache
+            output_path: Path to save the output video
+            relative: Use relative or absolute keypoint coordinates
+            adapt_movement_scale: Adapt movement scale based on convex hull
+            progress_callback: Optional callable receiving progress (0-100)
+            chunk_size: Keypoint frames read from the cache at a time
+            batch_size: Frames per generator forward pass (default: self.batch_size)
+            frame_callback: Optional callable receiving each block of uint8
+                            frames as it is written (live preview)
+        
+        Returns:
+            str: Path to the generated animation
+        """
+        if self.generator is None or self.kp_detector is None:
+            raise Exception("Model not loaded. Please check the setup.")
+        
+        batch_size = batch_size or self.batch_size
+        chunk_size = max(chunk_size, batch_size)
+        values = driving_keypoints.values
+        jacobians = driving_keypoints.jacobians
+        keypoint_chunks = timed_iter('keypoints', ((np.array(values[i:i + chunk_size]),
+                                                    np.array(jacobians[i:i + chunk_size]) if jacobians is not None else None)
+                                                   for i in range(0, len(values), chunk_size)))
+        
+        # Movement scale uses the cached driving hull area instead of recomputing it
+        predictions = self._animate(source_image_path, keypoint_chunks, relative=relative,
+                                    adapt_movement_scale=adapt_movement_scale,
+                                    driving_hull_area=driving_keypoints.hull_area,
+                                    batch_size=batch_size)
+        self._write_video(predictions, output_path, driving_keypoints.fps,
+                          driving_keypoints.num_frames, progress_callback, frame_callback)
+        
+        print(f"Animation saved to: {output_path}")
+        return output_path
+    
+    def _animate(self, source_image_path, keypoint_chunks, relative=True,
+                 adapt_movement_scale=True, driving_hull_area=None, batch_size=1):
+        """
+        Yield predicted frames for a stream of driving keypoint chunks
+        
+        Up to ``batch_size`` driving frames go through the generator in one
+        forward pass, with the source image and its keypoints broadcast
+        across the batch. batch_size=1 is the original frame-by-frame mode.
+        
+        Args:
+            source_image_path: Path to the source image (avatar)
+            keypoint_chunks: Iterable of (values, jacobians) arrays per chunk
+            relative: Use relative or absolute keypoint coordinates
+            adapt_movement_scale: Adapt movement scale based on convex hull
+            driving_hull_area: Hull area of the first driving frame, if known
+            batch_size: Driving frames per generator forward pass
+        
+        Yields:
+            np.ndarray: Predicted frames of shape (n, 256, 256, 3) in [0, 1]
+        """
+        with stage('source'):
+            source, kp_source = self.prepare_source(source_image_path)
+        
+        kp_driving_initial = None
+        movement_scale = 1
+        
+        for values, jacobians in keypoint_chunks:
+            for start in range(0, len(values), batch_size):
+                with torch.no_grad():
+                    kp_driving = {'value': torch.from_numpy(np.array(values[start:start + batch_size])).to(self.device)}
+                    if jacobians is not None:
+                        kp_driving['jacobian'] = torch.from_numpy(np.array(jacobians[start:start + batch_size])).to(self.device)
+                    
+                    if kp_driving_initial is None:
+                        kp_driving_initial = {name: kp[:1] for name, kp in kp_driving.items()}
+                        if adapt_movement_scale:
+                            if driving_hull_area is None:
+                                driving_hull_area = hull_area(np.asarray(values[0]))
+                            source_area = hull_area(kp_source['value'][0].cpu().numpy())
+                            movement_scale = np.sqrt(source_area) / np.sqrt(driving_hull_area)
+                    
+                    # Keypoint normalisation broadcasts the (1, ...) source/initial
+                    # keypoints over the (n, ...) driving batch
+                    kp_norm = normalize_kp(kp_source=kp_source, kp_driving=kp_driving,
+                                           kp_driving_initial=kp_driving_initial,
+                                           use_relative_movement=relative,
+                                           use_relative_jacobian=relative and jacobians is not None,
+                                           adapt_movement_scale=False)
+                    if relative and movement_scale != 1:
+                        kp_norm['value'] = (kp_norm['value'] - kp_source['value']) * movement_scale + kp_source['value']
+                    
+                    n = kp_norm['value'].shape[0]
+                    with stage('generator'):
+                        out = self.generator(source.expand(n, -1, -1, -1),
+                                             kp_source={name: kp.expand(n, *kp.shape[1:]) for name, kp in kp_source.items()},
+                                             kp_driving=kp_norm)
+                        predictions = np.transpose(out['prediction'].cpu().numpy(), [0, 2, 3, 1])
+                
+                yield predictions
+    
+    def prepare_source(self, source_image_path):
+        """
+        Load an avatar and run the keypoint detector on it
+        
+        Uses the features saved at upload time when they exist for this
+        checkpoint and keypoint detector backend, skipping the resize and
+        keypoint detection.
+        
+        Returns:
+            tuple: (source tensor of shape (1, 3, 256, 256), source keypoints)
+        """
+        features = load_source_features(source_image_path, self.checkpoint_path, self.kp_backend)
+        if features is not None:
+            source_image, keypoints = features
+            source = torch.from_numpy(source_image).permute(0, 3, 1, 2).to(self.device)
+            kp_source = {name: torch.from_numpy(kp).to(self.device) for name, kp in keypoints.items()}
+            return source, kp_source
+        
+        source_image = resize_batch(imageio.imread(source_image_path)[np.newaxis])
+        
+        with torch.no_grad():
+            source = torch.from_numpy(source_image).permute(0, 3, 1, 2).to(self.device)
+            kp_source = self.kp_detector(source)
+        return source, kp_source
+    
+    def animate_sources_with_keypoints(self, sources, driving_keypoints, output_paths,
+                                       relative=True, adapt_movement_scale=True,
+                                       progress_callbacks=None, frame_callbacks=None):
+        """
+        Animate several avatars with the same driving keypoints at once
+        
+        Each driving frame is rendered for every source in one generator
+        forward pass, with one output video per source.
+        
+        Args:
+            sources: List of (source tensor, source keypoints) from prepare_source
+            driving_keypoints: DrivingKeypoints from the keypoint cache
+            output_paths: Output video path per source
+            relative: Use relative or absolute keypoint coordinates
+            adapt_movement_scale: Adapt movement scale based on convex hull
+            progress_callbacks: Optional progress callable per source
+            frame_callbacks: Optional live preview frame callable per source
+        
+        Returns:
+            list: Output paths, in the same order as sources
+        """
+        if self.generator is None or self.kp_detector is None:
+            raise Exception("Model not loaded. Please check the setup.")
+        
+        progress_callbacks = progress_callbacks or [None] * len(sources)
+        frame_callbacks = frame_callbacks or [None] * len(sources)
+        num_frames = driving_keypoints.num_frames
+        values = driving_keypoints.values
+        jacobians = driving_keypoints.jacobians
+        
+        with torch.no_grad():
+            source = torch.cat([src for src, _ in sources])
+            kp_source = {name: torch.cat([kp[name] for _, kp in sources])
+                         for name in sources[0][1]}
+            
+            # One movement scale per source, broadcast over its keypoints
+            movement_scale = torch.ones(len(sources), 1, 1, device=self.device)
+            if adapt_movement_scale:
+                areas = [hull_area(kp['value'][0].cpu().numpy()) for _, kp in sources]
+                movement_scale = torch.tensor(np.sqrt(areas) / np.sqrt(driving_keypoints.hull_area),
+                                              dtype=torch.float32, device=self.device).view(-1, 1, 1)
+            
+            def kp_at(index):
+                kp = {'value': torch.from_numpy(np.array(values[index:index + 1])).to(self.device)}
+                if jacobians is not None:
+                    kp['jacobian'] = torch.from_numpy(np.array(jacobians[index:index + 1])).to(self.device)
+                return kp
+            
+            kp_driving_initial = kp_at(0)
+            writers = [imageio.get_writer(path, fps=driving_keypoints.fps) for path in output_paths]
+            try:
+                for frame_idx in range(num_frames):
+                    kp_norm = normalize_kp(kp_source=kp_source, kp_driving=kp_at(frame_idx),
+                                           kp_driving_initial=kp_driving_initial,
+                                           use_relative_movement=relative,
+                                           use_relative_jacobian=relative and jacobians is not None,
+                                           adapt_movement_scale=False)
+                    if relative:
+                        kp_norm['value'] = (kp_norm['value'] - kp_source['value']) * movement_scale + kp_source['value']
+                    else:
+                        kp_norm = {name: kp.expand(len(sources), *kp.shape[1:]) for name, kp in kp_norm.items()}
+                    
+                    with stage('generator'):
+                        out = self.generator(source, kp_source=kp_source, kp_driving=kp_norm)
+                        predictions = np.transpose(out['prediction'].cpu().numpy(), [0, 2, 3, 1])
+                    with stage('to_uint8'):
+                        predictions = to_uint8_batch(predictions)
+                    
+                    for writer, prediction, frame_callback in zip(writers, predictions, frame_callbacks):
+                        with stage('encode'):
+                            writer.append_data(prediction)
+                        if frame_callback:
+                            with stage('preview'):
+                                frame_callback(prediction[np.newaxis])
+                    current_timer().add_frames(1)
+                    
+                    if frame_idx % 10 == 0:
+                        for callback in progress_callbacks:
+                            if callback:
+                                callback(min(99, int(100 * (frame_idx + 1) / num_frames)))
+            finally:
+                with stage('encode'):
+                    for writer in writers:
+                        writer.close()
+        
+        return output_paths
+    
+    def _write_video(self, batches, output_path, fps, total_frames=None, progress_callback=None,
+                     frame_callback=None):
+        """Append batches of predicted frames to the output video as they arrive"""
+        timer = current_timer()
+        writer = imageio.get_writer(output_path, fps=fps)
+        written = 0
+        try:
+            for batch in batches:
+                with timer.stage('to_uint8'):
+                    frames = to_uint8_batch(batch)
+                with timer.stage('encode'):
+                    for frame in frames:
+                        writer.append_data(frame)
+                if frame_callback:
+                    with timer.stage('preview'):
+                        frame_callback(frames)
+                written += len(batch)
+                timer.add_frames(len(batch))
+                if progress_callback and total_frames:
+                    progress_callback(min(99, int(100 * written / total_frames)))
+        finally:
+            with timer.stage('encode'):
+                writer.close()
+    
+    def generate_expression_animation(self, source_image_path, expression_type, output_path,
+                                      progress_callback=None, frame_callback=None):
+        """
+        Generate animation with predefined expression
+        
+        Args:
+            source_image_path: Path to the source image
+            expression_type: Type of expression (smile, angry, surprised, sad)
+            output_path: Path to save the output
+            progress_callback: Optional callable receiving progress (0-100)
+            frame_callback: Optional callable receiving generated uint8 frames
+        
+        Returns:
+            str: Path to the generated animation
+        """
+        driving_video_path = expression_video_path(expression_type)
+        
+        # Stock videos never change, so their driving keypoints are cached on disk
+        with stage('keypoint_cache'):
+            driving_keypoints = get_keypoint_cache().get_or_build(driving_video_path, self)
+        
+        return self.animate_with_keypoints(source_image_path, driving_keypoints, output_path,
+                                           progress_callback=progress_callback,
+                                           frame_callback=frame_callback)
+
+
+def check_batch_consistency(generator, source_image_path, driving_video_path,
+                            batch_size=None, max_frames=32, tolerance=1e-3):
+    """
+    Verify batched inference matches frame-by-frame inference
+    
+    Args:
+        generator: Loaded FaceAnimationGenerator
+        source_image_path: Path to a source image
+        driving_video_path: Path to a driving video
+        batch_size: Batch size to check (default: generator.batch_size)
+        max_frames: Number of driving frames to compare
+        tolerance: Largest allowed absolute pixel difference (0-1 scale)
+    
+    Returns:
+        float: Largest absolute difference between the two modes
+    """
+    batch_size = batch_size or generator.batch_size
+    
+    reader = imageio.get_reader(driving_video_path)
+    try:
+        frames = resize_batch(np.stack(list(itertools.islice(read_frames(reader), max_frames))))
+    finally:
+        reader.close()
+    
+    keypoints = generator.detect_keypoints(frames)
+    single = np.concatenate(list(generator._animate(source_image_path, [keypoints], batch_size=1)))
+    batched = np.concatenate(list(generator._animate(source_image_path, [keypoints], batch_size=batch_size)))
+    
+    max_diff = float(np.abs(single - batched).max())
+    if max_diff > tolerance:
+        raise AssertionError(f"Batched output differs from frame-by-frame by {max_diff:.5f} "
+                             f"(tolerance {tolerance})")
+    return max_diff
+
+
+# Utility functions for Flask integration
+def setup_first_order_model():
+    """
+    Setup function to download and prepare the First Order Model
+    Run this once during initial setup
+    """
+    import subprocess
+    
+    print("Setting up First Order Model...")
+    
+    # Clone repository if not exists
+    if not os.path.exists(FIRST_ORDER_MODEL_PATH):
+        print("Cloning first-order-model repository...")
+        subprocess.run([
+            'git', 'clone', 
+            'https://github.com/AliaksandrSiarohin/first-order-model.git'
+        ])
+    
+    # Download checkpoint
+    checkpoint_dir = os.path.join(FIRST_ORDER_MODEL_PATH, 'checkpoints')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    
+    checkpoint_file = os.path.join(checkpoint_dir, 'vox-cpk.pth.tar')
+    
+    if not os.path.exists(checkpoint_file):
+        print("Downloading pre-trained model...")
+        subprocess.run([
+            'wget', 
+            'https://cloud.tsinghua.edu.cn/f/00c0c9f0f9c04f5da14e/?dl=1',
+            '-O', checkpoint_file
+        ])
+    
+    print("Setup complete!")
+
+
+def process_animation_task(avatar_path, expression_or_video, output_path, task_type='expression',
+                           progress_callback=None, use_batching=True, frame_callback=None):
+    """
+    Process animation generation task
+    
+    Args:
+        avatar_path: Path to the avatar image
+        expression_or_video: Expression type or path to driving video
+        output_path: Path to save output
+        task_type: 'expression' or 'custom'
+        progress_callback: Optional callable receiving progress (0-100)
+        use_batching: Merge expression jobs with concurrent jobs that share
+                      the same driving video
+        frame_callback: Optional callable receiving generated uint8 frames,
+                        e.g. a preview_stream.PreviewWriter
+    
+    Returns:
+        dict: Result with status, output path and per-stage metrics
+              (see pipeline_metrics.StageTimer.summary)
+    """
+    timer = StageTimer()
+    
+    try:
+        # Shared, already-loaded model; loading happens once per process
+        with use_timer(timer), stage('model'):
+            generator = get_model_registry().get()
+        timer.info.update(backend=generator.backend, batch_size=generator.batch_size)
+        
+        if task_type == 'expression' and use_batching:
+            # Runs on a batching thread, which records into this timer
+            result_path = get_animation_batcher().submit(
+                generator,
+                avatar_path,
+                expression_video_path(expression_or_video),
+                output_path,
+                progress_callback=progress_callback,
+                frame_callback=frame_callback,
+                timer=timer
+            ).result()
+        elif task_type == 'expression':
+            with use_timer(timer):
+                result_path = generator.generate_expression_animation(
+                    avatar_path, 
+                    expression_or_video, 
+                    output_path,
+                    progress_callback=progress_callback,
+                    frame_callback=frame_callback
+                )
+        else:
+            with use_timer(timer):
+                result_path = generator.generate_animation(
+                    avatar_path,
+                    expression_or_video,
+                    output_path,
+                    progress_callback=progress_callback,
+                    frame_callback=frame_callback
+                )
+        
+        return {
+            'status': 'success',
+            'output_path': result_path,
+            'message': 'Animation generated successfully',
+            'metrics': timer.finish().summary()
+        }
+    
+    except Exception as e:
+        return {
+            'status': 'failed',
+            'error': str(e),
+            'message': 'Animation generation failed',
+            'metrics': timer.finish().summary()
+        }
+
+
+# Example usage
+if __name__ == '__main__':
+    # Setup (run once)
+    # setup_first_order_model()
+    
+    # Test generation
+    generator = FaceAnimationGenerator()
+    
+    # Generate with expression
+    result = generator.generate_expression_animation(
+        source_image_path='./test_avatar.jpg',
+        expression_type='smile',
+        output_path='./test_output.mp4'
+    )
+    
     print(f"Generated: {result}")
\ No newline at end of file
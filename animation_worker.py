@@ -0,0 +1,682 @@
+"""
+Background Animation Job Queue
+
+Animation requests are stored as rows in the ``animations`` table, which acts
+as a durable job queue. The web process only inserts a 'queued' row and
+returns; worker threads claim queued rows, run ``process_animation_task`` and
+move the row through its states:
+
+    queued -> processing -> completed
+                         -> queued (retry, after a back-off delay)
+                         -> failed (retries exhausted)
+
+A running job refreshes ``heartbeat_at`` whenever it reports progress; a
+'processing' row whose heartbeat is older than the lease timeout belongs to
+a worker that died and is re-queued by the periodic recovery pass.
+
+When no animation is waiting, workers ingest newly uploaded avatars
+(``avatars.features_status`` 'pending' -> 'processing' -> 'ready'/'failed'/
+'invalid'): the image is verified, its thumbnail and model-ready
+derivatives are recorded on the row, and the source features every later
+animation reuses are precomputed. Finalized driving video uploads
+(``driving_videos.status`` 'pending' -> 'processing' -> 'ready'/'failed'/
+'invalid') are transcoded to model resolution the same way, see
+``video_ingest``.
+
+Every status change and progress update is also published to the job event
+bus (``job_events``), which the web process forwards to browsers. Job
+outcomes and stage timings are recorded in ``service_metrics``.
+
+Workers can run inside the web process (handy during development) or as a
+separate process:
+
+    python animation_worker.py --workers 2
+
+The inference backend comes from the ANIMATION_BACKEND environment variable
+only. The web process names the same setting in result cache keys, so web
+and worker processes must share it.
+
+A worker process also runs the storage reaper (``media_storage``) every
+``--reap-interval`` seconds to remove media files no row refers to.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from job_events import get_job_event_bus, job_event
+from media_storage import REAP_INTERVAL, StorageReaper, add_usage, file_size
+from preview_stream import PreviewWriter
+from result_cache import ResultCache
+from service_metrics import record_job, register_collector, stats_families
+from video_ingest import VIDEO_SIZE
+
+# Job settings
+MAX_ATTEMPTS = 3          # Total tries before a job is marked 'failed'
+RETRY_BACKOFF = 10        # Seconds before the first retry, doubled per attempt
+POLL_INTERVAL = 2         # Seconds an idle worker sleeps between queue checks
+LEASE_TIMEOUT = 30 * 60   # 'processing' rows without a heartbeat for this long are re-queued
+RECOVERY_INTERVAL = 60    # Seconds between checks for abandoned jobs
+MEDIA_ROOT = 'static'     # avatar_path / animation_path are relative to this
+DRIVING_VIDEOS_DIR = 'driving_videos'  # Transcoded driving videos, under the media root
+
+
+class AnimationWorkerPool:
+    def __init__(self, db_manager, num_workers=2, media_root=MEDIA_ROOT,
+                 max_attempts=MAX_ATTEMPTS, retry_backoff=RETRY_BACKOFF,
+                 poll_interval=POLL_INTERVAL, lease_timeout=LEASE_TIMEOUT,
+                 recovery_interval=RECOVERY_INTERVAL, task_runner=None, preload_models=False, result_cache=None,
+                 ingest_runner=None, live_preview=True, event_bus=None, video_runner=None):
+        """
+        Pool of threads that process queued animation jobs
+
+        Args:
+            db_manager: DatabaseConnection used to claim and update jobs
+            num_workers: Number of worker threads
+            media_root: Folder that stored avatar/animation paths are relative to
+            max_attempts: Tries per job before it is marked 'failed'
+            retry_backoff: Seconds before the first retry (doubles each time)
+            poll_interval: Seconds idle workers wait before checking the queue
+            lease_timeout: Seconds without a heartbeat after which a
+                           'processing' job is presumed abandoned by a
+                           crashed worker and re-queued
+            recovery_interval: Seconds between checks for abandoned jobs
+                               while the pool runs (0 disables them)
+            task_runner: Callable with the process_animation_task signature;
+                         defaults to animation_generator.process_animation_task
+            preload_models: Load the default model into the registry before
+                            the first job instead of on demand
+            result_cache: ResultCache that finished animations are registered in
+            ingest_runner: Callable (avatar_path) -> result dict for avatar
+                           ingest; defaults to avatar_ingest.process_avatar_ingest
+            live_preview: Publish frames to a preview stream while generating
+            event_bus: Bus job status events are published to (default: the
+                       installed job_events bus)
+            video_runner: Callable (upload_path, output_path, expected_sha256)
+                          -> result dict for driving video ingest; defaults
+                          to video_ingest.process_video_ingest
+        """
+        self.db_manager = db_manager
+        self.num_workers = num_workers
+        self.media_root = media_root
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self.recovery_interval = recovery_interval
+        self.task_runner = task_runner
+        self.ingest_runner = ingest_runner
+        self.video_runner = video_runner
+        self.preload_models = preload_models
+        self.live_preview = live_preview
+        self.event_bus = event_bus
+        self.result_cache = result_cache or ResultCache(db_manager, media_root=media_root)
+        self.worker_name = f'{socket.gethostname()}:{os.getpid()}'
+
+        self._threads = []
+        self._wakeup = threading.Condition()
+        self._pending_wakeups = 0
+        self._stopping = threading.Event()
+
+    # ----------------------------------------
+    # Lifecycle
+    # ----------------------------------------
+    def start(self):
+        """Re-queue abandoned jobs and start the worker threads"""
+        if self._threads:
+            return self
+        self.recover_stale_jobs()
+        if self.preload_models and self.task_runner is None:
+            from model_registry import get_model_registry
+            get_model_registry().preload()
+        self._stopping.clear()
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'animation-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.recovery_interval:
+            thread = threading.Thread(target=self._recover_periodically, name='animation-worker-recovery',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Animation worker pool started with {self.num_workers} workers")
+        return self
+
+    def stop(self, timeout=None):
+        """Ask workers to exit after their current job and wait for them"""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """Wake an idle worker because a new job was queued"""
+        with self._wakeup:
+            self._pending_wakeups += 1
+            self._wakeup.notify()
+
+    # ----------------------------------------
+    # Queue operations
+    # ----------------------------------------
+    def claim_next_job(self):
+        """
+        Atomically claim the oldest runnable queued job
+
+        Returns:
+            dict: Job row joined with avatar and expression, or None
+        """
+        now = datetime.now()
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT animation_id FROM animations
+                WHERE status = 'queued' AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+                ORDER BY animation_id
+                LIMIT 5
+            """, (now,))
+            candidates = [row['animation_id'] for row in cursor.fetchall()]
+
+            for animation_id in candidates:
+                # Only one worker can win the status transition
+                cursor.execute("""
+                    UPDATE animations
+                    SET status = 'processing', attempts = attempts + 1, progress = 0,
+                        started_at = %s, heartbeat_at = %s, worker_id = %s
+                    WHERE animation_id = %s AND status = 'queued'
+                """, (now, now, self.worker_name, animation_id))
+                db.commit()
+
+                if cursor.rowcount == 1:
+                    cursor.execute("""
+                        SELECT a.animation_id, a.user_id, a.attempts, a.animation_path,
+                               a.driving_video_path, a.result_key, e.expression_name,
+                               COALESCE(av.model_path, av.avatar_path) AS avatar_path
+                        FROM animations a
+                        JOIN avatars av ON a.avatar_id = av.avatar_id
+                        LEFT JOIN expressions e ON a.expression_id = e.expression_id
+                        WHERE a.animation_id = %s
+                    """, (animation_id,))
+                    return cursor.fetchone()
+        return None
+
+    def claim_next_ingest(self):
+        """
+        Atomically claim the oldest avatar waiting for ingest
+
+        Returns:
+            dict: avatar_id, user_id, avatar_path and size_bytes, or None
+        """
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT avatar_id, user_id, avatar_path, size_bytes FROM avatars
+                WHERE features_status = 'pending'
+                ORDER BY avatar_id
+                LIMIT 5
+            """)
+            for avatar in cursor.fetchall():
+                cursor.execute("""
+                    UPDATE avatars SET features_status = 'processing', ingest_started_at = %s
+                    WHERE avatar_id = %s AND features_status = 'pending'
+                """, (datetime.now(), avatar['avatar_id']))
+                db.commit()
+                if cursor.rowcount == 1:
+                    return avatar
+        return None
+
+    def claim_next_video(self):
+        """
+        Atomically claim the oldest finalized driving video upload
+
+        Returns:
+            dict: video_id, user_id, upload_path, upload_sha256 and size_bytes, or None
+        """
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT video_id, user_id, upload_path, upload_sha256, size_bytes FROM driving_videos
+                WHERE status = 'pending'
+                ORDER BY video_id
+                LIMIT 5
+            """)
+            for video in cursor.fetchall():
+                cursor.execute("""
+                    UPDATE driving_videos SET status = 'processing', ingest_started_at = %s
+                    WHERE video_id = %s AND status = 'pending'
+                """, (datetime.now(), video['video_id']))
+                db.commit()
+                if cursor.rowcount == 1:
+                    return video
+        return None
+
+    def recover_stale_jobs(self):
+        """Re-queue 'processing' jobs whose worker stopped sending heartbeats"""
+        cutoff = datetime.now() - timedelta(seconds=self.lease_timeout)
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE animations SET status = 'queued', next_attempt_at = NULL
+                WHERE status = 'processing'
+                  AND (COALESCE(heartbeat_at, started_at) IS NULL OR COALESCE(heartbeat_at, started_at) < %s)
+            """, (cutoff,))
+            requeued = cursor.rowcount
+            cursor.execute("""
+                UPDATE avatars SET features_status = 'pending'
+                WHERE features_status = 'processing' AND (ingest_started_at IS NULL OR ingest_started_at < %s)
+            """, (cutoff,))
+            cursor.execute("""
+                UPDATE driving_videos SET status = 'pending'
+                WHERE status = 'processing' AND (ingest_started_at IS NULL OR ingest_started_at < %s)
+            """, (cutoff,))
+            db.commit()
+            if requeued:
+                print(f"Re-queued {requeued} abandoned animation jobs")
+            return requeued
+
+    def queue_depth(self):
+        """Number of jobs waiting to be processed"""
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("SELECT COUNT(*) FROM animations WHERE status = 'queued'")
+            return cursor.fetchone()[0]
+
+    def register_metrics(self):
+        """Expose queue depth, connection pool, result cache and event bus stats on /metrics"""
+        register_collector('animation_queue', self._queue_families)
+        register_collector('db_pool', lambda: stats_families(
+            'db_pool', self.db_manager.stats(), counters=('created', 'discarded', 'timeouts'),
+            gauges=('pool_size', 'idle', 'in_use')))
+        register_collector('result_cache', lambda: stats_families(
+            'animation_result_cache', self.result_cache.stats(), counters=('hits', 'misses', 'evictions'),
+            ratio=('hits', 'misses')))
+        register_collector('job_events', lambda: stats_families(
+            'job_events', (self.event_bus or get_job_event_bus()).stats(), counters=('published',),
+            gauges=('subscribers',)))
+
+    def _queue_families(self):
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                SELECT status, COUNT(*) FROM animations
+                WHERE status IN ('queued', 'processing')
+                GROUP BY status
+            """)
+            counts = dict(cursor.fetchall())
+        return [('animation_queue_depth', 'gauge', 'Animation jobs waiting or running',
+                 [({'status': status}, counts.get(status, 0)) for status in ('queued', 'processing')])]
+
+    # ----------------------------------------
+    # Job execution
+    # ----------------------------------------
+    def process_job(self, job):
+        """Run one claimed job and record its outcome"""
+        animation_id = job['animation_id']
+        output_path = os.path.join(self.media_root, job['animation_path'])
+        avatar_path = os.path.join(self.media_root, job['avatar_path'])
+
+        if job['expression_name']:
+            task_type, expression_or_video = 'expression', job['expression_name']
+        else:
+            task_type = 'custom'
+            expression_or_video = os.path.join(self.media_root, job['driving_video_path'] or '')
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        self._publish(job, 'processing', progress=0)
+
+        def report_progress(percent):
+            # Doubles as the heartbeat that keeps the job's lease
+            self._update(animation_id, progress=int(percent), heartbeat_at=datetime.now())
+            self._publish(job, 'processing', progress=int(percent))
+
+        options = {}
+        preview = None
+        if self.live_preview:
+            try:
+                preview = options['frame_callback'] = PreviewWriter(animation_id)
+            except OSError as e:
+                print(f"Animation {animation_id} preview unavailable: {e}")
+
+        started = time.perf_counter()
+        try:
+            result = self._get_task_runner()(avatar_path, expression_or_video, output_path,
+                                             task_type=task_type,
+                                             progress_callback=report_progress,
+                                             **options)
+        except Exception as e:
+            result = {'status': 'failed', 'error': str(e)}
+        finally:
+            if preview is not None:
+                preview.close()
+
+        seconds = time.perf_counter() - started
+
+        # Per-stage timings and memory peaks (see pipeline_metrics)
+        metrics = json.dumps(result['metrics']) if result.get('metrics') else None
+
+        if result.get('status') == 'success':
+            record_job(result.get('metrics'), 'completed', seconds)
+            self._complete(job, metrics)
+            return result
+
+        self._retry_or_fail(job, result.get('error', 'Unknown error'), result.get('metrics'), seconds)
+        return result
+
+    def _retry_or_fail(self, job, error, metrics=None, seconds=0.0):
+        """Re-queue a failed job after its back-off delay, or fail it once retries are exhausted"""
+        animation_id = job['animation_id']
+
+        # Don't leave a half-written file behind
+        output_path = os.path.join(self.media_root, job['animation_path'])
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        stage_metrics = json.dumps(metrics) if metrics else None
+        if job['attempts'] < self.max_attempts:
+            record_job(metrics, 'retried', seconds)
+            delay = self.retry_backoff * (2 ** (job['attempts'] - 1))
+            self._update(animation_id, status='queued', progress=0, error_message=error,
+                         stage_metrics=stage_metrics,
+                         next_attempt_at=datetime.now() + timedelta(seconds=delay))
+            self._publish(job, 'queued', progress=0, error_message=error)
+            print(f"Animation {animation_id} failed (attempt {job['attempts']}), retrying in {delay}s: {error}")
+        else:
+            record_job(metrics, 'failed', seconds)
+            self._update(animation_id, status='failed', error_message=error,
+                         stage_metrics=stage_metrics, completed_at=datetime.now())
+            self._publish(job, 'failed', error_message=error)
+            print(f"Animation {animation_id} failed permanently: {error}")
+
+    def _complete(self, job, metrics=None):
+        """Mark a job completed and add its output to the result cache"""
+        animation_path = job['animation_path']
+
+        with self.db_manager.get_connection() as db:
+            if job['result_key']:
+                animation_path = self.result_cache.register(db, job['result_key'], animation_path)
+            size = file_size(os.path.join(self.media_root, animation_path))
+
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE animations
+                SET status = 'completed', progress = 100, completed_at = %s, error_message = NULL,
+                    animation_path = %s, stage_metrics = %s, size_bytes = %s
+                WHERE animation_id = %s
+            """, (datetime.now(), animation_path, metrics, size, job['animation_id']))
+            add_usage(cursor, job['user_id'], size)
+            db.commit()
+        self._publish(job, 'completed', progress=100)
+
+        if animation_path != job['animation_path']:
+            # An identical job finished first; share its file and drop ours
+            duplicate = os.path.join(self.media_root, job['animation_path'])
+            if os.path.exists(duplicate):
+                os.remove(duplicate)
+
+        if job['result_key']:
+            self.result_cache.evict()
+
+    def process_ingest(self, avatar):
+        """Precompute features for one claimed avatar and record the outcome"""
+        if self.ingest_runner is None:
+            from avatar_ingest import process_avatar_ingest
+            self.ingest_runner = process_avatar_ingest
+
+        try:
+            result = self.ingest_runner(os.path.join(self.media_root, avatar['avatar_path']))
+        except Exception as e:
+            result = {'status': 'failed', 'error': str(e)}
+
+        status = {'success': 'ready', 'invalid': 'invalid'}.get(result.get('status'), 'failed')
+        if status == 'failed':
+            # Animations still work; they compute source features themselves
+            print(f"Avatar {avatar['avatar_id']} ingest failed: {result.get('error')}")
+        elif status == 'invalid':
+            print(f"Avatar {avatar['avatar_id']} rejected: {result.get('error')}")
+
+        # The upload plus everything ingest wrote next to it
+        size = file_size(os.path.join(self.media_root, avatar['avatar_path']), result.get('thumbnail_path'),
+                         result.get('model_path'), result.get('features_path'))
+
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE avatars
+                SET features_status = %s, thumbnail_path = %s, model_path = %s, width = %s, height = %s,
+                    size_bytes = %s
+                WHERE avatar_id = %s
+            """, (status, self._media_path(result.get('thumbnail_path')),
+                  self._media_path(result.get('model_path')), result.get('width'), result.get('height'),
+                  size, avatar['avatar_id']))
+            add_usage(cursor, avatar['user_id'], size - (avatar['size_bytes'] or 0))
+            db.commit()
+        return result
+
+    def process_video(self, video):
+        """Transcode one claimed driving video upload and record the outcome"""
+        if self.video_runner is None:
+            from video_ingest import process_video_ingest
+            self.video_runner = process_video_ingest
+
+        upload_path = os.path.join(self.media_root, video['upload_path'])
+        stem = os.path.splitext(os.path.basename(upload_path))[0]
+        output_path = os.path.join(self.media_root, DRIVING_VIDEOS_DIR, f'{stem}_{VIDEO_SIZE}.mp4')
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        try:
+            result = self.video_runner(upload_path, output_path, video['upload_sha256'])
+        except Exception as e:
+            result = {'status': 'failed', 'error': str(e)}
+
+        status = {'success': 'ready', 'invalid': 'invalid'}.get(result.get('status'), 'failed')
+        if status != 'ready':
+            print(f"Driving video {video['video_id']} {status}: {result.get('error')}")
+            # Nothing will read the upload again
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+        size = file_size(result.get('video_path'))
+
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE driving_videos
+                SET status = %s, video_path = %s, fps = %s, duration = %s, width = %s, height = %s,
+                    error_message = %s, size_bytes = %s
+                WHERE video_id = %s
+            """, (status, self._media_path(result.get('video_path')), result.get('fps'),
+                  result.get('duration'), result.get('width'), result.get('height'),
+                  result.get('error'), size, video['video_id']))
+            add_usage(cursor, video['user_id'], size - (video['size_bytes'] or 0))
+            db.commit()
+        return result
+
+    def _media_path(self, path):
+        # Rows store paths relative to the media root
+        return os.path.relpath(path, self.media_root).replace(os.sep, '/') if path else None
+
+    def _get_task_runner(self):
+        if self.task_runner is None:
+            # Imported lazily so the web process never loads torch unless it runs jobs
+            from animation_generator import process_animation_task
+            self.task_runner = process_animation_task
+        return self.task_runner
+
+    def _publish(self, job, status, progress=None, error_message=None):
+        try:
+            (self.event_bus or get_job_event_bus()).publish(
+                job['user_id'], job_event(job['animation_id'], status, progress, error_message))
+        except Exception as e:
+            # Browsers fall back to the status endpoint; the job carries on
+            print(f"Job event error: {e}")
+
+    def _update(self, animation_id, **fields):
+        assignments = ', '.join(f'{name} = %s' for name in fields)
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute(f"UPDATE animations SET {assignments} WHERE animation_id = %s",
+                           (*fields.values(), animation_id))
+            db.commit()
+
+    def _abandon_job(self, job, error):
+        # The error may have come after the outcome was recorded
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("SELECT status FROM animations WHERE animation_id = %s", (job['animation_id'],))
+            row = cursor.fetchone()
+        if row and row[0] == 'processing':
+            self._retry_or_fail(job, error)
+
+    def _fail_ingest(self, avatar):
+        # Same outcome as a failed ingest runner; animations compute source features themselves
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE avatars SET features_status = 'failed'
+                WHERE avatar_id = %s AND features_status = 'processing'
+            """, (avatar['avatar_id'],))
+            db.commit()
+
+    def _fail_video(self, video, error):
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE driving_videos SET status = 'failed', error_message = %s
+                WHERE video_id = %s AND status = 'processing'
+            """, (error, video['video_id']))
+            db.commit()
+
+    def _release(self, handler, *args):
+        # Give up a claimed row after an unexpected error; if even that fails
+        # the row keeps its lease and recover_stale_jobs re-queues it
+        try:
+            handler(*args)
+        except Exception as e:
+            print(f"Animation worker error: {e}")
+
+    def _recover_periodically(self):
+        while not self._stopping.wait(self.recovery_interval):
+            try:
+                self.recover_stale_jobs()
+            except Exception as e:
+                print(f"Job recovery error: {e}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.claim_next_job()
+            except Exception as e:
+                print(f"Animation worker error: {e}")
+                job = None
+
+            if job is not None:
+                try:
+                    self.process_job(job)
+                except Exception as e:
+                    print(f"Animation {job['animation_id']} error: {e}")
+                    self._release(self._abandon_job, job, str(e))
+                continue
+
+            # Avatar ingest only runs when no animation is waiting
+            try:
+                avatar = self.claim_next_ingest()
+            except Exception as e:
+                print(f"Avatar ingest error: {e}")
+                avatar = None
+
+            if avatar is not None:
+                try:
+                    self.process_ingest(avatar)
+                except Exception as e:
+                    print(f"Avatar {avatar['avatar_id']} ingest error: {e}")
+                    self._release(self._fail_ingest, avatar)
+                continue
+
+            try:
+                video = self.claim_next_video()
+            except Exception as e:
+                print(f"Driving video ingest error: {e}")
+                video = None
+
+            if video is not None:
+                try:
+                    self.process_video(video)
+                except Exception as e:
+                    print(f"Driving video {video['video_id']} ingest error: {e}")
+                    self._release(self._fail_video, video, str(e))
+                continue
+
+            with self._wakeup:
+                if self._pending_wakeups == 0 and not self._stopping.is_set():
+                    self._wakeup.wait(self.poll_interval)
+                self._pending_wakeups = max(0, self._pending_wakeups - 1)
+
+
+def get_job_status(db, animation_id, user_id):
+    """
+    Look up the status of a user's animation job
+
+    Returns:
+        dict: Status fields, or None if the job doesn't exist or isn't theirs
+    """
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT animation_id, status, progress, attempts, error_message, animation_path,
+               created_at, started_at, completed_at, stage_metrics
+        FROM animations
+        WHERE animation_id = %s AND user_id = %s
+    """, (animation_id, user_id))
+    job = cursor.fetchone()
+    if job and isinstance(job['stage_metrics'], (str, bytes)):
+        job['stage_metrics'] = json.loads(job['stage_metrics'])
+    return job
+
+
+if __name__ == '__main__':
+    import argparse
+    from db_config import DatabaseConnection
+    from expression_catalog import ExpressionCatalog, set_expression_catalog
+
+    parser = argparse.ArgumentParser(description='Run animation generation workers')
+    parser.add_argument('--workers', type=int, default=2, help='Number of worker threads')
+    parser.add_argument('--media-root', default=MEDIA_ROOT, help='Folder holding avatars/, animations/ and driving videos')
+    parser.add_argument('--no-preload', action='store_true', help='Load the model on the first job instead of at startup')
+    parser.add_argument('--no-preview', action='store_true', help="Don't publish live preview frames")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve Prometheus metrics for this process on the port')
+    parser.add_argument('--reap-interval', type=int, default=REAP_INTERVAL,
+                        help='Seconds between storage reaper runs (0 disables it)')
+    args = parser.parse_args()
+
+    # One connection per worker thread, plus job recovery, the reaper and metrics
+    db_manager = DatabaseConnection(pool_size=args.workers + 3)
+    set_expression_catalog(ExpressionCatalog(db_manager))
+
+    pool = AnimationWorkerPool(db_manager, num_workers=args.workers, media_root=args.media_root,
+                               preload_models=not args.no_preload, live_preview=not args.no_preview)
+    reaper = StorageReaper(db_manager, media_root=args.media_root)
+    if args.metrics_port is not None:
+        from service_metrics import serve_metrics
+        pool.register_metrics()
+        reaper.register_metrics()
+        serve_metrics(args.metrics_port)
+    pool.start()
+
+    # The pool re-queues abandoned jobs itself; the main loop only runs the reaper
+    next_reap = time.monotonic() + 60
+    try:
+        while True:
+            time.sleep(60)
+            if args.reap_interval and time.monotonic() >= next_reap:
+                # On the main thread, so a long pass never holds up job threads
+                try:
+                    reaper.run()
+                except Exception as e:
+                    print(f"Storage reaper error: {e}")
+                next_reap = time.monotonic() + args.reap_interval
+    except KeyboardInterrupt:
+        print("Stopping animation workers...")
+        pool.stop()
@@ -1,492 +1,1257 @@
-from flask import Flask, render_template, request, jsonify, session, send_file, redirect, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from db_config import DatabaseConnection
-import os
-from datetime import datetime
-import uuid
-
-from werkzeug.security import generate_password_hash
-print(generate_password_hash('admin123'))
-
-
-app = Flask(__name__, 
-            static_folder='statics',
-            static_url_path='/static',
-            template_folder='templates')
-
-app.secret_key = 'your_secret_key_here_change_in_production'
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['AVATARS_FOLDER'] = 'static/avatars'
-app.config['ANIMATIONS_FOLDER'] = 'static/animations'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Ensure upload directories exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['AVATARS_FOLDER'], exist_ok=True)
-os.makedirs(app.config['ANIMATIONS_FOLDER'], exist_ok=True)
-
-ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov'}
-
-def allowed_file(filename, allowed_extensions):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
-
-def get_db():
-    return DatabaseConnection().get_connection()
-
-# ============================================
-# MAIN ROUTES (HTML Pages)
-# ============================================
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/login')
-def login_page():
-    return render_template('login.html')
-
-@app.route('/signup')
-def signup_page():
-    return render_template('signup.html')
-
-@app.route('/user')
-def user_dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login_page'))
-    if session.get('role') not in ['user', 'subscriber', 'admin']:
-        return redirect(url_for('login_page'))
-    return render_template('user.html')
-
-@app.route('/subscriber')
-def subscriber_dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login_page'))
-    if session.get('role') not in ['subscriber', 'admin']:
-        return redirect(url_for('login_page'))
-    return render_template('subscriber.html')
-
-@app.route('/admin')
-def admin_dashboard():
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return redirect(url_for('login_page'))
-    return render_template('admin.html')
-
-# ============================================
-# API ENDPOINTS
-# ============================================
-@app.route('/api/signup', methods=['POST'])
-def api_signup():
-    try:
-        data = request.get_json()
-        fullname = data.get('fullname')
-        email = data.get('email')
-        password = data.get('password')
-        
-        if not all([fullname, email, password]):
-            return jsonify({'success': False, 'message': 'All fields are required'}), 400
-        
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Check if email exists
-        cursor.execute("SELECT user_id FROM users WHERE email = %s", (email,))
-        if cursor.fetchone():
-            cursor.close()
-            db.close()
-            return jsonify({'success': False, 'message': 'Email already exists'}), 400
-        
-        # Insert new user
-        hashed_password = generate_password_hash(password)
-        cursor.execute(
-            "INSERT INTO users (fullname, email, password, role) VALUES (%s, %s, %s, %s)",
-            (fullname, email, hashed_password, 'user')
-        )
-        db.commit()
-        cursor.close()
-        db.close()
-        
-        return jsonify({'success': True, 'message': 'Account created successfully'})
-    
-    except Exception as e:
-        print(f"Signup error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/api/login', methods=['POST'])
-def api_login():
-    try:
-        data = request.get_json()
-        email = data.get('email')
-        password = data.get('password')
-        
-        if not all([email, password]):
-            return jsonify({'success': False, 'message': 'Email and password required'}), 400
-        
-        db = get_db()
-        cursor = db.cursor(dictionary=True)
-        
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-        user = cursor.fetchone()
-        
-        cursor.close()
-        db.close()
-        
-        if not user or not check_password_hash(user['password'], password):
-            return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
-        
-        # Create session
-        session['user_id'] = user['user_id']
-        session['email'] = user['email']
-        session['fullname'] = user['fullname']
-        session['role'] = user['role']
-        
-        return jsonify({
-            'success': True,
-            'message': 'Login successful',
-            'role': user['role'],
-            'redirect': url_for(f'{user["role"]}_dashboard') if user['role'] != 'user' else url_for('user_dashboard')
-        })
-    
-    except Exception as e:
-        print(f"Login error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/api/logout', methods=['POST'])
-def api_logout():
-    session.clear()
-    return jsonify({'success': True, 'message': 'Logged out successfully'})
-
-@app.route('/api/profile', methods=['GET', 'PUT'])
-def api_profile():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    try:
-        if request.method == 'GET':
-            cursor.execute("SELECT user_id, fullname, email, role, subscription_status FROM users WHERE user_id = %s", 
-                         (session['user_id'],))
-            user = cursor.fetchone()
-            return jsonify({'success': True, 'user': user})
-        
-        elif request.method == 'PUT':
-            data = request.get_json()
-            fullname = data.get('fullname')
-            email = data.get('email')
-            
-            cursor.execute(
-                "UPDATE users SET fullname = %s, email = %s WHERE user_id = %s",
-                (fullname, email, session['user_id'])
-            )
-            db.commit()
-            
-            session['fullname'] = fullname
-            session['email'] = email
-            
-            return jsonify({'success': True, 'message': 'Profile updated'})
-    
-    except Exception as e:
-        print(f"Profile error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/avatar/upload', methods=['POST'])
-def upload_avatar():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    if 'avatar' not in request.files:
-        return jsonify({'success': False, 'message': 'No file provided'}), 400
-    
-    file = request.files['avatar']
-    
-    if file.filename == '':
-        return jsonify({'success': False, 'message': 'No file selected'}), 400
-    
-    if file and allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS):
-        filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-        filepath = os.path.join(app.config['AVATARS_FOLDER'], filename)
-        file.save(filepath)
-        
-        db = get_db()
-        cursor = db.cursor()
-        
-        try:
-            cursor.execute(
-                "INSERT INTO avatars (user_id, avatar_path) VALUES (%s, %s)",
-                (session['user_id'], f'avatars/{filename}')
-            )
-            db.commit()
-            
-            avatar_id = cursor.lastrowid
-            
-            return jsonify({
-                'success': True,
-                'message': 'Avatar uploaded successfully',
-                'avatar_id': avatar_id,
-                'avatar_path': f'avatars/{filename}'
-            })
-        
-        except Exception as e:
-            print(f"Avatar upload error: {e}")
-            return jsonify({'success': False, 'message': str(e)}), 500
-        finally:
-            cursor.close()
-            db.close()
-    
-    return jsonify({'success': False, 'message': 'Invalid file type'}), 400
-
-@app.route('/api/avatars', methods=['GET'])
-def get_avatars():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    try:
-        if session.get('role') == 'admin':
-            cursor.execute("SELECT * FROM avatars ORDER BY created_at DESC")
-        else:
-            cursor.execute("SELECT * FROM avatars WHERE user_id = %s ORDER BY created_at DESC", 
-                         (session['user_id'],))
-        
-        avatars = cursor.fetchall()
-        return jsonify({'success': True, 'avatars': avatars})
-    
-    except Exception as e:
-        print(f"Get avatars error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/avatar/<int:avatar_id>', methods=['DELETE'])
-def delete_avatar(avatar_id):
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    try:
-        cursor.execute("SELECT * FROM avatars WHERE avatar_id = %s AND user_id = %s", 
-                     (avatar_id, session['user_id']))
-        avatar = cursor.fetchone()
-        
-        if not avatar:
-            return jsonify({'success': False, 'message': 'Avatar not found'}), 404
-        
-        filepath = os.path.join('static', avatar['avatar_path'])
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
-        cursor.execute("DELETE FROM avatars WHERE avatar_id = %s", (avatar_id,))
-        db.commit()
-        
-        return jsonify({'success': True, 'message': 'Avatar deleted'})
-    
-    except Exception as e:
-        print(f"Delete avatar error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/expressions', methods=['GET'])
-def get_expressions():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    try:
-        cursor.execute("SELECT * FROM expressions ORDER BY expression_name")
-        expressions = cursor.fetchall()
-        return jsonify({'success': True, 'expressions': expressions})
-    
-    except Exception as e:
-        print(f"Get expressions error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/animation/generate', methods=['POST'])
-def generate_animation():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    data = request.get_json()
-    avatar_id = data.get('avatar_id')
-    expression_id = data.get('expression_id')
-    
-    if not all([avatar_id, expression_id]):
-        return jsonify({'success': False, 'message': 'Avatar and expression required'}), 400
-    
-    db = get_db()
-    cursor = db.cursor()
-    
-    try:
-        animation_path = f'animations/animation_{uuid.uuid4()}.mp4'
-        
-        cursor.execute(
-            "INSERT INTO animations (user_id, avatar_id, expression_id, animation_path, status) VALUES (%s, %s, %s, %s, %s)",
-            (session['user_id'], avatar_id, expression_id, animation_path, 'processing')
-        )
-        db.commit()
-        
-        animation_id = cursor.lastrowid
-        
-        # TODO: Call First Order Model processing here
-        cursor.execute("UPDATE animations SET status = %s WHERE animation_id = %s", 
-                     ('completed', animation_id))
-        db.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Animation generated',
-            'animation_id': animation_id,
-            'animation_path': animation_path
-        })
-    
-    except Exception as e:
-        print(f"Generate animation error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/animations', methods=['GET'])
-def get_animations():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    try:
-        cursor.execute("""
-            SELECT a.*, av.avatar_path, e.expression_name 
-            FROM animations a
-            JOIN avatars av ON a.avatar_id = av.avatar_id
-            LEFT JOIN expressions e ON a.expression_id = e.expression_id
-            WHERE a.user_id = %s
-            ORDER BY a.created_at DESC
-        """, (session['user_id'],))
-        
-        animations = cursor.fetchall()
-        return jsonify({'success': True, 'animations': animations})
-    
-    except Exception as e:
-        print(f"Get animations error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/subscription/update', methods=['POST'])
-def update_subscription():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    data = request.get_json()
-    plan = data.get('plan')
-    
-    db = get_db()
-    cursor = db.cursor()
-    
-    try:
-        cursor.execute(
-            "UPDATE users SET role = %s, subscription_status = %s WHERE user_id = %s",
-            ('subscriber', 'active', session['user_id'])
-        )
-        db.commit()
-        
-        session['role'] = 'subscriber'
-        
-        return jsonify({'success': True, 'message': 'Subscription updated'})
-    
-    except Exception as e:
-        print(f"Update subscription error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/admin/users', methods=['GET'])
-def admin_get_users():
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    try:
-        cursor.execute("SELECT user_id, fullname, email, role, subscription_status, created_at FROM users")
-        users = cursor.fetchall()
-        return jsonify({'success': True, 'users': users})
-    
-    except Exception as e:
-        print(f"Get users error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-@app.route('/api/admin/user/<int:user_id>', methods=['PUT', 'DELETE'])
-def admin_manage_user(user_id):
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-    
-    db = get_db()
-    cursor = db.cursor()
-    
-    try:
-        if request.method == 'PUT':
-            data = request.get_json()
-            action = data.get('action')
-            
-            if action == 'suspend':
-                cursor.execute("UPDATE users SET subscription_status = %s WHERE user_id = %s", 
-                             ('suspended', user_id))
-            elif action == 'activate':
-                cursor.execute("UPDATE users SET subscription_status = %s WHERE user_id = %s", 
-                             ('active', user_id))
-            
-            db.commit()
-            return jsonify({'success': True, 'message': 'User updated'})
-        
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
-            db.commit()
-            return jsonify({'success': True, 'message': 'User deleted'})
-    
-    except Exception as e:
-        print(f"Manage user error: {e}")
-        return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        cursor.close()
-        db.close()
-
-# Error handlers
-@app.errorhandler(404)
-def not_found(e):
-    return render_template('index.html'), 404
-
-@app.errorhandler(500)
-def internal_error(e):
-    return jsonify({'success': False, 'message': 'Internal server error'}), 500
-
-if __name__ == '__main__':
-    print("\n" + "="*60)
-    print("Face Animation Platform Starting...")
-    print("="*60)
-    print(f"Server running at: http://localhost:5000")
-    print(f"Static folder: {app.static_folder}")
-    print(f"Template folder: {app.template_folder}")
-    print("="*60 + "\n")
-    
-    app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
+"""
+Face Animation Platform web application
+
+Build an app with the factory, e.g. ``flask --app app run`` or
+``gunicorn 'app:create_app()'``; pick the settings with APP_CONFIG (see
+config.py). Importing this module only defines routes: the database pool,
+caches and workers are created by create_app(), and the model stack (torch
+and the First Order Model) is only ever imported by the processes that run
+animation jobs.
+"""
+
+from flask import (Blueprint, Flask, render_template, request, jsonify, session, send_file, redirect,
+                   url_for, Response, g, current_app)
+from werkzeug.utils import secure_filename
+from db_config import DatabaseConnection, sqlite_schema
+from animation_worker import AnimationWorkerPool, get_job_status
+from result_cache import ResultCache, driving_video_result_key, expression_result_key
+from content_hash import file_hash
+from avatar_ingest import features_path, sniff_image_format
+from video_ingest import (ChunkChecksumError, ChunkConflictError, locked_upload, parse_checksum,
+                          sniff_video_format, write_chunk)
+from expression_catalog import ExpressionCatalog, set_expression_catalog
+from preview_stream import BOUNDARY, iter_preview_frames, mjpeg_stream
+from job_events import JobStatusRelay, get_job_event_bus, job_event, format_sse
+from model_registry import get_model_registry
+from service_metrics import CONTENT_TYPE, REQUEST_LATENCY, get_metrics_registry, register_collector, stats_families
+from password_hashing import HashingBusyError, HashingTimeoutError, PasswordHasher
+from media_storage import QuotaExceededError, add_usage, check_quota, file_size
+from config import CONFIGS
+import os
+import time
+from datetime import datetime
+import uuid
+import base64
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database_schema.sql')
+
+bp = Blueprint('main', __name__)
+
+
+class Services:
+    def __init__(self, config):
+        """
+        Database pool, caches and worker pool shared by one app's requests
+        
+        Nothing here connects or starts threads yet: connections open on
+        first checkout and inline workers start with the first queued job.
+        """
+        if config['SQLITE_PATH']:
+            # Only a new file needs the tables and seed rows
+            schema = None
+            if not os.path.exists(config['SQLITE_PATH']):
+                with open(SCHEMA_PATH) as f:
+                    schema = sqlite_schema(f.read())
+            self.db_manager = DatabaseConnection.sqlite(config['SQLITE_PATH'], schema=schema,
+                                                        pool_size=config['DB_POOL_SIZE'],
+                                                        wait_timeout=config['DB_POOL_TIMEOUT'])
+        else:
+            self.db_manager = DatabaseConnection(pool_size=config['DB_POOL_SIZE'],
+                                                 wait_timeout=config['DB_POOL_TIMEOUT'])
+        
+        self.result_cache = ResultCache(self.db_manager, media_root=config['MEDIA_ROOT'],
+                                        max_bytes=config['RESULT_CACHE_MAX_BYTES'])
+        # Expressions are served from memory and resolved to driving videos through the same catalog
+        self.expression_catalog = ExpressionCatalog(self.db_manager)
+        self.worker_pool = AnimationWorkerPool(self.db_manager, num_workers=config['ANIMATION_WORKERS'],
+                                               media_root=config['MEDIA_ROOT'],
+                                               result_cache=self.result_cache)
+        # Workers in other processes can't reach this process's event bus; one relay
+        # per process publishes their job changes to it instead
+        self.job_relay = None if config['ANIMATION_WORKERS_INLINE'] else JobStatusRelay(
+            self.db_manager, interval=config['EVENTS_POLL_INTERVAL'])
+        # Signup and login hash on their own bounded pool, off the request threads
+        self.password_hasher = PasswordHasher(workers=config['PASSWORD_HASH_WORKERS'],
+                                              max_queue=config['PASSWORD_HASH_QUEUE'],
+                                              timeout=config['PASSWORD_HASH_TIMEOUT'],
+                                              method=config['PASSWORD_HASH_METHOD'])
+
+
+def create_app(config=None, **overrides):
+    """
+    Build the Flask application
+    
+    Args:
+        config: Settings class or its name in config.CONFIGS
+                (default: APP_CONFIG environment variable, else development)
+        overrides: Individual settings replacing the class values,
+                   e.g. SQLITE_PATH='load_test.db'
+    
+    Returns:
+        Flask: App with its Services in ``app.extensions['face_animation']``
+    """
+    app = Flask(__name__, 
+                static_folder='statics',
+                static_url_path='/static',
+                template_folder='templates')
+    
+    if config is None or isinstance(config, str):
+        config = CONFIGS[config or os.environ.get('APP_CONFIG', 'development')]
+    app.config.from_object(config)
+    app.config.update(overrides)
+    
+    app_services = app.extensions['face_animation'] = Services(app.config)
+    set_expression_catalog(app_services.expression_catalog)
+    get_model_registry().backend = app.config['ANIMATION_BACKEND']
+    app_services.worker_pool.register_metrics()
+    register_collector('password_hasher', lambda: stats_families(
+        'password_hash', app_services.password_hasher.stats(),
+        counters=('completed', 'rejected', 'timeouts', 'rehashed'), gauges=('workers', 'max_queue')))
+    
+    app.register_blueprint(bp)
+    return app
+
+def services():
+    """The current app's database pool, caches and worker pool"""
+    return current_app.extensions['face_animation']
+
+def get_db():
+    """Check out a pooled connection; use as ``with get_db() as db:``"""
+    return services().db_manager.get_connection()
+
+def notify_workers():
+    """Start in-process workers on first use and wake one for a new job"""
+    if current_app.config['ANIMATION_WORKERS_INLINE']:
+        worker_pool = services().worker_pool
+        worker_pool.start()
+        worker_pool.notify()
+
+def hashing_unavailable(e):
+    """429 while the password hashing queue is full, 503 if a hash timed out"""
+    if isinstance(e, HashingBusyError):
+        response = jsonify({'success': False, 'message': 'Too many requests, please try again shortly'})
+        response.status_code = 429
+    else:
+        response = jsonify({'success': False, 'message': 'Service busy, please try again shortly'})
+        response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def storage_quota():
+    """Byte quota for the signed-in user's role, or None for unlimited"""
+    return current_app.config['STORAGE_QUOTAS'].get(session.get('role'))
+
+def quota_exceeded(e):
+    """403 with the user's usage when an upload or job would exceed their storage quota"""
+    return jsonify({'success': False, 'message': 'Storage quota exceeded',
+                    'storage_bytes': e.used, 'storage_quota': e.quota}), 403
+
+ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov'}
+DRIVING_VIDEO_COLUMNS = ("video_id, video_name, upload_size, upload_offset, video_path, fps, duration, "
+                         "width, height, size_bytes, status, error_message, created_at")
+
+def allowed_file(filename, allowed_extensions):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+def encode_cursor(created_at, row_id):
+    """Opaque cursor for the last row of a page"""
+    raw = f"{created_at}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def parse_page_args():
+    """
+    Read ?limit= and ?cursor= for keyset pagination
+    
+    Returns:
+        tuple: (limit, (created_at, id) of the last row seen or None)
+    
+    Raises:
+        ValueError: If the cursor or limit is malformed
+    """
+    limit = min(max(int(request.args.get('limit', current_app.config['PAGE_SIZE'])), 1),
+                current_app.config['MAX_PAGE_SIZE'])
+    
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return limit, None
+    
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+    return limit, (created_at, int(row_id))
+
+def keyset_page(cursor, query, params, after, limit, id_column, id_key):
+    """
+    Run one page of a newest-first keyset query
+    
+    Args:
+        cursor: DB cursor (dictionary=True)
+        query: SELECT ... WHERE <filters> with a {keyset} placeholder for the
+               extra condition, without ORDER BY or LIMIT
+        params: Parameters for the filters
+        after: (created_at, id) from parse_page_args, or None
+        limit: Rows per page
+        id_column: Qualified id column used as tie-breaker, e.g. 'a.animation_id'
+        id_key: Name of the id in the result rows
+    
+    Returns:
+        tuple: (rows, next_cursor or None)
+    """
+    created_column = id_column.rsplit('.', 1)[0] + '.created_at' if '.' in id_column else 'created_at'
+    keyset = ''
+    if after:
+        keyset = f"AND ({created_column} < %s OR ({created_column} = %s AND {id_column} < %s))"
+        params = (*params, after[0], after[0], after[1])
+    
+    # One extra row tells us whether another page exists
+    cursor.execute(f"{query.format(keyset=keyset)} ORDER BY {created_column} DESC, {id_column} DESC LIMIT %s",
+                   (*params, limit + 1))
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1][id_key])
+    return rows, next_cursor
+
+# ============================================
+# METRICS
+# ============================================
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Streams (SSE, MJPEG) are timed to their first byte
+        REQUEST_LATENCY.observe(time.perf_counter() - started,
+                                endpoint=request.endpoint or 'unmatched',
+                                method=request.method, status=response.status_code)
+    return response
+
+@bp.route('/metrics')
+def metrics():
+    """Prometheus text format; see service_metrics"""
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'success': False, 'message': 'Not found'}), 404
+    return Response(get_metrics_registry().render(), mimetype=None, content_type=CONTENT_TYPE)
+
+# ============================================
+# MAIN ROUTES (HTML Pages)
+# ============================================
+@bp.route('/')
+def index():
+    return render_template('index.html')
+
+@bp.route('/login')
+def login_page():
+    return render_template('login.html')
+
+@bp.route('/signup')
+def signup_page():
+    return render_template('signup.html')
+
+@bp.route('/user')
+def user_dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('.login_page'))
+    if session.get('role') not in ['user', 'subscriber', 'admin']:
+        return redirect(url_for('.login_page'))
+    return render_template('user.html')
+
+@bp.route('/subscriber')
+def subscriber_dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('.login_page'))
+    if session.get('role') not in ['subscriber', 'admin']:
+        return redirect(url_for('.login_page'))
+    return render_template('subscriber.html')
+
+@bp.route('/admin')
+def admin_dashboard():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('.login_page'))
+    return render_template('admin.html')
+
+# ============================================
+# API ENDPOINTS
+# ============================================
+@bp.route('/api/signup', methods=['POST'])
+def api_signup():
+    try:
+        data = request.get_json()
+        fullname = data.get('fullname')
+        email = data.get('email')
+        password = data.get('password')
+        
+        if not all([fullname, email, password]):
+            return jsonify({'success': False, 'message': 'All fields are required'}), 400
+        
+        # Hash before checking out a connection, so a queued hash doesn't hold one
+        hashed_password = services().password_hasher.hash(password)
+        
+        with get_db() as db:
+            cursor = db.cursor()
+            
+            # Check if email exists
+            cursor.execute("SELECT user_id FROM users WHERE email = %s", (email,))
+            if cursor.fetchone():
+                return jsonify({'success': False, 'message': 'Email already exists'}), 400
+            
+            # Insert new user
+            cursor.execute(
+                "INSERT INTO users (fullname, email, password, role) VALUES (%s, %s, %s, %s)",
+                (fullname, email, hashed_password, 'user')
+            )
+            db.commit()
+        
+        return jsonify({'success': True, 'message': 'Account created successfully'})
+    
+    except (HashingBusyError, HashingTimeoutError) as e:
+        return hashing_unavailable(e)
+    except Exception as e:
+        print(f"Signup error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/login', methods=['POST'])
+def api_login():
+    try:
+        data = request.get_json()
+        email = data.get('email')
+        password = data.get('password')
+        
+        if not all([email, password]):
+            return jsonify({'success': False, 'message': 'Email and password required'}), 400
+        
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+            user = cursor.fetchone()
+        
+        hasher = services().password_hasher
+        if not user or not hasher.verify(user['password'], password):
+            return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
+        
+        try:
+            # Hashes made with older parameters are upgraded while the password is at hand
+            new_hash = hasher.upgrade(user['password'], password)
+            if new_hash:
+                with get_db() as db:
+                    cursor = db.cursor()
+                    cursor.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s",
+                                   (new_hash, user['user_id'], user['password']))
+                    db.commit()
+        except Exception as e:
+            # The old hash still works; try again at the next login
+            print(f"Password rehash error: {e}")
+        
+        # Create session
+        session['user_id'] = user['user_id']
+        session['email'] = user['email']
+        session['fullname'] = user['fullname']
+        session['role'] = user['role']
+        
+        return jsonify({
+            'success': True,
+            'message': 'Login successful',
+            'role': user['role'],
+            'redirect': url_for(f'.{user["role"]}_dashboard') if user['role'] != 'user' else url_for('.user_dashboard')
+        })
+    
+    except (HashingBusyError, HashingTimeoutError) as e:
+        return hashing_unavailable(e)
+    except Exception as e:
+        print(f"Login error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/logout', methods=['POST'])
+def api_logout():
+    session.clear()
+    return jsonify({'success': True, 'message': 'Logged out successfully'})
+
+@bp.route('/api/profile', methods=['GET', 'PUT'])
+def api_profile():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            
+            if request.method == 'GET':
+                cursor.execute("SELECT user_id, fullname, email, role, subscription_status, storage_bytes FROM users WHERE user_id = %s", 
+                             (session['user_id'],))
+                user = cursor.fetchone()
+                if user:
+                    user['storage_quota'] = storage_quota()
+                return jsonify({'success': True, 'user': user})
+            
+            elif request.method == 'PUT':
+                data = request.get_json()
+                fullname = data.get('fullname')
+                email = data.get('email')
+                
+                cursor.execute(
+                    "UPDATE users SET fullname = %s, email = %s WHERE user_id = %s",
+                    (fullname, email, session['user_id'])
+                )
+                db.commit()
+                
+                session['fullname'] = fullname
+                session['email'] = email
+                
+                return jsonify({'success': True, 'message': 'Profile updated'})
+    
+    except Exception as e:
+        print(f"Profile error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/avatar/upload', methods=['POST'])
+def upload_avatar():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    if 'avatar' not in request.files:
+        return jsonify({'success': False, 'message': 'No file provided'}), 400
+    
+    file = request.files['avatar']
+    
+    if file.filename == '':
+        return jsonify({'success': False, 'message': 'No file selected'}), 400
+    
+    if file and allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS):
+        # Reject obvious non-images now; a worker decodes and verifies the whole file
+        if sniff_image_format(file.stream.read(16)) is None:
+            return jsonify({'success': False, 'message': 'File is not a supported image'}), 400
+        file.stream.seek(0)
+        
+        filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
+        os.makedirs(current_app.config['AVATARS_FOLDER'], exist_ok=True)
+        filepath = os.path.join(current_app.config['AVATARS_FOLDER'], filename)
+        file.save(filepath)
+        
+        try:
+            # Content hash lets identical images share cached animations
+            content_hash = file_hash(filepath)
+            size = os.path.getsize(filepath)
+            
+            with get_db() as db:
+                try:
+                    check_quota(db, session['user_id'], storage_quota(), size)
+                except QuotaExceededError as e:
+                    os.remove(filepath)
+                    return quota_exceeded(e)
+                
+                cursor = db.cursor()
+                cursor.execute(
+                    "INSERT INTO avatars (user_id, avatar_path, content_hash, size_bytes) VALUES (%s, %s, %s, %s)",
+                    (session['user_id'], f'avatars/{filename}', content_hash, size)
+                )
+                add_usage(cursor, session['user_id'], size)
+                db.commit()
+                
+                avatar_id = cursor.lastrowid
+            
+            # Workers precompute the avatar's source features in the background
+            notify_workers()
+            
+            return jsonify({
+                'success': True,
+                'message': 'Avatar uploaded successfully',
+                'avatar_id': avatar_id,
+                'avatar_path': f'avatars/{filename}'
+            })
+        
+        except Exception as e:
+            print(f"Avatar upload error: {e}")
+            return jsonify({'success': False, 'message': str(e)}), 500
+    
+    return jsonify({'success': False, 'message': 'Invalid file type'}), 400
+
+@bp.route('/api/avatars', methods=['GET'])
+def get_avatars():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        limit, after = parse_page_args()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid page cursor'}), 400
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            columns = ("avatar_id, user_id, avatar_path, thumbnail_path, model_path, width, height, "
+                       "avatar_name, features_status, created_at")
+            
+            if session.get('role') == 'admin':
+                avatars, next_cursor = keyset_page(
+                    cursor, f"SELECT {columns} FROM avatars WHERE 1 = 1 {{keyset}}", (),
+                    after, limit, 'avatar_id', 'avatar_id')
+            else:
+                avatars, next_cursor = keyset_page(
+                    cursor, f"SELECT {columns} FROM avatars WHERE user_id = %s {{keyset}}",
+                    (session['user_id'],), after, limit, 'avatar_id', 'avatar_id')
+        
+        return jsonify({'success': True, 'avatars': avatars, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        print(f"Get avatars error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/avatar/<int:avatar_id>', methods=['DELETE'])
+def delete_avatar(avatar_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM avatars WHERE avatar_id = %s AND user_id = %s", 
+                         (avatar_id, session['user_id']))
+            avatar = cursor.fetchone()
+            
+            if not avatar:
+                return jsonify({'success': False, 'message': 'Avatar not found'}), 404
+            
+            media_root = current_app.config['MEDIA_ROOT']
+            paths = [os.path.join(media_root, avatar['avatar_path'])]
+            for derivative in (avatar['thumbnail_path'], avatar['model_path']):
+                if derivative:
+                    paths.append(os.path.join(media_root, derivative))
+            for path in paths + [features_path(path) for path in paths]:
+                if os.path.exists(path):
+                    os.remove(path)
+            
+            # Animations cascade with the avatar: release their shared result files
+            # and remove the ones that only they used. Only completed rows hold a
+            # reference; queued and failed rows carry the key they will register
+            cursor.execute("SELECT animation_path, status, result_key, size_bytes FROM animations WHERE avatar_id = %s",
+                         (avatar_id,))
+            animations = cursor.fetchall()
+            result_keys = [row['result_key'] for row in animations
+                           if row['result_key'] and row['status'] == 'completed']
+            for row in animations:
+                if (row['result_key'] and row['status'] == 'completed') or row['status'] == 'processing':
+                    continue  # Shared, or still being written; the storage reaper handles the latter
+                path = os.path.join(media_root, row['animation_path'])
+                if os.path.exists(path):
+                    os.remove(path)
+            
+            cursor.execute("DELETE FROM avatars WHERE avatar_id = %s", (avatar_id,))
+            services().result_cache.release(db, result_keys)
+            add_usage(cursor, session['user_id'],
+                      -((avatar['size_bytes'] or 0) + sum(row['size_bytes'] or 0 for row in animations)))
+            db.commit()
+        
+        services().result_cache.evict()
+        
+        return jsonify({'success': True, 'message': 'Avatar deleted'})
+    
+    except Exception as e:
+        print(f"Delete avatar error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def upload_progress(video, status=200):
+    """Response for an upload's current state, with its offset also in Upload-Offset"""
+    response = jsonify({'success': status < 400, 'video': video, 'offset': video['upload_offset']})
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(video['upload_offset'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@bp.route('/api/driving-videos', methods=['POST'])
+def create_driving_video_upload():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    size = data.get('size')
+    
+    if not allowed_file(filename, ALLOWED_VIDEO_EXTENSIONS):
+        return jsonify({'success': False, 'message': 'Invalid file type'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'success': False, 'message': 'File size required'}), 400
+    if size > current_app.config['DRIVING_VIDEO_MAX_BYTES']:
+        return jsonify({'success': False, 'message': 'Video is too large'}), 413
+    try:
+        # Optional; the worker checks the assembled file against it
+        sha256 = parse_checksum(f"sha256 {data['sha256']}") if data.get('sha256') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid sha256'}), 400
+    
+    stored_name = secure_filename(f"{uuid.uuid4()}_{filename}")
+    os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_name)
+    
+    try:
+        # Chunks are written into this file at their offsets
+        open(upload_path, 'xb').close()
+        
+        with get_db() as db:
+            # Checked against the declared size, before any chunk arrives
+            try:
+                check_quota(db, session['user_id'], storage_quota(), size)
+            except QuotaExceededError as e:
+                os.remove(upload_path)
+                return quota_exceeded(e)
+            
+            cursor = db.cursor()
+            cursor.execute(
+                "INSERT INTO driving_videos (user_id, video_name, upload_path, upload_size, upload_sha256) VALUES (%s, %s, %s, %s, %s)",
+                (session['user_id'], filename[:255], f'uploads/{stored_name}', size, sha256)
+            )
+            db.commit()
+            video_id = cursor.lastrowid
+        
+        response = jsonify({
+            'success': True,
+            'video_id': video_id,
+            'offset': 0,
+            'size': size,
+            'max_chunk_bytes': current_app.config['UPLOAD_CHUNK_MAX_BYTES']
+        })
+        response.status_code = 201
+        response.headers['Location'] = url_for('.driving_video_upload', video_id=video_id)
+        return response
+    
+    except Exception as e:
+        print(f"Driving video upload error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/driving-videos', methods=['GET'])
+def get_driving_videos():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        limit, after = parse_page_args()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid page cursor'}), 400
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            videos, next_cursor = keyset_page(cursor, f"""
+                SELECT {DRIVING_VIDEO_COLUMNS} FROM driving_videos
+                WHERE user_id = %s {{keyset}}
+            """, (session['user_id'],), after, limit, 'video_id', 'video_id')
+        
+        return jsonify({'success': True, 'driving_videos': videos, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        print(f"Get driving videos error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/driving-videos/<int:video_id>', methods=['GET', 'PATCH', 'DELETE'])
+def driving_video_upload(video_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+        except (KeyError, ValueError):
+            return jsonify({'success': False, 'message': 'Upload-Offset and a valid Upload-Checksum are required'}), 400
+        if (request.content_length or 0) > current_app.config['UPLOAD_CHUNK_MAX_BYTES']:
+            return jsonify({'success': False, 'message': 'Chunk is too large'}), 413
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute(f"SELECT {DRIVING_VIDEO_COLUMNS}, upload_path FROM driving_videos WHERE video_id = %s AND user_id = %s",
+                         (video_id, session['user_id']))
+            video = cursor.fetchone()
+            
+            if not video:
+                return jsonify({'success': False, 'message': 'Driving video not found'}), 404
+            
+            if request.method == 'DELETE':
+                media_root = current_app.config['MEDIA_ROOT']
+                for path in (video['upload_path'], video['video_path']):
+                    if path and os.path.exists(os.path.join(media_root, path)):
+                        os.remove(os.path.join(media_root, path))
+                cursor.execute("DELETE FROM driving_videos WHERE video_id = %s", (video_id,))
+                add_usage(cursor, session['user_id'], -(video['size_bytes'] or 0))
+                db.commit()
+                return jsonify({'success': True, 'message': 'Driving video deleted'})
+        
+        upload_path = os.path.join(current_app.config['MEDIA_ROOT'], video.pop('upload_path'))
+        if request.method == 'GET':
+            return upload_progress(video)
+        
+        if video['status'] != 'uploading':
+            return jsonify({'success': False, 'message': 'Upload already finalized'}), 409
+        
+        # The lock keeps another request for this upload out until the new offset is recorded
+        with locked_upload(upload_path) as f:
+            with get_db() as db:
+                cursor = db.cursor(dictionary=True)
+                cursor.execute("SELECT upload_offset, size_bytes FROM driving_videos WHERE video_id = %s",
+                             (video_id,))
+                video.update(cursor.fetchone())
+            
+            if offset != video['upload_offset']:
+                # The client resumes from the offset we return
+                return upload_progress(video, 409)
+            
+            # No connection is held while the chunk streams in
+            remaining = video['upload_size'] - offset
+            try:
+                written = write_chunk(f, offset, request.stream,
+                                      min(remaining, current_app.config['UPLOAD_CHUNK_MAX_BYTES']), checksum)
+            except ChunkChecksumError as e:
+                return jsonify({'success': False, 'message': str(e), 'offset': offset}), 422
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e), 'offset': offset}), 413
+            
+            with get_db() as db:
+                cursor = db.cursor()
+                cursor.execute(
+                    "UPDATE driving_videos SET upload_offset = %s, size_bytes = %s WHERE video_id = %s AND upload_offset = %s",
+                    (offset + written, offset + written, video_id, offset)
+                )
+                add_usage(cursor, session['user_id'], offset + written - (video['size_bytes'] or 0))
+                db.commit()
+            video['upload_offset'] = video['size_bytes'] = offset + written
+        
+        return upload_progress(video)
+    
+    except ChunkConflictError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except Exception as e:
+        print(f"Driving video upload error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/driving-videos/<int:video_id>/finalize', methods=['POST'])
+def finalize_driving_video(video_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute(f"SELECT {DRIVING_VIDEO_COLUMNS}, upload_path FROM driving_videos WHERE video_id = %s AND user_id = %s",
+                         (video_id, session['user_id']))
+            video = cursor.fetchone()
+            
+            if not video:
+                return jsonify({'success': False, 'message': 'Driving video not found'}), 404
+            
+            upload_path = os.path.join(current_app.config['MEDIA_ROOT'], video.pop('upload_path'))
+            if video['status'] != 'uploading':
+                # Finalizing twice is harmless
+                return jsonify({'success': True, 'video': video}), 202
+            if video['upload_offset'] != video['upload_size']:
+                return upload_progress(video, 409)
+            
+            # Reject obvious non-videos now; a worker decodes the whole file
+            with open(upload_path, 'rb') as f:
+                if sniff_video_format(f.read(12)) is None:
+                    cursor.execute("UPDATE driving_videos SET status = 'invalid', error_message = %s, size_bytes = 0 WHERE video_id = %s",
+                                 ('File is not a supported video', video_id))
+                    add_usage(cursor, session['user_id'], -(video['size_bytes'] or 0))
+                    db.commit()
+                    os.remove(upload_path)
+                    return jsonify({'success': False, 'message': 'File is not a supported video'}), 400
+            
+            cursor.execute("UPDATE driving_videos SET status = 'pending' WHERE video_id = %s AND status = 'uploading'",
+                         (video_id,))
+            db.commit()
+            video['status'] = 'pending'
+        
+        # Workers transcode the video in the background
+        notify_workers()
+        
+        return jsonify({'success': True, 'message': 'Driving video queued for processing', 'video': video}), 202
+    
+    except Exception as e:
+        print(f"Finalize driving video error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/expressions', methods=['GET'])
+def get_expressions():
+    try:
+        catalog = services().expression_catalog.snapshot()
+        
+        # Clients revalidate with If-None-Match and get a bodiless 304 while unchanged
+        if catalog.version in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = jsonify({'success': True, 'expressions': catalog.expressions,
+                                'version': catalog.version})
+        
+        response.set_etag(catalog.version)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    except Exception as e:
+        print(f"Get expressions error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/admin/expressions', methods=['POST'])
+def admin_create_expression():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    data = request.get_json()
+    expression_name = data.get('expression_name')
+    
+    if not expression_name:
+        return jsonify({'success': False, 'message': 'Expression name required'}), 400
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor()
+            cursor.execute(
+                "INSERT INTO expressions (expression_name, expression_description, driving_video_path) VALUES (%s, %s, %s)",
+                (expression_name, data.get('expression_description'), data.get('driving_video_path'))
+            )
+            db.commit()
+            expression_id = cursor.lastrowid
+        
+        services().expression_catalog.invalidate()
+        return jsonify({'success': True, 'message': 'Expression created', 'expression_id': expression_id})
+    
+    except Exception as e:
+        print(f"Create expression error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/admin/expression/<int:expression_id>', methods=['PUT', 'DELETE'])
+def admin_manage_expression(expression_id):
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor()
+            
+            if request.method == 'PUT':
+                data = request.get_json()
+                fields = {name: data[name] for name in
+                          ('expression_name', 'expression_description', 'driving_video_path') if name in data}
+                
+                if not fields:
+                    return jsonify({'success': False, 'message': 'Nothing to update'}), 400
+                
+                assignments = ', '.join(f'{name} = %s' for name in fields)
+                cursor.execute(f"UPDATE expressions SET {assignments} WHERE expression_id = %s",
+                             (*fields.values(), expression_id))
+                message = 'Expression updated'
+            
+            elif request.method == 'DELETE':
+                cursor.execute("DELETE FROM expressions WHERE expression_id = %s", (expression_id,))
+                message = 'Expression deleted'
+            
+            db.commit()
+        
+        services().expression_catalog.invalidate()
+        return jsonify({'success': True, 'message': message})
+    
+    except Exception as e:
+        print(f"Manage expression error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/animation/generate', methods=['POST'])
+def generate_animation():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    data = request.get_json()
+    avatar_id = data.get('avatar_id')
+    expression_id = data.get('expression_id')
+    driving_video_id = data.get('driving_video_id')
+    
+    if not avatar_id or not (expression_id or driving_video_id):
+        return jsonify({'success': False, 'message': 'Avatar and expression or driving video required'}), 400
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            
+            cursor.execute("SELECT content_hash, features_status FROM avatars WHERE avatar_id = %s AND user_id = %s",
+                         (avatar_id, session['user_id']))
+            avatar = cursor.fetchone()
+            
+            if driving_video_id:
+                # A custom video drives the job through its transcoded copy
+                cursor.execute("SELECT video_path, status FROM driving_videos WHERE video_id = %s AND user_id = %s",
+                             (driving_video_id, session['user_id']))
+                video = cursor.fetchone()
+            
+        if driving_video_id:
+            if not avatar or not video:
+                return jsonify({'success': False, 'message': 'Avatar or driving video not found'}), 404
+            if video['status'] != 'ready':
+                return jsonify({'success': False, 'message': f"Driving video is {video['status']}",
+                                'video_status': video['status']}), 409
+            expression_id = None
+            driving_video_path = video['video_path']
+        else:
+            expression = services().expression_catalog.get(expression_id)
+            if not avatar or not expression:
+                return jsonify({'success': False, 'message': 'Avatar or expression not found'}), 404
+            driving_video_path = None
+        
+        if avatar['features_status'] == 'invalid':
+            return jsonify({'success': False, 'message': 'Avatar image could not be read'}), 400
+        
+        # Reuse an identical earlier result instead of generating it again. The key
+        # hashes the driving video, so it is built without holding a pooled connection;
+        # workers read the same ANIMATION_BACKEND, so the backend named here is the one rendering
+        backend = current_app.config['ANIMATION_BACKEND']
+        model_id = current_app.config['ANIMATION_MODEL_ID']
+        if driving_video_path:
+            result_key = driving_video_result_key(
+                avatar['content_hash'], os.path.join(current_app.config['MEDIA_ROOT'], driving_video_path),
+                model_id=model_id, backend=backend)
+        else:
+            result_key = expression_result_key(avatar['content_hash'], expression['expression_name'],
+                                               model_id=model_id, backend=backend)
+        
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            try:
+                check_quota(db, session['user_id'], storage_quota())
+            except QuotaExceededError as e:
+                return quota_exceeded(e)
+            
+            cached_path = services().result_cache.acquire(db, result_key) if result_key else None
+            
+            if cached_path:
+                # A shared result counts towards every user who has it
+                size = file_size(os.path.join(current_app.config['MEDIA_ROOT'], cached_path))
+                cursor.execute(
+                    "INSERT INTO animations (user_id, avatar_id, expression_id, driving_video_path, animation_path, status, progress, result_key, size_bytes) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    (session['user_id'], avatar_id, expression_id, driving_video_path, cached_path, 'completed', 100, result_key, size)
+                )
+                add_usage(cursor, session['user_id'], size)
+                db.commit()
+                
+                return jsonify({
+                    'success': True,
+                    'message': 'Animation generated',
+                    'animation_id': cursor.lastrowid,
+                    'animation_path': cached_path,
+                    'status': 'completed'
+                })
+            
+            animation_path = f'animations/animation_{uuid.uuid4()}.mp4'
+            
+            # Queue the job; a worker runs the First Order Model and updates the status
+            cursor.execute(
+                "INSERT INTO animations (user_id, avatar_id, expression_id, driving_video_path, animation_path, status, result_key) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (session['user_id'], avatar_id, expression_id, driving_video_path, animation_path, 'queued', result_key)
+            )
+            db.commit()
+            
+            animation_id = cursor.lastrowid
+        
+        notify_workers()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Animation queued',
+            'animation_id': animation_id,
+            'animation_path': animation_path,
+            'status': 'queued'
+        }), 202
+    
+    except Exception as e:
+        print(f"Generate animation error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/animation/<int:animation_id>/status', methods=['GET'])
+def animation_status(animation_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            job = get_job_status(db, animation_id, session['user_id'])
+        
+        if not job:
+            return jsonify({'success': False, 'message': 'Animation not found'}), 404
+        
+        return jsonify({'success': True, 'animation': job})
+    
+    except Exception as e:
+        print(f"Animation status error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/animations/events', methods=['GET'])
+def animation_events():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    # Subscribe before reading current state so no transition is missed in between
+    subscription = get_job_event_bus().subscribe(user_id)
+    
+    try:
+        job_relay = services().job_relay
+        if job_relay:
+            job_relay.start()
+        
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT animation_id, status, progress, error_message FROM animations
+                WHERE user_id = %s AND status IN ('queued', 'processing')
+                ORDER BY animation_id
+            """, (user_id,))
+            active = cursor.fetchall()
+        
+        if job_relay:
+            job_relay.watch(user_id, active)
+    
+    except Exception as e:
+        subscription.close()
+        print(f"Animation events error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+    
+    keepalive = current_app.config['EVENTS_KEEPALIVE']
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            # Jobs already in flight, so a reconnecting browser catches up
+            for job in active:
+                yield format_sse(job_event(job['animation_id'], job['status'],
+                                           job['progress'], job['error_message']))
+            while True:
+                event = subscription.get(timeout=keepalive)
+                # A comment line keeps proxies from closing an idle stream
+                yield format_sse(event) if event else ': keepalive\n\n'
+        finally:
+            subscription.close()
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route('/api/animation/<int:animation_id>/preview', methods=['GET'])
+def animation_preview(animation_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            job = get_job_status(db, animation_id, session['user_id'])
+    
+    except Exception as e:
+        print(f"Animation preview error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+    
+    if not job:
+        return jsonify({'success': False, 'message': 'Animation not found'}), 404
+    if job['status'] == 'completed':
+        return redirect(url_for('.animation_media', animation_id=animation_id))
+    if job['status'] == 'failed':
+        return jsonify({'success': False, 'message': 'Animation failed'}), 409
+    
+    # The session isn't available once the response starts streaming
+    user_id = session['user_id']
+    
+    def is_active():
+        try:
+            with get_db() as db:
+                job = get_job_status(db, animation_id, user_id)
+            return bool(job) and job['status'] in ('queued', 'processing')
+        except Exception:
+            return False
+    
+    frames = iter_preview_frames(animation_id, is_active)
+    response = Response(mjpeg_stream(frames), mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let nginx pass frames through immediately
+    return response
+
+@bp.route('/api/animation/<int:animation_id>/media', methods=['GET'])
+def animation_media(animation_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            if session.get('role') == 'admin':
+                cursor.execute("SELECT animation_path, status FROM animations WHERE animation_id = %s",
+                             (animation_id,))
+            else:
+                cursor.execute("SELECT animation_path, status FROM animations WHERE animation_id = %s AND user_id = %s",
+                             (animation_id, session['user_id']))
+            animation = cursor.fetchone()
+    
+    except Exception as e:
+        print(f"Animation media error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+    
+    if not animation:
+        return jsonify({'success': False, 'message': 'Animation not found'}), 404
+    if animation['status'] != 'completed':
+        return jsonify({'success': False, 'message': 'Animation not ready'}), 409
+    
+    filepath = os.path.abspath(os.path.join(current_app.config['MEDIA_ROOT'], animation['animation_path']))
+    if not os.path.isfile(filepath):
+        return jsonify({'success': False, 'message': 'Animation file missing'}), 404
+    
+    accel_prefix = current_app.config['MEDIA_ACCEL_REDIRECT']
+    if accel_prefix:
+        # nginx streams the file itself, including ranges and conditional requests
+        response = current_app.response_class(mimetype='video/mp4')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + animation['animation_path']
+    else:
+        # Handles Range, If-None-Match and If-Modified-Since; the body goes out through
+        # the server's file wrapper (sendfile) or X-Sendfile, not through Python memory
+        response = send_file(filepath, mimetype='video/mp4', conditional=True, etag=True,
+                             max_age=current_app.config['MEDIA_MAX_AGE'])
+    
+    response.headers['Cache-Control'] = f"private, max-age={current_app.config['MEDIA_MAX_AGE']}, immutable"
+    return response
+
+@bp.route('/api/animations', methods=['GET'])
+def get_animations():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        limit, after = parse_page_args()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid page cursor'}), 400
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            animations, next_cursor = keyset_page(cursor, """
+                SELECT a.animation_id, a.avatar_id, a.expression_id, a.animation_path, a.status,
+                       a.progress, a.created_at, av.avatar_path, e.expression_name
+                FROM animations a
+                JOIN avatars av ON a.avatar_id = av.avatar_id
+                LEFT JOIN expressions e ON a.expression_id = e.expression_id
+                WHERE a.user_id = %s {keyset}
+            """, (session['user_id'],), after, limit, 'a.animation_id', 'animation_id')
+        
+        return jsonify({'success': True, 'animations': animations, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        print(f"Get animations error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/subscription/update', methods=['POST'])
+def update_subscription():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    data = request.get_json()
+    plan = data.get('plan')
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor()
+            cursor.execute(
+                "UPDATE users SET role = %s, subscription_status = %s WHERE user_id = %s",
+                ('subscriber', 'active', session['user_id'])
+            )
+            db.commit()
+        
+        session['role'] = 'subscriber'
+        
+        return jsonify({'success': True, 'message': 'Subscription updated'})
+    
+    except Exception as e:
+        print(f"Update subscription error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/admin/users', methods=['GET'])
+def admin_get_users():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        limit, after = parse_page_args()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid page cursor'}), 400
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor(dictionary=True)
+            users, next_cursor = keyset_page(
+                cursor,
+                "SELECT user_id, fullname, email, role, subscription_status, created_at FROM users WHERE 1 = 1 {keyset}",
+                (), after, limit, 'user_id', 'user_id')
+        
+        return jsonify({'success': True, 'users': users, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        print(f"Get users error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/admin/user/<int:user_id>', methods=['PUT', 'DELETE'])
+def admin_manage_user(user_id):
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        with get_db() as db:
+            cursor = db.cursor()
+            
+            if request.method == 'PUT':
+                data = request.get_json()
+                action = data.get('action')
+                
+                if action == 'suspend':
+                    cursor.execute("UPDATE users SET subscription_status = %s WHERE user_id = %s", 
+                                 ('suspended', user_id))
+                elif action == 'activate':
+                    cursor.execute("UPDATE users SET subscription_status = %s WHERE user_id = %s", 
+                                 ('active', user_id))
+                
+                db.commit()
+                return jsonify({'success': True, 'message': 'User updated'})
+            
+            elif request.method == 'DELETE':
+                # Rows cascade with the user; release the shared result files their
+                # completed animations reference. The storage reaper removes the
+                # files nothing refers to any more
+                cursor.execute("""
+                    SELECT result_key FROM animations
+                    WHERE user_id = %s AND result_key IS NOT NULL AND status = 'completed'
+                """, (user_id,))
+                result_keys = [row[0] for row in cursor.fetchall()]
+                
+                cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+                services().result_cache.release(db, result_keys)
+                db.commit()
+                services().result_cache.evict()
+                return jsonify({'success': True, 'message': 'User deleted'})
+    
+    except Exception as e:
+        print(f"Manage user error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Error handlers
+@bp.app_errorhandler(404)
+def not_found(e):
+    return render_template('index.html'), 404
+
+@bp.app_errorhandler(500)
+def internal_error(e):
+    return jsonify({'success': False, 'message': 'Internal server error'}), 500
+
+if __name__ == '__main__':
+    app = create_app()
+    
+    print("\n" + "="*60)
+    print("Face Animation Platform Starting...")
+    print("="*60)
+    print(f"Server running at: http://localhost:5000")
+    print(f"Static folder: {app.static_folder}")
+    print(f"Template folder: {app.template_folder}")
+    print("="*60 + "\n")
+    
+    app.run(debug=app.config.get('DEBUG', False), port=5000, host='0.0.0.0')
@@ -0,0 +1,252 @@
+"""
+Avatar Ingest
+
+Work done once per uploaded avatar, in the background worker pool, so that
+animation jobs and gallery pages don't repeat it:
+
+- the upload is fully decoded and verified; anything that isn't a readable
+  PNG, JPEG, GIF or WebP within the size limits is marked 'invalid'
+- two derivatives are written from the decoded pixels only, so EXIF (GPS,
+  camera details) and other metadata never reach them:
+    ``<avatar>_thumb.webp``  square gallery thumbnail
+    ``<avatar>_256.webp``    model-ready 256x256 RGB input, resized as
+                             frame_preprocessing.resize_batch does
+  (JPEG instead of WebP where Pillow lacks WebP support)
+- the keypoint detector is run on the model-ready image and the result is
+  saved next to it as ``<avatar>_256.features.npz``, tagged with the
+  checkpoint it was computed for
+
+The worker records the derivatives on the avatars row; listings serve the
+thumbnail and animation jobs read the model-ready file.
+FaceAnimationGenerator.prepare_source picks the features up automatically
+and falls back to computing them if the file is missing or was made with a
+different checkpoint.
+"""
+
+import os
+import uuid
+
+from content_hash import cached_file_hash
+
+FEATURES_SUFFIX = '.features.npz'
+THUMBNAIL_SIZE = 200       # Gallery thumbnails, square; shown at 100px on high-DPI screens
+THUMBNAIL_QUALITY = 80
+MODEL_SIZE = 256           # Model input resolution
+MODEL_QUALITY = 95         # Only used for the JPEG fallback; WebP derivatives are lossless
+MIN_IMAGE_SIDE = 64
+MAX_IMAGE_PIXELS = 40_000_000  # Larger images are rejected before decoding
+
+# Leading bytes of the formats accepted for upload
+IMAGE_SIGNATURES = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+
+
+class InvalidImageError(Exception):
+    """Raised when an upload can't be decoded as a usable image"""
+    pass
+
+
+def sniff_image_format(header):
+    """
+    Identify an image from its first bytes, without decoding it
+
+    Cheap enough for the upload request; the worker still decodes the whole
+    file before the avatar is used.
+
+    Returns:
+        str: 'png', 'jpeg', 'gif' or 'webp', or None if unrecognised
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    for name, signatures in IMAGE_SIGNATURES.items():
+        if header.startswith(signatures):
+            return name
+    return None
+
+
+def features_path(image_path):
+    """Where the precomputed features for an avatar image live"""
+    return os.path.splitext(image_path)[0] + FEATURES_SUFFIX
+
+
+def derivative_paths(image_path, extension):
+    """Where the thumbnail and model-ready derivatives of an avatar live"""
+    stem = os.path.splitext(image_path)[0]
+    return f'{stem}_thumb.{extension}', f'{stem}_{MODEL_SIZE}.{extension}'
+
+
+def create_derivatives(image_path):
+    """
+    Decode and verify an avatar, then write its metadata-free derivatives
+
+    Args:
+        image_path: Path to the uploaded image
+
+    Returns:
+        dict: thumbnail_path, model_path, width and height of the original
+
+    Raises:
+        InvalidImageError: If the file isn't a readable image of usable size
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+    try:
+        with Image.open(image_path) as image:
+            if image.format not in ('PNG', 'JPEG', 'GIF', 'WEBP'):
+                raise InvalidImageError(f"Unsupported image format {image.format}")
+            # Checked from the header, before anything is decompressed
+            if image.width * image.height > MAX_IMAGE_PIXELS:
+                raise InvalidImageError(f"Image too large ({image.width}x{image.height})")
+            image.verify()
+
+        # verify() leaves the image unusable; decode it again in full
+        with Image.open(image_path) as image:
+            image = ImageOps.exif_transpose(image)
+            rgb = image.convert('RGB')
+            # Derivatives copy info on resize and save parts of it; keep only the pixels
+            rgb.info.clear()
+    except InvalidImageError:
+        raise
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        raise InvalidImageError(f"Not a valid image: {e}")
+
+    if min(rgb.size) < MIN_IMAGE_SIDE:
+        raise InvalidImageError(f"Image too small ({rgb.width}x{rgb.height})")
+
+    if features.check('webp'):
+        extension, thumbnail_options = 'webp', {'quality': THUMBNAIL_QUALITY}
+        model_options = {'lossless': True}
+    else:
+        extension, thumbnail_options = 'jpg', {'quality': THUMBNAIL_QUALITY}
+        model_options = {'quality': MODEL_QUALITY}
+    thumbnail_path, model_path = derivative_paths(image_path, extension)
+
+    # Pillow's bilinear resize is anti-aliased, like resize_batch
+    thumbnail = ImageOps.fit(rgb, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BILINEAR)
+    model_input = rgb.resize((MODEL_SIZE, MODEL_SIZE), Image.BILINEAR)
+    for derivative, path, options in ((thumbnail, thumbnail_path, thumbnail_options),
+                                      (model_input, model_path, model_options)):
+        # Write then rename so a listing or job never reads a half-written file
+        scratch = f'{path}.{uuid.uuid4().hex}.tmp'
+        derivative.save(scratch, format='WEBP' if extension == 'webp' else 'JPEG', **options)
+        os.replace(scratch, path)
+
+    return {'thumbnail_path': thumbnail_path, 'model_path': model_path,
+            'width': rgb.width, 'height': rgb.height}
+
+
+def compute_source_features(generator, image_path):
+    """
+    Normalise an avatar, detect its keypoints and save both to disk
+
+    Args:
+        generator: Loaded FaceAnimationGenerator
+        image_path: Path to the avatar image
+
+    Returns:
+        str: Path of the written features file
+    """
+    import imageio
+    import numpy as np
+    from frame_preprocessing import resize_batch
+
+    source = resize_batch(imageio.imread(image_path)[np.newaxis])
+    values, jacobians = generator.detect_keypoints(source)
+
+    arrays = {
+        'source': source,
+        'kp_value': values,
+        'checkpoint_hash': np.array(cached_file_hash(generator.checkpoint_path)),
+        'kp_backend': np.array(generator.kp_backend)
+    }
+    if jacobians is not None:
+        arrays['kp_jacobian'] = jacobians
+
+    # Write then rename so a job never reads a half-written file
+    output_path = features_path(image_path)
+    scratch = f'{output_path}.{uuid.uuid4().hex}.tmp.npz'
+    np.savez(scratch, **arrays)
+    os.replace(scratch, output_path)
+    return output_path
+
+
+def load_source_features(image_path, checkpoint_path, kp_backend='eager'):
+    """
+    Load precomputed features for an avatar
+
+    Args:
+        image_path: Path to the avatar image
+        checkpoint_path: Checkpoint the caller's model was loaded from
+        kp_backend: Backend of the caller's keypoint detector
+
+    Returns:
+        tuple: (source of shape (1, 256, 256, 3), dict of keypoint arrays),
+               or None if missing or computed for another checkpoint or
+               keypoint detector backend
+    """
+    path = features_path(image_path)
+    if not os.path.exists(path):
+        return None
+
+    import numpy as np
+
+    try:
+        with np.load(path) as data:
+            if str(data['checkpoint_hash']) != cached_file_hash(checkpoint_path):
+                return None
+            # Files written before the tag existed are taken to be from the eager detector
+            if (str(data['kp_backend']) if 'kp_backend' in data else 'eager') != kp_backend:
+                return None
+            keypoints = {'value': data['kp_value']}
+            if 'kp_jacobian' in data:
+                keypoints['jacobian'] = data['kp_jacobian']
+            return data['source'], keypoints
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring unreadable avatar features {path}: {e}")
+        return None
+
+
+def process_avatar_ingest(avatar_path):
+    """
+    Ingest task run by the worker pool for a newly uploaded avatar
+
+    Args:
+        avatar_path: Path to the uploaded avatar image
+
+    Returns:
+        dict: Result with status ('success', 'failed' or 'invalid'), the
+              derivatives from create_derivatives and the features path
+    """
+    try:
+        derivatives = create_derivatives(avatar_path)
+    except Exception as e:
+        return {
+            'status': 'invalid' if isinstance(e, InvalidImageError) else 'failed',
+            'error': str(e),
+            'message': 'Avatar ingest failed'
+        }
+
+    try:
+        from model_registry import get_model_registry
+
+        generator = get_model_registry().get()
+        path = compute_source_features(generator, derivatives['model_path'])
+
+        return {
+            'status': 'success',
+            'features_path': path,
+            'message': 'Avatar ingested successfully',
+            **derivatives
+        }
+
+    except Exception as e:
+        # The derivatives are still usable; jobs compute the features themselves
+        return {
+            'status': 'failed',
+            'error': str(e),
+            'message': 'Avatar features failed',
+            **derivatives
+        }
@@ -0,0 +1,72 @@
+"""
+Application Settings
+
+create_app() loads one of these classes into app.config; pick it with the
+APP_CONFIG environment variable (development or production) or pass a
+class or name explicitly. Secrets and per-deployment values come from the
+environment.
+"""
+
+import os
+
+from job_events import RELAY_INTERVAL
+from model_registry import DEFAULT_BACKEND, DEFAULT_MODEL_ID
+from password_hashing import HASH_METHOD, HASH_QUEUE, HASH_TIMEOUT, HASH_WORKERS
+from media_storage import STORAGE_QUOTAS
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your_secret_key_here_change_in_production')
+    UPLOAD_FOLDER = 'static/uploads'
+    AVATARS_FOLDER = 'static/avatars'
+    ANIMATIONS_FOLDER = 'static/animations'
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    # Driving videos arrive in resumable chunks (see video_ingest)
+    DRIVING_VIDEO_MAX_BYTES = 512 * 1024 * 1024  # 512MB max driving video
+    UPLOAD_CHUNK_MAX_BYTES = 8 * 1024 * 1024  # Per request; keep below MAX_CONTENT_LENGTH
+
+    # Database
+    DB_POOL_SIZE = 10
+    DB_POOL_TIMEOUT = 10  # seconds to wait for a free connection
+    SQLITE_PATH = None    # Use this SQLite file instead of MySQL (load tests, local experiments)
+
+    # Password hashing (see password_hashing)
+    PASSWORD_HASH_METHOD = HASH_METHOD  # Changing it re-hashes each password at its next login
+    PASSWORD_HASH_WORKERS = HASH_WORKERS
+    PASSWORD_HASH_QUEUE = HASH_QUEUE      # Waiting logins beyond this get 429
+    PASSWORD_HASH_TIMEOUT = HASH_TIMEOUT  # Seconds before a waiting login gets 503
+
+    # Animation jobs
+    ANIMATION_WORKERS = 2
+    ANIMATION_WORKERS_INLINE = True  # False when running animation_worker.py separately
+    ANIMATION_BACKEND = DEFAULT_BACKEND  # eager, torchscript, compile, static_int8 or onnx
+    ANIMATION_MODEL_ID = DEFAULT_MODEL_ID  # Checkpoint name in result cache keys; change it with the weights
+    RESULT_CACHE_MAX_BYTES = 5 * 1024 ** 3  # Budget for cached animation files
+
+    # Media delivery
+    MEDIA_ROOT = 'static'  # avatar_path / animation_path are relative to this
+    MEDIA_MAX_AGE = 365 * 24 * 3600  # Generated files never change in place
+    MEDIA_ACCEL_REDIRECT = None  # e.g. '/protected-media/' when nginx serves MEDIA_ROOT internally
+    USE_X_SENDFILE = False  # True behind Apache/lighttpd with X-Sendfile enabled
+    STORAGE_QUOTAS = STORAGE_QUOTAS  # Bytes per role (None: unlimited); see media_storage
+
+    EVENTS_KEEPALIVE = 15  # Seconds between SSE keep-alive comments
+    EVENTS_POLL_INTERVAL = RELAY_INTERVAL  # Seconds between each process's job status checks when workers run separately
+    PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    METRICS_ENABLED = True  # Keep /metrics off the public proxy; scrape it internally
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class ProductionConfig(Config):
+    # Web replicas stay light; animation_worker.py processes run the model
+    ANIMATION_WORKERS_INLINE = False
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
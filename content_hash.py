@@ -0,0 +1,39 @@
+"""
+Content Hashing
+
+SHA-256 digests of files, used to key caches by what a file contains rather
+than where it lives. Digests of large, rarely changing files (checkpoints,
+stock driving videos) are remembered while the file's size and mtime stay
+the same.
+"""
+
+import hashlib
+import os
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_memo = {}  # (path, size, mtime) -> digest
+_memo_lock = threading.Lock()
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_file_hash(path):
+    """file_hash, reused until the file's size or mtime changes"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    with _memo_lock:
+        digest = _memo.get(key)
+    if digest is None:
+        digest = file_hash(path)
+        with _memo_lock:
+            _memo[key] = digest
+    return digest
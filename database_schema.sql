@@ -1,81 +1,152 @@
--- Create database
-DROP DATABASE IF EXISTS face_animation_db;
-CREATE DATABASE IF NOT EXISTS face_animation_db;
-USE face_animation_db;
-
-
--- Users table
-CREATE TABLE IF NOT EXISTS users (
-    user_id INT PRIMARY KEY AUTO_INCREMENT,
-    fullname VARCHAR(255) NOT NULL,
-    email VARCHAR(255) UNIQUE NOT NULL,
-    password VARCHAR(255) NOT NULL,
-    role ENUM('user', 'subscriber', 'admin') DEFAULT 'user',
-    subscription_status ENUM('active', 'inactive', 'suspended') DEFAULT 'inactive',
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-);
-
--- Avatars table
-CREATE TABLE IF NOT EXISTS avatars (
-    avatar_id INT PRIMARY KEY AUTO_INCREMENT,
-    user_id INT NOT NULL,
-    avatar_path VARCHAR(500) NOT NULL,
-    avatar_name VARCHAR(255),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-);
-
--- Expressions table
-CREATE TABLE IF NOT EXISTS expressions (
-    expression_id INT PRIMARY KEY AUTO_INCREMENT,
-    expression_name VARCHAR(100) NOT NULL,
-    expression_description TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
--- Animations table
-CREATE TABLE IF NOT EXISTS animations (
-    animation_id INT PRIMARY KEY AUTO_INCREMENT,
-    user_id INT NOT NULL,
-    avatar_id INT NOT NULL,
-    expression_id INT,
-    driving_video_path VARCHAR(500),
-    animation_path VARCHAR(500) NOT NULL,
-    status ENUM('processing', 'completed', 'failed') DEFAULT 'processing',
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-    FOREIGN KEY (avatar_id) REFERENCES avatars(avatar_id) ON DELETE CASCADE,
-    FOREIGN KEY (expression_id) REFERENCES expressions(expression_id) ON DELETE SET NULL
-);
-
--- Subscriptions table
-CREATE TABLE IF NOT EXISTS subscriptions (
-    subscription_id INT PRIMARY KEY AUTO_INCREMENT,
-    user_id INT NOT NULL,
-    plan_type ENUM('monthly', 'yearly') NOT NULL,
-    start_date DATE NOT NULL,
-    end_date DATE NOT NULL,
-    payment_status ENUM('pending', 'completed', 'failed') DEFAULT 'pending',
-    amount DECIMAL(10, 2) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-);
-
--- Insert default expressions
-INSERT INTO expressions (expression_name, expression_description) VALUES
-('smile', 'Happy smiling expression'),
-('angry', 'Angry expression'),
-('surprised', 'Surprised expression'),
-('sad', 'Sad expression');
-
--- Insert default admin user (password: admin123)
--- Password hash generated with werkzeug.security.generate_password_hash('admin123')
-INSERT INTO users (fullname, email, password, role, subscription_status) VALUES
-('Admin User', 'admin@faceanimation.com', 'scrypt:32768:8:1$hBzKjLQ6HWpvYGxC$0fde8e5e5c5c8e8f8d8b8c8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c', 'admin', 'active');
-
--- Create indexes for better performance
-CREATE INDEX idx_user_email ON users(email);
-CREATE INDEX idx_avatar_user ON avatars(user_id);
-CREATE INDEX idx_animation_user ON animations(user_id);
-CREATE INDEX idx_animation_status ON animations(status);
\ No newline at end of file
+-- Create database
+DROP DATABASE IF EXISTS face_animation_db;
+CREATE DATABASE IF NOT EXISTS face_animation_db;
+USE face_animation_db;
+
+
+-- Users table
+CREATE TABLE IF NOT EXISTS users (
+    user_id INT PRIMARY KEY AUTO_INCREMENT,
+    fullname VARCHAR(255) NOT NULL,
+    email VARCHAR(255) UNIQUE NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    role ENUM('user', 'subscriber', 'admin') DEFAULT 'user',
+    subscription_status ENUM('active', 'inactive', 'suspended') DEFAULT 'inactive',
+    storage_bytes BIGINT DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- Avatars table
+CREATE TABLE IF NOT EXISTS avatars (
+    avatar_id INT PRIMARY KEY AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    avatar_path VARCHAR(500) NOT NULL,
+    avatar_name VARCHAR(255),
+    content_hash CHAR(64),
+    thumbnail_path VARCHAR(500),
+    model_path VARCHAR(500),
+    width INT,
+    height INT,
+    size_bytes BIGINT DEFAULT 0,
+    features_status ENUM('pending', 'processing', 'ready', 'failed', 'invalid') DEFAULT 'pending',
+    ingest_started_at TIMESTAMP NULL DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- Expressions table
+CREATE TABLE IF NOT EXISTS expressions (
+    expression_id INT PRIMARY KEY AUTO_INCREMENT,
+    expression_name VARCHAR(100) NOT NULL,
+    expression_description TEXT,
+    driving_video_path VARCHAR(500),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Driving videos table (custom driving video uploads and their transcodes)
+CREATE TABLE IF NOT EXISTS driving_videos (
+    video_id INT PRIMARY KEY AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    video_name VARCHAR(255),
+    upload_path VARCHAR(500) NOT NULL,
+    upload_size BIGINT NOT NULL,
+    upload_offset BIGINT DEFAULT 0,
+    upload_sha256 CHAR(64),
+    video_path VARCHAR(500),
+    fps FLOAT,
+    duration FLOAT,
+    width INT,
+    height INT,
+    size_bytes BIGINT DEFAULT 0,
+    status ENUM('uploading', 'pending', 'processing', 'ready', 'failed', 'invalid') DEFAULT 'uploading',
+    error_message TEXT,
+    ingest_started_at TIMESTAMP NULL DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- Animations table
+CREATE TABLE IF NOT EXISTS animations (
+    animation_id INT PRIMARY KEY AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    avatar_id INT NOT NULL,
+    expression_id INT,
+    driving_video_path VARCHAR(500),
+    animation_path VARCHAR(500) NOT NULL,
+    status ENUM('queued', 'processing', 'completed', 'failed') DEFAULT 'queued',
+    progress TINYINT UNSIGNED DEFAULT 0,
+    attempts INT DEFAULT 0,
+    error_message TEXT,
+    worker_id VARCHAR(255),
+    next_attempt_at TIMESTAMP NULL DEFAULT NULL,
+    started_at TIMESTAMP NULL DEFAULT NULL,
+    heartbeat_at TIMESTAMP NULL DEFAULT NULL,
+    completed_at TIMESTAMP NULL DEFAULT NULL,
+    result_key CHAR(64),
+    size_bytes BIGINT DEFAULT 0,
+    stage_metrics JSON,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (avatar_id) REFERENCES avatars(avatar_id) ON DELETE CASCADE,
+    FOREIGN KEY (expression_id) REFERENCES expressions(expression_id) ON DELETE SET NULL
+);
+
+-- Animation results table (content-addressed cache of generated files)
+CREATE TABLE IF NOT EXISTS animation_results (
+    result_key CHAR(64) PRIMARY KEY,
+    animation_path VARCHAR(500) NOT NULL,
+    size_bytes BIGINT DEFAULT 0,
+    ref_count INT DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Subscriptions table
+CREATE TABLE IF NOT EXISTS subscriptions (
+    subscription_id INT PRIMARY KEY AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    plan_type ENUM('monthly', 'yearly') NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    payment_status ENUM('pending', 'completed', 'failed') DEFAULT 'pending',
+    amount DECIMAL(10, 2) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- Insert default expressions
+INSERT INTO expressions (expression_name, expression_description, driving_video_path) VALUES
+('smile', 'Happy smiling expression', './expressions/smile.mp4'),
+('angry', 'Angry expression', './expressions/angry.mp4'),
+('surprised', 'Surprised expression', './expressions/surprised.mp4'),
+('sad', 'Sad expression', './expressions/sad.mp4');
+
+-- Insert default admin user (password: admin123)
+-- Password hash generated with werkzeug.security.generate_password_hash('admin123')
+INSERT INTO users (fullname, email, password, role, subscription_status) VALUES
+('Admin User', 'admin@faceanimation.com', 'scrypt:32768:8:1$hBzKjLQ6HWpvYGxC$0fde8e5e5c5c8e8f8d8b8c8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c8b8a8e8d8c', 'admin', 'active');
+
+-- Create indexes for better performance
+CREATE INDEX idx_user_email ON users(email);
+CREATE INDEX idx_avatar_user ON avatars(user_id);
+CREATE INDEX idx_avatar_user_created ON avatars(user_id, created_at, avatar_id);
+CREATE INDEX idx_avatar_created ON avatars(created_at, avatar_id);
+CREATE INDEX idx_user_created ON users(created_at, user_id);
+CREATE INDEX idx_avatar_ingest ON avatars(features_status, avatar_id);
+CREATE INDEX idx_video_user_created ON driving_videos(user_id, created_at, video_id);
+CREATE INDEX idx_video_ingest ON driving_videos(status, video_id);
+CREATE INDEX idx_animation_user ON animations(user_id);
+CREATE INDEX idx_animation_user_created ON animations(user_id, created_at, animation_id);
+CREATE INDEX idx_animation_status ON animations(status);
+CREATE INDEX idx_animation_queue ON animations(status, next_attempt_at, animation_id);
+CREATE INDEX idx_animation_result ON animations(result_key);
+CREATE INDEX idx_result_lru ON animation_results(ref_count, last_used_at);
+-- Storage reaper lookups by stored path
+CREATE INDEX idx_avatar_path ON avatars(avatar_path);
+CREATE INDEX idx_avatar_thumbnail ON avatars(thumbnail_path);
+CREATE INDEX idx_avatar_model ON avatars(model_path);
+CREATE INDEX idx_animation_path ON animations(animation_path);
+CREATE INDEX idx_result_path ON animation_results(animation_path);
+CREATE INDEX idx_video_upload ON driving_videos(upload_path);
+CREATE INDEX idx_video_path ON driving_videos(video_path);
\ No newline at end of file
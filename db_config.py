@@ -1,35 +1,410 @@
-import mysql.connector
-from mysql.connector import Error
-
-class DatabaseConnection:
-    def __init__(self):
-        """Initialize database connection"""
-        try:
-            self.connection = mysql.connector.connect(
-                host="localhost",
-                user="root",  # Change to your MySQL username
-                password="1234",  # Change to your MySQL password
-                database="face_animation_db"
-            )
-            
-            if self.connection.is_connected():
-                print("Successfully connected to MySQL database")
-        
-        except Error as e:
-            print(f"Error connecting to MySQL: {e}")
-            self.connection = None
-    
-    def get_connection(self):
-        """Return the database connection"""
-        if self.connection and self.connection.is_connected():
-            return self.connection
-        else:
-            # Reconnect if connection was lost
-            self.__init__()
-            return self.connection
-    
-    def close(self):
-        """Close the database connection"""
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            print("MySQL connection closed")
\ No newline at end of file
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+
+from service_metrics import DB_POOL_WAIT, DB_QUERY_DURATION
+
+# Connection settings
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',  # Change to your MySQL username
+    'password': '1234',  # Change to your MySQL password
+    'database': 'face_animation_db'
+}
+
+# Pool settings
+POOL_SIZE = 10           # Max connections open at once
+POOL_WAIT_TIMEOUT = 10   # Seconds to wait for a free connection
+POOL_PING_INTERVAL = 30  # Re-check idle connections older than this (seconds)
+SQLITE_BUSY_TIMEOUT = 30  # Seconds a SQLite writer waits for the database lock
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes free within the wait timeout"""
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, pool_size=POOL_SIZE, wait_timeout=POOL_WAIT_TIMEOUT,
+                 ping_interval=POOL_PING_INTERVAL):
+        """
+        Fixed-size pool of reusable database connections
+
+        Args:
+            connect: Callable returning a new DB-API connection
+            pool_size: Maximum number of connections open at the same time
+            wait_timeout: Seconds a checkout waits for a free connection
+            ping_interval: Idle connections older than this are health-checked
+                           on checkout (0 checks every time)
+        """
+        self._connect = connect
+        self.pool_size = pool_size
+        self.wait_timeout = wait_timeout
+        self.ping_interval = ping_interval
+
+        self._idle = deque()  # (connection, last_used) pairs, most recent last
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Counters for monitoring
+        self.created = 0
+        self.discarded = 0
+        self.checked_out = 0
+        self.wait_time_total = 0.0
+        self.timeouts = 0
+
+    def acquire(self):
+        """Check out a healthy connection, waiting up to wait_timeout"""
+        if self._closed:
+            raise PoolTimeoutError("Connection pool is closed")
+
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeoutError(
+                f"No database connection available after {self.wait_timeout}s "
+                f"(pool size {self.pool_size})"
+            )
+        waited = time.monotonic() - started
+        DB_POOL_WAIT.observe(waited)
+
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = self._connect()
+                with self._lock:
+                    self.created += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.checked_out += 1
+            self.wait_time_total += waited
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or drop it if it is broken"""
+        try:
+            if not discard and not self._closed:
+                try:
+                    conn.rollback()  # Never hand out an open transaction
+                except Exception:
+                    discard = True
+
+            if discard or self._closed:
+                self._close_quietly(conn)
+                with self._lock:
+                    self.discarded += 1
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self.checked_out -= 1
+            self._slots.release()
+
+    def close_all(self):
+        """Close every idle connection and refuse further checkouts"""
+        self._closed = True
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Snapshot of pool counters"""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'idle': len(self._idle),
+                'in_use': self.checked_out,
+                'created': self.created,
+                'discarded': self.discarded,
+                'timeouts': self.timeouts,
+                'wait_time_total': self.wait_time_total
+            }
+
+    def _take_idle(self):
+        """Pop the most recently used idle connection that passes a health check"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used < self.ping_interval or self._is_healthy(conn):
+                return conn
+
+            self._close_quietly(conn)
+            with self._lock:
+                self.discarded += 1
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            if hasattr(conn, 'is_connected'):
+                return conn.is_connected()
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class PooledConnection:
+    def __init__(self, pool, conn):
+        """
+        Connection checked out from a ConnectionPool
+
+        Behaves like the underlying connection. close() (or leaving a
+        ``with`` block) closes any cursors it handed out and returns the
+        connection to the pool instead of closing the socket.
+        """
+        self._pool = pool
+        self._conn = conn
+        self._cursors = []
+
+    def cursor(self, *args, **kwargs):
+        cursor = TimedCursor(self._conn.cursor(*args, **kwargs))
+        self._cursors.append(cursor)
+        return cursor
+
+    def close(self, discard=False):
+        """Close open cursors and hand the connection back to the pool"""
+        if self._conn is None:
+            return
+        for cursor in self._cursors:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._cursors = []
+        conn, self._conn = self._conn, None
+        self._pool.release(conn, discard=discard)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError(f"Connection already returned to pool: {name}")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # release() rolls back; a connection that cannot roll back is dropped
+        self.close()
+        return False
+
+
+class TimedCursor:
+    def __init__(self, cursor):
+        """Cursor that records statement execution time in db_query_duration_seconds"""
+        self._cursor = cursor
+
+    def execute(self, query, *args, **kwargs):
+        with DB_QUERY_DURATION.time(verb=_verb(query)):
+            return self._cursor.execute(query, *args, **kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        with DB_QUERY_DURATION.time(verb=_verb(query)):
+            return self._cursor.executemany(query, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+_VERBS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _verb(query):
+    # A fixed label set, whatever the statement
+    verb = query.lstrip()[:6].upper()
+    return verb if verb in _VERBS else 'OTHER'
+
+
+_PLACEHOLDER = re.compile(r'%s')
+
+# MySQL-only syntax in database_schema.sql and its SQLite equivalent
+_SCHEMA_REWRITES = [
+    (re.compile(r'^\s*(DROP|CREATE) DATABASE[^;]*;|^\s*USE [^;]*;', re.I | re.M), ''),
+    (re.compile(r'\bINT PRIMARY KEY AUTO_INCREMENT\b', re.I), 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    (re.compile(r'\bENUM\([^)]*\)', re.I), 'TEXT'),
+    (re.compile(r'\bJSON\b', re.I), 'TEXT'),
+    (re.compile(r'\bTINYINT UNSIGNED\b', re.I), 'INTEGER'),
+    (re.compile(r'\s+ON UPDATE CURRENT_TIMESTAMP', re.I), ''),
+]
+
+
+def sqlite_schema(mysql_schema):
+    """
+    Translate database_schema.sql into a script SQLite accepts
+
+    Covers the MySQL syntax the schema uses, so SQLite stand-ins (load
+    tests, local experiments) always match the real tables.
+    """
+    for pattern, replacement in _SCHEMA_REWRITES:
+        mysql_schema = pattern.sub(replacement, mysql_schema)
+    return mysql_schema
+
+
+class SQLiteCursor:
+    def __init__(self, cursor, dictionary=False):
+        """
+        sqlite3 cursor that accepts MySQL-style ``%s`` placeholders and
+        ``dictionary=True`` rows, so app queries run unchanged on SQLite
+        """
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def execute(self, query, params=()):
+        self._cursor.execute(_PLACEHOLDER.sub('?', query), params)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(_PLACEHOLDER.sub('?', query), seq_of_params)
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._convert(row) if row is not None else None
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def _convert(self, row):
+        if not self._dictionary:
+            return tuple(row)
+        return {col[0]: value for col, value in zip(self._cursor.description, row)}
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        """sqlite3 connection exposing the mysql.connector calls the app uses"""
+        self._conn = conn
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._conn.cursor(), dictionary=dictionary)
+
+    def is_connected(self):
+        try:
+            self._conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class DatabaseConnection:
+    def __init__(self, pool_size=POOL_SIZE, wait_timeout=POOL_WAIT_TIMEOUT,
+                 ping_interval=POOL_PING_INTERVAL, connect=None, **connect_args):
+        """
+        Initialize the pooled database connection manager
+
+        Connections are opened lazily on first use and reused afterwards.
+
+        Args:
+            pool_size: Maximum number of open connections
+            wait_timeout: Seconds to wait for a free connection before failing
+            ping_interval: Health-check idle connections older than this
+            connect: Optional factory returning a new connection (for SQLite
+                     or other stand-ins); defaults to MySQL with DB_CONFIG
+            connect_args: Overrides for DB_CONFIG when using MySQL
+        """
+        if connect is None:
+            settings = dict(DB_CONFIG, **connect_args)
+
+            def connect():
+                if mysql is None:
+                    raise RuntimeError("mysql-connector-python is not installed")
+                return mysql.connector.connect(**settings)
+
+        self.pool = ConnectionPool(connect, pool_size=pool_size, wait_timeout=wait_timeout,
+                                   ping_interval=ping_interval)
+
+    @classmethod
+    def sqlite(cls, path=None, schema=None, **pool_args):
+        """
+        Build a manager backed by SQLite instead of MySQL
+
+        Args:
+            path: Database file; None for a private in-memory database
+            schema: Optional SQL script run once to create tables
+
+        Returns:
+            DatabaseConnection: Manager whose connections speak the MySQL API
+        """
+        in_memory = path is None
+        if in_memory:
+            path = f'file:fyp-{uuid.uuid4().hex}?mode=memory&cache=shared'
+
+        def connect():
+            # Writers wait for each other instead of failing straight away
+            conn = sqlite3.connect(path, uri=path.startswith('file:'), check_same_thread=False,
+                                   timeout=SQLITE_BUSY_TIMEOUT)
+            conn.execute("PRAGMA foreign_keys = ON")
+            return SQLiteConnection(conn)
+
+        manager = cls(connect=connect, **pool_args)
+
+        # Shared in-memory databases vanish once their last connection closes
+        manager._keeper = connect()
+        if not in_memory:
+            # Readers don't block on the writer, as with InnoDB
+            manager._keeper.execute("PRAGMA journal_mode = WAL")
+        if schema:
+            manager._keeper.executescript(schema)
+            manager._keeper.commit()
+        return manager
+
+    def get_connection(self):
+        """
+        Check out a connection from the pool
+
+        Use it as a context manager, or call close() to return it:
+
+            with db_manager.get_connection() as db:
+                cursor = db.cursor(dictionary=True)
+                ...
+        """
+        return PooledConnection(self.pool, self.pool.acquire())
+
+    def stats(self):
+        """Return pool counters"""
+        return self.pool.stats()
+
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.close_all()
+        keeper = getattr(self, '_keeper', None)
+        if keeper is not None:
+            keeper.close()
+            self._keeper = None
+        print("Database connection pool closed")
@@ -0,0 +1,126 @@
+"""
+Expression Catalog
+
+In-memory copy of the ``expressions`` table, including the driving video for
+each expression. The list is effectively static reference data, so it is
+loaded once and served from memory with a version stamp (also used as the
+HTTP ETag) until an admin change invalidates it, or ``ttl`` seconds pass so
+changes made by another process are picked up.
+
+Both the web process and the workers resolve expressions through the
+installed catalog, so the generator always uses the same driving videos the
+catalog advertises. Kept free of the inference stack so the web process can
+use it without importing torch.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+CATALOG_TTL = 300  # Seconds before the catalog is re-read from the database
+
+# Default driving videos, used when no catalog is installed or an
+# expression row has no driving_video_path
+EXPRESSION_VIDEOS = {
+    'smile': './expressions/smile.mp4',
+    'angry': './expressions/angry.mp4',
+    'surprised': './expressions/surprised.mp4',
+    'sad': './expressions/sad.mp4'
+}
+
+
+class CatalogSnapshot:
+    def __init__(self, expressions):
+        """Immutable view of the catalog at one version"""
+        self.expressions = expressions
+        self.by_id = {row['expression_id']: row for row in expressions}
+        self.videos = {
+            row['expression_name']: row.get('driving_video_path') or EXPRESSION_VIDEOS.get(row['expression_name'])
+            for row in expressions
+        }
+        payload = json.dumps(expressions, default=str, sort_keys=True).encode()
+        self.version = hashlib.sha256(payload).hexdigest()[:16]
+        self.loaded_at = time.monotonic()
+
+
+class ExpressionCatalog:
+    def __init__(self, db_manager, ttl=CATALOG_TTL):
+        """
+        Cached expression list and name -> driving video mapping
+
+        Args:
+            db_manager: DatabaseConnection used to load the expressions table
+            ttl: Seconds a loaded snapshot is trusted
+        """
+        self.db_manager = db_manager
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+        self.loads = 0
+        self.hits = 0
+
+    def snapshot(self):
+        """Current catalog, reloading it if invalidated or expired"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot.loaded_at < self.ttl:
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.monotonic() - snapshot.loaded_at >= self.ttl:
+                snapshot = self._load()
+                self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self):
+        """Drop the cached copy; call after any change to the expressions table"""
+        with self._lock:
+            self._snapshot = None
+
+    def get(self, expression_id):
+        """Expression row by id, or None"""
+        try:
+            return self.snapshot().by_id.get(int(expression_id))
+        except (TypeError, ValueError):
+            return None
+
+    def video_path(self, expression_name):
+        """Configured driving video for an expression name, or None"""
+        return self.snapshot().videos.get(expression_name)
+
+    def _load(self):
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT expression_id, expression_name, expression_description, driving_video_path
+                FROM expressions
+                ORDER BY expression_name
+            """)
+            expressions = cursor.fetchall()
+        self.loads += 1
+        return CatalogSnapshot(expressions)
+
+
+_catalog = None
+
+
+def set_expression_catalog(catalog):
+    """Install the catalog used to resolve expression driving videos"""
+    global _catalog
+    _catalog = catalog
+
+
+def expression_video_path(expression_type):
+    """Driving video for a predefined expression, checking that it exists"""
+    driving_video_path = _catalog.video_path(expression_type) if _catalog else EXPRESSION_VIDEOS.get(expression_type)
+
+    if driving_video_path is None:
+        raise ValueError(f"Unknown expression type: {expression_type}")
+
+    if not os.path.exists(driving_video_path):
+        raise FileNotFoundError(f"Expression video not found: {driving_video_path}")
+    return driving_video_path
@@ -0,0 +1,385 @@
+"""
+CPU Inference Backends
+
+Our nodes have no GPU, so the OcclusionAwareGenerator forward pass on CPU is
+the production hot path. This module builds alternative execution backends
+for it:
+
+    eager         the model as loaded by load_checkpoints (fp32)
+    onnx          exported ONNX graphs run by onnxruntime (see onnx_backend)
+    torchscript   traced and frozen TorchScript (fp32)
+    compile       torch.compile with the inductor backend (fp32)
+    static_int8   the encoder/decoder convolution blocks statically
+                  quantized to int8 with calibration on stock driving frames;
+                  dense motion estimation stays fp32; traced
+
+Apart from onnx, only the generator is converted. The keypoint detector
+stays eager so the driving keypoints and avatar features cached on disk are
+valid for every backend.
+
+There is no dynamic int8 backend: torch.ao dynamic quantization only covers
+Linear and RNN layers, and vox-256 is fully convolutional, so it would
+quantize nothing. static_int8 is the quantized option.
+
+The first build of a backend is validated against eager (PSNR of the
+predicted frames on a sample of stock driving frames) and saved under
+``cache/backends/<checkpoint hash>_<backend>_torch<version>/``; later loads
+reuse it. torch.compile output can't be serialised, so ``compile`` uses
+inductor's on-disk graph cache instead.
+
+The backend is chosen with the ANIMATION_BACKEND environment variable, which
+web and worker processes must share because result cache keys name it.
+Compare backends on this machine with:
+
+    python inference_backends.py --backends eager torchscript static_int8 --batch-size 8
+"""
+
+import copy
+import json
+import math
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from content_hash import cached_file_hash
+
+BACKENDS = ('eager', 'torchscript', 'compile', 'static_int8', 'onnx')
+BACKEND_CACHE_DIR = './cache/backends'
+MIN_PSNR = 30.0     # dB against eager below which a backend is rejected
+SAMPLE_FRAMES = 12  # Driving frames used for tracing, calibration and checks
+TRACE_BATCH = 2     # Batch size traced with; checks then run at another size
+CHECK_BATCH = 3
+
+# Generator blocks without data-dependent control flow, which FX can quantize
+STATIC_QUANT_BLOCKS = ('first', 'down_blocks', 'bottleneck', 'up_blocks', 'final')
+
+
+class BackendQualityError(Exception):
+    """A backend's output differs too much from eager"""
+
+
+class GeneratorAdapter(nn.Module):
+    def __init__(self, generator, with_jacobian):
+        """Tensor-only signature around the generator, as tracing requires"""
+        super().__init__()
+        self.generator = generator
+        self.with_jacobian = with_jacobian
+
+    def forward(self, source, *keypoints):
+        if self.with_jacobian:
+            source_value, source_jacobian, driving_value, driving_jacobian = keypoints
+            kp_source = {'value': source_value, 'jacobian': source_jacobian}
+            kp_driving = {'value': driving_value, 'jacobian': driving_jacobian}
+        else:
+            source_value, driving_value = keypoints
+            kp_source = {'value': source_value}
+            kp_driving = {'value': driving_value}
+        return self.generator(source, kp_source=kp_source, kp_driving=kp_driving)['prediction']
+
+
+class TracedGenerator(nn.Module):
+    def __init__(self, module, with_jacobian):
+        """Give a traced generator back the eager generator's call signature"""
+        super().__init__()
+        self.module = module
+        self.with_jacobian = with_jacobian
+
+    def forward(self, source_image, kp_driving, kp_source):
+        return {'prediction': self.module(source_image, *flatten_keypoints(kp_source, kp_driving,
+                                                                           self.with_jacobian))}
+
+
+def flatten_keypoints(kp_source, kp_driving, with_jacobian):
+    """Keypoint dicts as the positional tensors GeneratorAdapter takes"""
+    if with_jacobian:
+        return kp_source['value'], kp_source['jacobian'], kp_driving['value'], kp_driving['jacobian']
+    return kp_source['value'], kp_driving['value']
+
+
+def _expand(kp, n):
+    return {name: value.expand(n, *value.shape[1:]) for name, value in kp.items()}
+
+
+def sample_inputs(face_generator, num_frames=SAMPLE_FRAMES, video_path=None):
+    """
+    Real driving frames and keypoints for tracing, calibration and checks
+
+    The first frame of a stock expression video is the source; the
+    following frames drive it. Falls back to noise if the video is missing,
+    which is fine for tracing but makes the PSNR check meaningless.
+
+    Returns:
+        tuple: (source (1, 3, 256, 256), source keypoints, driving keypoints (num_frames, ...))
+    """
+    from expression_catalog import EXPRESSION_VIDEOS
+    from keypoint_cache import get_keypoint_cache
+
+    video_path = video_path or EXPRESSION_VIDEOS['smile']
+    if os.path.exists(video_path):
+        cached = get_keypoint_cache().get_or_build(video_path, face_generator)
+        frames = np.array(cached.frames[:num_frames + 1])
+    else:
+        print(f"Warning: {video_path} not found; using random frames as backend sample")
+        frames = np.random.default_rng(0).random((num_frames + 1, 256, 256, 3), dtype=np.float32)
+
+    with torch.no_grad():
+        batch = torch.from_numpy(np.ascontiguousarray(frames)).permute(0, 3, 1, 2).to(face_generator.device)
+        kp = face_generator.kp_detector(batch)
+    return batch[:1], {name: v[:1] for name, v in kp.items()}, {name: v[1:] for name, v in kp.items()}
+
+
+def predict(generator, sample, batch_size=CHECK_BATCH):
+    """Run a generator over every driving frame of a sample"""
+    source, kp_source, kp_driving = sample
+    num_frames = kp_driving['value'].shape[0]
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, num_frames, batch_size):
+            kp = {name: v[start:start + batch_size] for name, v in kp_driving.items()}
+            n = kp['value'].shape[0]
+            out = generator(source.expand(n, -1, -1, -1), kp_source=_expand(kp_source, n), kp_driving=kp)
+            outputs.append(out['prediction'].cpu().numpy())
+    return np.concatenate(outputs)
+
+
+def psnr(reference, candidate):
+    """Peak signal-to-noise ratio in dB of frames in [0, 1]"""
+    mse = float(np.mean((np.asarray(reference, dtype=np.float64) - candidate) ** 2))
+    return math.inf if mse == 0 else 10 * math.log10(1 / mse)
+
+
+def check_backend_quality(eager_generator, backend_generator, sample, min_psnr=MIN_PSNR):
+    """
+    Compare a backend's predictions with eager on the same sample
+
+    Returns:
+        float: PSNR in dB
+
+    Raises:
+        BackendQualityError: If the PSNR is below min_psnr
+    """
+    score = psnr(predict(eager_generator, sample), predict(backend_generator, sample))
+    if score < min_psnr:
+        raise BackendQualityError(f"PSNR {score:.1f} dB against eager is below {min_psnr} dB")
+    return score
+
+
+def backend_dir(checkpoint_path, backend, cache_dir=BACKEND_CACHE_DIR):
+    """Cache folder for one backend build of a checkpoint"""
+    return os.path.join(cache_dir, f'{cached_file_hash(checkpoint_path)[:16]}_{backend}_torch{torch.__version__}')
+
+
+def load_backend(face_generator, backend, cache_dir=BACKEND_CACHE_DIR, min_psnr=MIN_PSNR):
+    """
+    Return the generator module to use for a backend, building it once
+
+    Args:
+        face_generator: FaceAnimationGenerator with the eager model loaded
+        backend: One of BACKENDS
+        cache_dir: Folder for built backends
+
+    Returns:
+        nn.Module: Callable like the eager generator
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (choose from {', '.join(BACKENDS)})")
+    eager = face_generator.generator
+    if backend == 'eager':
+        return eager
+    if face_generator.device.type != 'cpu':
+        raise ValueError(f"The {backend} backend is for CPU inference; use eager on {face_generator.device}")
+
+    if backend == 'compile':
+        return _compile(eager, face_generator, cache_dir, min_psnr)
+    if backend == 'onnx':
+        from onnx_backend import export_onnx, load_onnx_models
+        export_onnx(face_generator, min_psnr=min_psnr)
+        return load_onnx_models(face_generator.checkpoint_path)[0]
+
+    directory = backend_dir(face_generator.checkpoint_path, backend, cache_dir)
+    model_path = os.path.join(directory, 'generator.pt')
+    with_jacobian = has_jacobian(face_generator)
+
+    if os.path.exists(model_path):
+        module = torch.jit.load(model_path, map_location=face_generator.device)
+        return TracedGenerator(module, with_jacobian).eval()
+
+    started = time.perf_counter()
+    sample = sample_inputs(face_generator)
+    converted = _convert(eager, backend, sample)
+    module = _trace(converted, sample, with_jacobian)
+    generator = TracedGenerator(module, with_jacobian).eval()
+    score = check_backend_quality(eager, generator, sample, min_psnr)
+
+    # Write then rename so concurrent workers never load a partial build
+    scratch = f'{directory}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(scratch)
+    torch.jit.save(module, os.path.join(scratch, 'generator.pt'))
+    with open(os.path.join(scratch, 'meta.json'), 'w') as f:
+        json.dump({'backend': backend, 'psnr': score, 'torch': torch.__version__,
+                   'build_seconds': time.perf_counter() - started}, f)
+    try:
+        os.replace(scratch, directory)
+    except OSError:
+        # Another worker finished the same build first
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(f"Built {backend} backend: PSNR {score:.1f} dB against eager "
+          f"({time.perf_counter() - started:.0f}s)")
+    return generator
+
+
+def has_jacobian(face_generator):
+    """Whether the model's keypoints carry jacobians"""
+    with torch.no_grad():
+        probe = torch.zeros(1, 3, 256, 256, device=face_generator.device)
+        return 'jacobian' in face_generator.kp_detector(probe)
+
+
+def _convert(eager, backend, sample):
+    if backend == 'torchscript':
+        return eager
+    return _static_int8(eager, sample)
+
+
+def trace_inputs(sample, with_jacobian, batch_size=TRACE_BATCH):
+    """Example GeneratorAdapter inputs for tracing or export"""
+    source, kp_source, kp_driving = sample
+    kp = {name: v[:batch_size] for name, v in kp_driving.items()}
+    n = kp['value'].shape[0]
+    return (source.expand(n, -1, -1, -1).contiguous(),
+            *flatten_keypoints(_expand(kp_source, n), kp, with_jacobian))
+
+
+def _trace(generator, sample, with_jacobian):
+    inputs = trace_inputs(sample, with_jacobian)
+    with torch.no_grad():
+        traced = torch.jit.trace(GeneratorAdapter(generator, with_jacobian).eval(), inputs,
+                                 check_trace=False)
+    return torch.jit.freeze(traced.eval())
+
+
+def _static_int8(eager, sample):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    model = copy.deepcopy(eager).eval()
+    blocks = []
+    for name in STATIC_QUANT_BLOCKS:
+        child = getattr(model, name, None)
+        if isinstance(child, nn.ModuleList):
+            blocks.extend((child, index, block) for index, block in enumerate(child))
+        elif child is not None:
+            blocks.append((model, name, child))
+
+    # Capture one real input per block to give FX its example shapes
+    example_inputs = {}
+
+    def capture(i):
+        def hook(module, args):
+            example_inputs.setdefault(i, args)
+        return hook
+
+    hooks = [block.register_forward_pre_hook(capture(i)) for i, (_, _, block) in enumerate(blocks)]
+    try:
+        predict(model, sample)
+    finally:
+        for hook in hooks:
+            hook.remove()
+
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = []
+    for i, (parent, key, block) in enumerate(blocks):
+        module = prepare_fx(block, qconfig_mapping, example_inputs[i])
+        _set_child(parent, key, module)
+        prepared.append((parent, key, module))
+
+    predict(model, sample)  # Calibrate activation ranges
+
+    for parent, key, module in prepared:
+        _set_child(parent, key, convert_fx(module))
+    return model
+
+
+def _set_child(parent, key, module):
+    if isinstance(key, int):
+        parent[key] = module
+    else:
+        setattr(parent, key, module)
+
+
+def _compile(eager, face_generator, cache_dir, min_psnr):
+    import torch._inductor.config as inductor_config
+
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(os.path.join(cache_dir, 'inductor')))
+    inductor_config.fx_graph_cache = True
+
+    compiled = torch.compile(eager, dynamic=True)
+    started = time.perf_counter()
+    # Compiles now (or loads from inductor's cache) rather than on the first job
+    score = check_backend_quality(eager, compiled, sample_inputs(face_generator), min_psnr)
+    print(f"Compiled generator: PSNR {score:.1f} dB against eager "
+          f"({time.perf_counter() - started:.0f}s)")
+    return compiled
+
+
+def benchmark_backend(generator, sample, batch_size, repeats=3):
+    """Generated frames per second over a sample, after one warm-up run"""
+    predict(generator, sample, batch_size)
+    num_frames = sample[2]['value'].shape[0]
+    started = time.perf_counter()
+    for _ in range(repeats):
+        predict(generator, sample, batch_size)
+    return num_frames * repeats / (time.perf_counter() - started)
+
+
+def _benchmark(backends, batch_size, num_frames, repeats, threads):
+    from model_registry import DEFAULT_CHECKPOINT_PATH, DEFAULT_CONFIG_PATH
+    from animation_generator import FaceAnimationGenerator
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    face_generator = FaceAnimationGenerator(DEFAULT_CONFIG_PATH, DEFAULT_CHECKPOINT_PATH,
+                                            batch_size=batch_size, backend='eager')
+    if face_generator.generator is None:
+        raise SystemExit("Model not loaded")
+
+    eager = face_generator.generator
+    sample = sample_inputs(face_generator, num_frames)
+    reference = predict(eager, sample, batch_size)
+    baseline = None
+
+    print(f"{'backend':<14} {'load s':>8} {'PSNR dB':>8} {'frames/s':>9} {'speedup':>8}")
+    for backend in backends:
+        try:
+            started = time.perf_counter()
+            generator = load_backend(face_generator, backend, min_psnr=0)
+            load_seconds = time.perf_counter() - started
+            score = psnr(reference, predict(generator, sample, batch_size))
+            fps = benchmark_backend(generator, sample, batch_size, repeats)
+        except Exception as e:
+            print(f"{backend:<14} failed: {e}")
+            continue
+        baseline = baseline or (fps if backend == 'eager' else None)
+        speedup = f"{fps / baseline:7.2f}x" if baseline else '       -'
+        print(f"{backend:<14} {load_seconds:8.1f} {score:8.1f} {fps:9.2f} {speedup:>8}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark CPU inference backends against eager')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=SAMPLE_FRAMES)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads (default: torch decides)')
+    args = parser.parse_args()
+
+    _benchmark(args.backends, args.batch_size, args.frames, args.repeats, args.threads)
@@ -0,0 +1,260 @@
+"""
+Job Status Events
+
+Publish/subscribe channel for animation job status changes, keyed by user.
+Workers publish each status transition and progress update; the web
+process forwards a user's events to their browser over Server-Sent Events
+(``/api/animations/events``), so the dashboard doesn't poll the database.
+
+The default bus is in-process: it reaches browsers connected to the same
+process as the workers (``ANIMATION_WORKERS_INLINE``). When workers run as
+separate ``animation_worker.py`` processes their events never reach the web
+process, so each web process runs one JobStatusRelay, which turns changes
+in subscribed users' ``animations`` rows into the same events on its own
+bus. Streams only ever wait on the bus, whichever way events arrive. Anything
+with the same ``subscribe``/``publish`` methods can be installed instead
+with ``set_job_event_bus``, e.g. a stand-in that records events in tests
+or a broker-backed bus.
+"""
+
+import json
+import threading
+from collections import deque
+
+MAX_PENDING_EVENTS = 100  # Events buffered per subscriber; the oldest are dropped first
+RELAY_INTERVAL = 2         # Seconds between JobStatusRelay checks
+TERMINAL_STATUSES = ('completed', 'failed')
+
+
+class Subscription:
+    def __init__(self, bus, user_id, max_pending=MAX_PENDING_EVENTS):
+        """One listener's queue of events for a user"""
+        self.bus = bus
+        self.user_id = user_id
+        self._events = deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def put(self, event):
+        with self._condition:
+            # A full queue drops its oldest event, so a slow browser
+            # loses stale progress updates rather than blocking workers
+            self._events.append(event)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait for the next event
+
+        Returns:
+            dict: The event, or None on timeout or once closed
+        """
+        with self._condition:
+            if not self._events and not self.closed:
+                self._condition.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+    def close(self):
+        """Stop receiving events"""
+        self.bus.unsubscribe(self)
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JobEventBus:
+    def __init__(self, max_pending=MAX_PENDING_EVENTS):
+        """In-process fan-out of job events to each user's subscribers"""
+        self.max_pending = max_pending
+        self._subscribers = {}  # user_id -> set of Subscription
+        self._lock = threading.Lock()
+
+        self.published = 0
+
+    def subscribe(self, user_id):
+        """Start receiving a user's events"""
+        subscription = Subscription(self, user_id, self.max_pending)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event):
+        """Deliver an event to every current subscriber of a user"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self.published += 1
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscribed_users(self):
+        """Users with at least one subscriber"""
+        with self._lock:
+            return set(self._subscribers)
+
+    def stats(self):
+        """Snapshot of bus counters"""
+        with self._lock:
+            return {
+                'published': self.published,
+                'subscribers': sum(len(subs) for subs in self._subscribers.values())
+            }
+
+
+class JobStatusRelay:
+    def __init__(self, db_manager, interval=RELAY_INTERVAL, bus=None):
+        """
+        Publishes job events on behalf of workers in other processes
+
+        One thread per web process reads the ``animations`` rows of users
+        with an open event stream and publishes their changes to the
+        in-process bus, so each stream only waits on its subscription and
+        the query count doesn't grow with the number of open streams.
+
+        Args:
+            db_manager: DatabaseConnection
+            interval: Seconds between checks while anyone is subscribed
+            bus: Bus to publish to (default: the installed job_events bus)
+        """
+        self.db_manager = db_manager
+        self.interval = interval
+        self.bus = bus
+        self.last_animation_id = None
+        self._seen = {}  # animation_id -> (user_id, state last published)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start the relay thread unless it is running; call before reading a stream's initial rows"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            # Rows created from here on are reported even if they finish between two checks
+            with self.db_manager.get_connection() as db:
+                cursor = db.cursor()
+                cursor.execute("SELECT MAX(animation_id) FROM animations")
+                self.last_animation_id = cursor.fetchone()[0] or 0
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='job-status-relay', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the relay thread"""
+        self._stopping.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def watch(self, user_id, rows):
+        """
+        Track jobs a newly connected stream was sent, so their next change is published
+
+        Args:
+            user_id: Owner of the rows
+            rows: Rows (animation_id, status, progress, error_message)
+        """
+        with self._lock:
+            for row in rows:
+                self._seen.setdefault(row['animation_id'], (user_id, self._state(row)))
+
+    def poll(self):
+        """
+        Check subscribed users' jobs once and publish what changed
+
+        Returns:
+            int: Events published
+        """
+        bus = self.bus or get_job_event_bus()
+        user_ids = sorted(bus.subscribed_users())
+        with self._lock:
+            # Forget jobs of users whose streams have all closed
+            self._seen = {animation_id: seen for animation_id, seen in self._seen.items()
+                          if seen[0] in user_ids}
+            watched = list(self._seen)
+        if not user_ids:
+            return 0
+
+        in_users = ', '.join(['%s'] * len(user_ids))
+        in_watched = f" OR animation_id IN ({', '.join(['%s'] * len(watched))})" if watched else ''
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT animation_id, user_id, status, progress, error_message FROM animations
+                WHERE user_id IN ({in_users})
+                  AND (status IN ('queued', 'processing') OR animation_id > %s{in_watched})
+                ORDER BY animation_id
+            """, (*user_ids, self.last_animation_id, *watched))
+            rows = cursor.fetchall()
+
+        published = 0
+        for row in rows:
+            animation_id = row['animation_id']
+            state = self._state(row)
+            with self._lock:
+                self.last_animation_id = max(self.last_animation_id, animation_id)
+                changed = self._seen.get(animation_id, (None, None))[1] != state
+                if row['status'] in TERMINAL_STATUSES:
+                    self._seen.pop(animation_id, None)
+                else:
+                    self._seen[animation_id] = (row['user_id'], state)
+            if changed:
+                bus.publish(row['user_id'], job_event(animation_id, *state))
+                published += 1
+        return published
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # Streams carry on; the next check catches up
+                print(f"Job status relay error: {e}")
+
+    @staticmethod
+    def _state(row):
+        return row['status'], row['progress'], row['error_message']
+
+
+def job_event(animation_id, status, progress=None, error_message=None):
+    """Build the event published for a job status change"""
+    event = {'animation_id': animation_id, 'status': status}
+    if progress is not None:
+        event['progress'] = progress
+    if error_message is not None:
+        event['error_message'] = error_message
+    return event
+
+
+def format_sse(event, event_type='status'):
+    """Encode an event as one Server-Sent Events message"""
+    return f'event: {event_type}\ndata: {json.dumps(event, default=str)}\n\n'
+
+
+_bus = JobEventBus()
+
+
+def get_job_event_bus():
+    """Return the installed job event bus"""
+    return _bus
+
+
+def set_job_event_bus(bus):
+    """Install the bus workers publish to and the web process listens on"""
+    global _bus
+    _bus = bus
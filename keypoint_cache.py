@@ -0,0 +1,199 @@
+"""
+Driving Video Keypoint Cache
+
+The stock expression videos are the same for every job, yet each job used to
+decode them, resize every frame and run the keypoint detector over them. This
+module does that work once per (video content, model checkpoint, keypoint
+detector backend) and stores the result as memory-mapped .npy files:
+
+    cache/keypoints/<video hash>_<checkpoint hash>[_<backend>]/
+        frames.npy        resized float32 driving frames (N, 256, 256, 3)
+        kp_value.npy      driving keypoints (N, K, 2)
+        kp_jacobian.npy   driving jacobians (N, K, 2, 2), if the model has them
+        meta.json         fps, frame count, hull area of the first frame
+
+Only the onnx backend replaces the keypoint detector, so entries for any
+other backend are shared and carry no backend suffix.
+
+Entries are built on demand by the first job that needs them, or ahead of
+time with:
+
+    python keypoint_cache.py
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+from content_hash import cached_file_hash
+from service_metrics import register_collector, stats_families
+
+CACHE_DIR = './cache/keypoints'
+
+
+class DrivingKeypoints:
+    def __init__(self, directory):
+        """
+        Memory-mapped view of one cache entry
+
+        Arrays are opened read-only with mmap, so several workers share the
+        same pages and nothing is read until it is used.
+        """
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+
+        self.directory = directory
+        self.fps = meta['fps']
+        self.num_frames = meta['num_frames']
+        self.hull_area = meta['hull_area']
+        self.frames = np.load(os.path.join(directory, 'frames.npy'), mmap_mode='r')
+        self.values = np.load(os.path.join(directory, 'kp_value.npy'), mmap_mode='r')
+
+        jacobian_path = os.path.join(directory, 'kp_jacobian.npy')
+        self.jacobians = np.load(jacobian_path, mmap_mode='r') if os.path.exists(jacobian_path) else None
+
+
+class KeypointCache:
+    def __init__(self, cache_dir=CACHE_DIR):
+        """
+        On-disk cache of driving keypoints keyed by video and checkpoint hash
+        and keypoint detector backend
+
+        Args:
+            cache_dir: Folder holding one sub-folder per cache entry
+        """
+        self.cache_dir = cache_dir
+        self._entries = {}  # entry directory -> DrivingKeypoints
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, video_path, generator):
+        """
+        Return cached driving keypoints, computing them if missing
+
+        Args:
+            video_path: Path to the driving video
+            generator: Loaded FaceAnimationGenerator (for kp_detector, its
+                       backend and checkpoint)
+
+        Returns:
+            DrivingKeypoints: Memory-mapped frames, keypoints and metadata
+        """
+        directory = self.entry_dir(video_path, generator.checkpoint_path, generator.kp_backend)
+
+        with self._lock:
+            entry = self._entries.get(directory)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            build_lock = self._build_locks.setdefault(directory, threading.Lock())
+
+        with build_lock:
+            if not os.path.exists(os.path.join(directory, 'meta.json')):
+                self.misses += 1
+                self._build(video_path, generator, directory)
+            else:
+                self.hits += 1
+
+            entry = DrivingKeypoints(directory)
+            with self._lock:
+                self._entries[directory] = entry
+            return entry
+
+    def entry_dir(self, video_path, checkpoint_path, kp_backend='eager'):
+        """Cache folder for a video/checkpoint/keypoint detector backend combination"""
+        # Hashing a large checkpoint is slow, so digests are memoised per file version
+        video_hash = cached_file_hash(video_path)
+        checkpoint_hash = cached_file_hash(checkpoint_path)
+        suffix = '' if kp_backend == 'eager' else f'_{kp_backend}'
+        return os.path.join(self.cache_dir, f'{video_hash[:16]}_{checkpoint_hash[:16]}{suffix}')
+
+    def _build(self, video_path, generator, directory):
+        import imageio
+        from scipy.spatial import ConvexHull
+        from animation_generator import iter_chunks, read_frames
+        from frame_preprocessing import resize_batch
+
+        print(f"Building keypoint cache for {video_path}")
+
+        reader = imageio.get_reader(video_path)
+        fps = reader.get_meta_data()['fps']
+        try:
+            chunks = [resize_batch(chunk) for chunk in iter_chunks(read_frames(reader), 32)]
+        finally:
+            reader.close()
+
+        if not chunks:
+            raise ValueError(f"No frames could be read from {video_path}")
+
+        frames = np.concatenate(chunks)
+        values, jacobians = generator.detect_keypoints(frames)
+        hull_area = float(ConvexHull(values[0]).volume)
+
+        # Write into a scratch folder and rename, so readers never see a partial entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        scratch = f'{directory}.tmp-{uuid.uuid4().hex}'
+        os.makedirs(scratch)
+        try:
+            np.save(os.path.join(scratch, 'frames.npy'), frames)
+            np.save(os.path.join(scratch, 'kp_value.npy'), values.astype(np.float32))
+            if jacobians is not None:
+                np.save(os.path.join(scratch, 'kp_jacobian.npy'), jacobians.astype(np.float32))
+            with open(os.path.join(scratch, 'meta.json'), 'w') as f:
+                json.dump({
+                    'video_path': video_path,
+                    'checkpoint_path': generator.checkpoint_path,
+                    'kp_backend': generator.kp_backend,
+                    'fps': fps,
+                    'num_frames': len(frames),
+                    'hull_area': hull_area
+                }, f)
+            os.replace(scratch, directory)
+        except OSError:
+            # Another process finished the same entry first
+            shutil.rmtree(scratch, ignore_errors=True)
+            if not os.path.exists(os.path.join(directory, 'meta.json')):
+                raise
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self._lock:
+            return {'entries_loaded': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_keypoint_cache():
+    """Return the process-wide KeypointCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = KeypointCache()
+            register_collector('keypoint_cache', lambda: stats_families(
+                'animation_keypoint_cache', _cache.stats(), counters=('hits', 'misses'),
+                gauges=('entries_loaded',), ratio=('hits', 'misses')))
+        return _cache
+
+
+if __name__ == '__main__':
+    from expression_catalog import EXPRESSION_VIDEOS
+    from model_registry import get_model_registry
+
+    generator = get_model_registry().get()
+    cache = get_keypoint_cache()
+
+    for expression, path in EXPRESSION_VIDEOS.items():
+        if not os.path.exists(path):
+            print(f"Skipping {expression}: {path} not found")
+            continue
+        entry = cache.get_or_build(path, generator)
+        print(f"{expression}: {entry.num_frames} frames cached in {entry.directory}")
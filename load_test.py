@@ -0,0 +1,394 @@
+"""
+HTTP Load Test
+
+Boots app.py on a local port against a SQLite copy of database_schema.sql
+and a fake, fast animation task runner, then drives mixed traffic from many
+concurrent sessions over real HTTP:
+
+    python load_test.py --users 50 --duration 30 --output results.json
+    python load_test.py --users 50 --duration 30 --compare results.json
+
+Each virtual user signs up, logs in and uploads an avatar, then repeatedly
+picks a weighted action (listings, expressions, generate and poll, profile,
+another upload, a fresh login) with a short think time until the run ends.
+Latency percentiles and errors are reported per route and saved as JSON so
+runs can be compared across changes; ``--compare`` prints the p95 change per
+route against an earlier run.
+
+No MySQL, model or GPU is needed. Everything the app writes goes to a
+temporary folder.
+"""
+
+import json
+import logging
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from datetime import datetime
+from http.cookiejar import CookieJar
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Relative frequency of each action once a user is set up
+ACTION_WEIGHTS = {
+    'list_avatars': 25,
+    'list_animations': 20,
+    'expressions': 15,
+    'generate': 12,
+    'profile': 10,
+    'dashboard': 8,
+    'upload': 5,
+    'login': 5,
+}
+AVATAR_VARIANTS = 8      # Distinct avatar images, so some generations hit the result cache
+STATUS_POLLS = 5         # Status checks after each generate call
+REQUEST_TIMEOUT = 30
+
+
+def tiny_png(variant, size=64):
+    """A small valid PNG gradient; one distinct image per variant"""
+    rows = b''.join(
+        b'\x00' + bytes((x * 4 + variant * 31) % 256 for x in range(size) for _ in range(3))
+        for _ in range(size)
+    )
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def fake_task_runner(delay):
+    """Stands in for process_animation_task: waits ``delay`` seconds and writes a stub file"""
+    def run(avatar_path, expression_or_video, output_path, task_type='expression',
+            progress_callback=None, **kwargs):
+        time.sleep(delay / 2)
+        if progress_callback:
+            progress_callback(50)
+        time.sleep(delay / 2)
+        with open(output_path, 'wb') as f:
+            f.write(b'\x00' * 1024)
+        return {'status': 'success', 'output_path': output_path,
+                'message': 'Animation generated successfully',
+                'metrics': {'total_seconds': delay, 'frames': 0, 'stages': {}}}
+    return run
+
+
+def fake_ingest(avatar_path):
+    return {'status': 'success', 'features_path': None, 'message': 'Avatar ingested successfully'}
+
+
+def boot_app(workdir, workers, task_delay):
+    """
+    Build the app on SQLite with a fake task runner and serve it on a free port
+
+    Returns:
+        tuple: (Flask app, werkzeug server)
+    """
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    media_root = os.path.join(workdir, 'static')
+    app = create_app('production', SQLITE_PATH=os.path.join(workdir, 'load_test.db'),
+                     MEDIA_ROOT=media_root, UPLOAD_FOLDER=os.path.join(media_root, 'uploads'),
+                     AVATARS_FOLDER=os.path.join(media_root, 'avatars'),
+                     ANIMATIONS_FOLDER=os.path.join(media_root, 'animations'),
+                     ANIMATION_WORKERS=workers, ANIMATION_WORKERS_INLINE=True)
+
+    worker_pool = app.extensions['face_animation'].worker_pool
+    worker_pool.task_runner = fake_task_runner(task_delay)
+    worker_pool.ingest_runner = fake_ingest
+    worker_pool.live_preview = False
+
+    # One access-log line per request would dominate the run
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-server', daemon=True).start()
+    return app, server
+
+
+class Recorder:
+    def __init__(self):
+        """Latencies, status codes and errors per route, shared by all users"""
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, status, error=None):
+        with self._lock:
+            entry = self.routes.setdefault(route, {'latencies': [], 'statuses': {}, 'errors': 0,
+                                                   'error_samples': []})
+            entry['latencies'].append(seconds)
+            entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+            if error:
+                entry['errors'] += 1
+                if len(entry['error_samples']) < 5:
+                    entry['error_samples'].append(error)
+
+    def summary(self, elapsed):
+        """Per-route count, throughput, latency percentiles (ms) and errors"""
+        routes = {}
+        with self._lock:
+            for route, entry in sorted(self.routes.items()):
+                latencies = sorted(entry['latencies'])
+                routes[route] = {
+                    'requests': len(latencies),
+                    'rps': round(len(latencies) / elapsed, 2),
+                    'p50_ms': _percentile(latencies, 50),
+                    'p95_ms': _percentile(latencies, 95),
+                    'p99_ms': _percentile(latencies, 99),
+                    'max_ms': round(latencies[-1] * 1000, 1),
+                    'errors': entry['errors'],
+                    'error_rate': round(entry['errors'] / len(latencies), 4),
+                    'statuses': entry['statuses'],
+                    'error_samples': entry['error_samples']
+                }
+        total = sum(route['requests'] for route in routes.values())
+        errors = sum(route['errors'] for route in routes.values())
+        return {
+            'requests': total,
+            'rps': round(total / elapsed, 2),
+            'errors': errors,
+            'error_rate': round(errors / total, 4) if total else 0.0,
+            'routes': routes
+        }
+
+
+def _percentile(sorted_values, percent):
+    # Nearest-rank percentile, in milliseconds
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[rank] * 1000, 1)
+
+
+class VirtualUser:
+    def __init__(self, base_url, index, recorder, rng, think_time):
+        """One browser session with its own cookie jar"""
+        self.base_url = base_url
+        self.index = index
+        self.recorder = recorder
+        self.rng = rng
+        self.think_time = think_time
+        self.email = f'load-{uuid.uuid4().hex[:12]}@example.com'
+        self.password = 'load-test-password'
+        self.avatar_ids = []
+        self.expression_ids = []
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, route, method, path, body=None, headers=None):
+        """
+        Send one request and record it under ``route``
+
+        Returns:
+            tuple: (status code, parsed JSON body or None)
+        """
+        request = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                         headers=headers or {})
+        started = time.perf_counter()
+        status, payload, error = None, None, None
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT) as response:
+                status, raw = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, raw = e.code, e.read()
+        except Exception as e:
+            raw, error = b'', f'{type(e).__name__}: {e}'
+        elapsed = time.perf_counter() - started
+
+        if raw and raw[:1] in (b'{', b'['):
+            try:
+                payload = json.loads(raw)
+            except ValueError:
+                pass
+        if error is None and (status is None or status >= 400):
+            error = f'HTTP {status}: {(payload or {}).get("message", "")}' if isinstance(payload, dict) \
+                else f'HTTP {status}'
+
+        self.recorder.record(route, elapsed, status, error)
+        return status, payload
+
+    def json(self, route, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else None
+        return self.request(route, method, path, body, {'Content-Type': 'application/json'})
+
+    # ----------------------------------------
+    # Setup
+    # ----------------------------------------
+    def signup(self):
+        self.json('POST /api/signup', 'POST', '/api/signup',
+                  {'fullname': f'Load User {self.index}', 'email': self.email, 'password': self.password})
+
+    def login(self):
+        self.json('POST /api/login', 'POST', '/api/login', {'email': self.email, 'password': self.password})
+
+    def upload(self):
+        boundary = uuid.uuid4().hex
+        image = tiny_png(self.rng.randrange(AVATAR_VARIANTS))
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="avatar"; filename="face.png"\r\n'
+                f'Content-Type: image/png\r\n\r\n').encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+        status, payload = self.request('POST /api/avatar/upload', 'POST', '/api/avatar/upload', body,
+                                       {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        if payload and payload.get('avatar_id'):
+            self.avatar_ids.append(payload['avatar_id'])
+
+    def expressions(self):
+        status, payload = self.request('GET /api/expressions', 'GET', '/api/expressions')
+        if payload and payload.get('expressions'):
+            self.expression_ids = [e['expression_id'] for e in payload['expressions']]
+
+    # ----------------------------------------
+    # Mixed traffic
+    # ----------------------------------------
+    def list_avatars(self):
+        self.request('GET /api/avatars', 'GET', '/api/avatars')
+
+    def list_animations(self):
+        self.request('GET /api/animations', 'GET', '/api/animations')
+
+    def profile(self):
+        self.request('GET /api/profile', 'GET', '/api/profile')
+
+    def dashboard(self):
+        self.request('GET /user', 'GET', '/user')
+
+    def generate(self):
+        if not self.avatar_ids or not self.expression_ids:
+            return
+        status, payload = self.json('POST /api/animation/generate', 'POST', '/api/animation/generate', {
+            'avatar_id': self.rng.choice(self.avatar_ids),
+            'expression_id': self.rng.choice(self.expression_ids)
+        })
+        if not payload or not payload.get('animation_id'):
+            return
+
+        for _ in range(STATUS_POLLS):
+            status, job = self.request('GET /api/animation/<id>/status', 'GET',
+                                       f"/api/animation/{payload['animation_id']}/status")
+            if not job or job.get('animation', {}).get('status') in ('completed', 'failed'):
+                break
+            time.sleep(self.think_time)
+
+    def run(self, deadline):
+        self.signup()
+        self.login()
+        self.expressions()
+        self.upload()
+
+        actions, weights = zip(*ACTION_WEIGHTS.items())
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(actions, weights)[0])()
+            time.sleep(self.rng.uniform(0, 2 * self.think_time))
+
+
+def run_load_test(users, duration, ramp_up, think_time, workers, task_delay, seed):
+    """
+    Boot the app, run the virtual users and summarise the results
+
+    Returns:
+        dict: Run configuration, totals and per-route statistics
+    """
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    app, server = boot_app(workdir, workers, task_delay)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    recorder = Recorder()
+
+    started = time.monotonic()
+    deadline = started + duration
+    threads = []
+    for i in range(users):
+        user = VirtualUser(base_url, i, recorder, random.Random(seed * 100003 + i), think_time)
+        thread = threading.Thread(target=user.run, args=(deadline,), name=f'load-user-{i}', daemon=True)
+        threads.append(thread)
+        # Stagger arrivals over the ramp-up period
+        delay = started + ramp_up * i / max(1, users) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        thread.start()
+
+    for thread in threads:
+        thread.join(deadline - time.monotonic() + REQUEST_TIMEOUT)
+    elapsed = time.monotonic() - started
+    server.shutdown()
+
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'config': {'users': users, 'duration': duration, 'ramp_up': ramp_up, 'think_time': think_time,
+                   'workers': workers, 'task_delay': task_delay, 'seed': seed,
+                   'db_pool_size': app.config['DB_POOL_SIZE'], 'python': sys.version.split()[0]},
+        'elapsed': round(elapsed, 2),
+        **recorder.summary(elapsed)
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    print(f"\n{results['requests']} requests in {results['elapsed']}s "
+          f"({results['rps']} req/s), {results['errors']} errors, "
+          f"{results['config']['users']} users, commit {results['commit']}")
+    header = f"{'route':<34} {'reqs':>6} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'errors':>7}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+
+    for route, stats in results['routes'].items():
+        line = (f"{route:<34} {stats['requests']:>6} {stats['rps']:>7} {stats['p50_ms']:>8} "
+                f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['max_ms']:>8} {stats['errors']:>7}")
+        previous = (baseline or {}).get('routes', {}).get(route)
+        if previous and previous.get('p95_ms'):
+            change = (stats['p95_ms'] - previous['p95_ms']) / previous['p95_ms']
+            line += f" {change:>+11.0%}"
+        print(line)
+
+    for route, stats in results['routes'].items():
+        for sample in stats['error_samples']:
+            print(f"  {route}: {sample}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load-test the Flask API with local stand-ins')
+    parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which users arrive')
+    parser.add_argument('--think-time', type=float, default=0.1, help='Mean seconds between a user\'s actions')
+    parser.add_argument('--workers', type=int, default=2, help='Animation worker threads')
+    parser.add_argument('--task-delay', type=float, default=0.05, help='Seconds the fake generator takes per job')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Save results as JSON to this file')
+    parser.add_argument('--compare', help='Earlier results JSON to compare p95 latency against')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run_load_test(args.users, args.duration, args.ramp_up, args.think_time, args.workers,
+                            args.task_delay, args.seed)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {args.output}")
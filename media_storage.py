@@ -0,0 +1,332 @@
+"""
+Media Storage Accounting and Reaper
+
+Every row that owns files under the media root records their total size in
+``size_bytes`` (avatars with their derivatives and features, animations,
+driving videos), and ``users.storage_bytes`` is adjusted by the same amount
+in the same transaction. Quotas are checked against that counter, so an
+upload never has to walk the user's folders.
+
+Files can still outlive their rows: deleting a user cascades its rows but
+leaves the files, failed jobs and crashed workers leave partial output,
+and abandoned chunked uploads never finish. StorageReaper reconciles the
+media folders with the database in batches:
+
+1. uploads still 'uploading' after ``upload_expiry`` are deleted
+2. each folder is listed with os.scandir, a batch of names at a time; one
+   query per referencing column returns which of them are still in use, and
+   the set difference is removed (files younger than ``grace_period`` are
+   skipped, as their row may not be committed yet)
+3. ``users.storage_bytes`` is recomputed from the rows' ``size_bytes`` to
+   correct any drift
+
+Workers run it periodically (``animation_worker.py --reap-interval``); it
+can also be run by hand:
+
+    python media_storage.py --media-root static --dry-run
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from avatar_ingest import FEATURES_SUFFIX
+
+MEDIA_ROOT = 'static'
+REAP_INTERVAL = 60 * 60    # Seconds between reaper runs in a worker process
+REAP_BATCH = 500           # Directory entries checked per query
+GRACE_PERIOD = 60 * 60     # Files modified more recently are never removed
+UPLOAD_EXPIRY = 24 * 3600  # Unfinished driving video uploads are dropped after this
+
+# Bytes each role may store; None is unlimited
+STORAGE_QUOTAS = {
+    'user': 1024 ** 3,
+    'subscriber': 10 * 1024 ** 3,
+    'admin': None,
+}
+
+# Folder under the media root -> (table, column, condition) whose values keep a file
+REFERENCES = {
+    'avatars': [
+        ('avatars', 'avatar_path', None),
+        ('avatars', 'thumbnail_path', None),
+        ('avatars', 'model_path', None),
+    ],
+    'animations': [
+        # A failed job's file is partial output
+        ('animations', 'animation_path', "status <> 'failed'"),
+        ('animation_results', 'animation_path', None),
+    ],
+    'uploads': [
+        ('driving_videos', 'upload_path', "status IN ('uploading', 'pending', 'processing')"),
+    ],
+    'driving_videos': [
+        ('driving_videos', 'video_path', None),
+    ],
+}
+
+# Tables whose size_bytes add up to users.storage_bytes
+USAGE_TABLES = ('avatars', 'animations', 'driving_videos')
+
+# Images whose features file may sit next to them
+FEATURE_OWNER_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+
+
+class QuotaExceededError(Exception):
+    """Raised when storing more would take a user over their quota"""
+
+    def __init__(self, used, quota):
+        super().__init__(f"Storage quota exceeded ({used} of {quota} bytes used)")
+        self.used = used
+        self.quota = quota
+
+
+def file_size(*paths):
+    """Combined size of the files that exist among paths"""
+    total = 0
+    for path in paths:
+        if path and os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def add_usage(cursor, user_id, delta):
+    """Adjust a user's stored bytes; commit together with the row's size_bytes change"""
+    if delta:
+        cursor.execute("UPDATE users SET storage_bytes = storage_bytes + %s WHERE user_id = %s",
+                       (delta, user_id))
+
+
+def check_quota(db, user_id, quota, incoming_bytes=0):
+    """
+    Make sure a user may store ``incoming_bytes`` more
+
+    Args:
+        db: Pooled connection
+        user_id: User about to store something
+        quota: Byte limit for the user's role, or None for unlimited
+        incoming_bytes: Size of what is about to be stored, if known
+
+    Raises:
+        QuotaExceededError: If usage has reached the quota or the incoming
+                            bytes would take it over
+    """
+    if quota is None:
+        return
+    cursor = db.cursor()
+    cursor.execute("SELECT storage_bytes FROM users WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    used = (row[0] if row else 0) or 0
+    if used >= quota or used + incoming_bytes > quota:
+        raise QuotaExceededError(used, quota)
+
+
+def reference_candidates(folder, name):
+    """Stored paths that keep ``folder/name`` alive"""
+    if name.endswith(FEATURES_SUFFIX):
+        stem = name[:-len(FEATURES_SUFFIX)]
+        return [f'{folder}/{stem}.{extension}' for extension in FEATURE_OWNER_EXTENSIONS]
+    return [f'{folder}/{name}']
+
+
+class StorageReaper:
+    def __init__(self, db_manager, media_root=MEDIA_ROOT, batch_size=REAP_BATCH,
+                 grace_period=GRACE_PERIOD, upload_expiry=UPLOAD_EXPIRY, dry_run=False):
+        """
+        Removes media files no row refers to and re-totals per-user storage
+
+        Args:
+            db_manager: DatabaseConnection
+            media_root: Folder that stored paths are relative to
+            batch_size: Directory entries checked per query
+            grace_period: Seconds a new file is left alone
+            upload_expiry: Seconds before an unfinished upload is dropped
+            dry_run: Only report what would be removed
+        """
+        self.db_manager = db_manager
+        self.media_root = media_root
+        self.batch_size = batch_size
+        self.grace_period = grace_period
+        self.upload_expiry = upload_expiry
+        self.dry_run = dry_run
+
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.files_removed = 0
+        self.bytes_removed = 0
+        self.uploads_expired = 0
+        self.last_run_seconds = 0.0
+
+    def run(self):
+        """
+        One full pass: expire uploads, reap every folder, re-total usage
+
+        Returns:
+            dict: files and bytes removed per folder, and uploads expired
+        """
+        started = time.perf_counter()
+        summary = {'uploads_expired': self.expire_uploads()}
+        for folder in REFERENCES:
+            summary[folder] = self.reap_folder(folder)
+        if not self.dry_run:
+            self.reconcile_usage()
+
+        with self._lock:
+            self.runs += 1
+            self.last_run_seconds = time.perf_counter() - started
+        return summary
+
+    def expire_uploads(self):
+        """Delete driving video uploads left unfinished for longer than upload_expiry"""
+        cutoff = datetime.now() - timedelta(seconds=self.upload_expiry)
+        expired = 0
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            while True:
+                cursor.execute("""
+                    SELECT video_id, user_id, upload_path, size_bytes FROM driving_videos
+                    WHERE status = 'uploading' AND created_at < %s
+                    ORDER BY video_id
+                    LIMIT %s
+                """, (cutoff, self.batch_size))
+                uploads = cursor.fetchall()
+                if not uploads or self.dry_run:
+                    expired += len(uploads)
+                    break
+
+                for upload in uploads:
+                    # Skip uploads finalized since the SELECT
+                    cursor.execute("DELETE FROM driving_videos WHERE video_id = %s AND status = 'uploading'",
+                                   (upload['video_id'],))
+                    if cursor.rowcount != 1:
+                        continue
+                    add_usage(cursor, upload['user_id'], -(upload['size_bytes'] or 0))
+                    db.commit()
+                    expired += 1
+
+                    path = os.path.join(self.media_root, upload['upload_path'])
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        if expired:
+            with self._lock:
+                self.uploads_expired += expired
+            print(f"{'Would expire' if self.dry_run else 'Expired'} {expired} unfinished driving video uploads")
+        return expired
+
+    def reap_folder(self, folder):
+        """
+        Remove the files in one media folder that no row refers to
+
+        Returns:
+            dict: files and bytes removed
+        """
+        directory = os.path.join(self.media_root, folder)
+        removed = {'files': 0, 'bytes': 0}
+        if not os.path.isdir(directory):
+            return removed
+
+        cutoff = time.time() - self.grace_period
+        batch = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > cutoff:
+                    continue
+                batch.append((entry.name, stat.st_size))
+                if len(batch) >= self.batch_size:
+                    self._reap_batch(folder, batch, removed)
+                    batch = []
+        if batch:
+            self._reap_batch(folder, batch, removed)
+
+        if removed['files']:
+            with self._lock:
+                self.files_removed += removed['files']
+                self.bytes_removed += removed['bytes']
+            print(f"{'Would remove' if self.dry_run else 'Removed'} {removed['files']} orphaned files "
+                  f"({removed['bytes']} bytes) from {folder}")
+        return removed
+
+    def reconcile_usage(self):
+        """Recompute users.storage_bytes from the rows' size_bytes, a batch of users at a time"""
+        totals = ' + '.join(f"(SELECT COALESCE(SUM(size_bytes), 0) FROM {table} "
+                            f"WHERE {table}.user_id = users.user_id)" for table in USAGE_TABLES)
+        last_id = 0
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            while True:
+                cursor.execute("SELECT user_id FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                               (last_id, self.batch_size))
+                user_ids = [row[0] for row in cursor.fetchall()]
+                if not user_ids:
+                    break
+                placeholders = ', '.join(['%s'] * len(user_ids))
+                cursor.execute(f"UPDATE users SET storage_bytes = {totals} WHERE user_id IN ({placeholders})",
+                               user_ids)
+                db.commit()
+                last_id = user_ids[-1]
+
+    def stats(self):
+        """Snapshot of reaper counters"""
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'files_removed': self.files_removed,
+                'bytes_removed': self.bytes_removed,
+                'uploads_expired': self.uploads_expired,
+                'last_run_seconds': self.last_run_seconds
+            }
+
+    def register_metrics(self):
+        """Expose reaper counters on /metrics"""
+        from service_metrics import register_collector, stats_families
+
+        register_collector('storage_reaper', lambda: stats_families(
+            'storage_reaper', self.stats(),
+            counters=('runs', 'files_removed', 'bytes_removed', 'uploads_expired'),
+            gauges=('last_run_seconds',)))
+
+    def _reap_batch(self, folder, batch, removed):
+        candidates = {name: reference_candidates(folder, name) for name, _ in batch}
+        paths = sorted({path for paths in candidates.values() for path in paths})
+        placeholders = ', '.join(['%s'] * len(paths))
+
+        referenced = set()
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor()
+            for table, column, condition in REFERENCES[folder]:
+                extra = f' AND {condition}' if condition else ''
+                cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders}){extra}", paths)
+                referenced.update(row[0] for row in cursor.fetchall())
+
+        for name, size in batch:
+            if referenced.isdisjoint(candidates[name]):
+                if not self.dry_run:
+                    try:
+                        os.remove(os.path.join(self.media_root, folder, name))
+                    except FileNotFoundError:
+                        continue
+                removed['files'] += 1
+                removed['bytes'] += size
+
+
+if __name__ == '__main__':
+    import argparse
+    from db_config import DatabaseConnection
+
+    parser = argparse.ArgumentParser(description='Remove orphaned media files and re-total user storage')
+    parser.add_argument('--media-root', default=MEDIA_ROOT, help='Folder holding avatars/, animations/ and driving videos')
+    parser.add_argument('--sqlite', default=None, help='Use this SQLite database instead of MySQL')
+    parser.add_argument('--grace-period', type=int, default=GRACE_PERIOD,
+                        help='Leave files modified within this many seconds')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed')
+    args = parser.parse_args()
+
+    db_manager = DatabaseConnection.sqlite(args.sqlite) if args.sqlite else DatabaseConnection(pool_size=1)
+    summary = StorageReaper(db_manager, media_root=args.media_root, grace_period=args.grace_period,
+                            dry_run=args.dry_run).run()
+    print(summary)
@@ -0,0 +1,191 @@
+"""
+Resident Model Registry
+
+Loading a FaceAnimationGenerator re-reads the YAML config, runs
+load_checkpoints and moves the weights to the device, which takes seconds.
+The registry keeps loaded generators warm for the life of the process so
+each animation job reuses them instead of loading its own copy.
+
+Several config/checkpoint/backend combinations can be resident at once; when
+their combined weight size exceeds the memory budget the least recently used
+one is dropped. The execution backend (see inference_backends) defaults to
+the ANIMATION_BACKEND environment variable.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from service_metrics import MODEL_LOAD_DURATION, register_collector, stats_families
+
+DEFAULT_CONFIG_PATH = './first-order-model/config/vox-256.yaml'
+DEFAULT_CHECKPOINT_PATH = './first-order-model/checkpoints/vox-cpk.pth.tar'
+DEFAULT_BACKEND = os.environ.get('ANIMATION_BACKEND', 'eager')
+# Names the checkpoint weights in result cache keys; change it whenever the checkpoint is replaced
+DEFAULT_MODEL_ID = os.environ.get('ANIMATION_MODEL_ID', 'vox-cpk')
+MEMORY_BUDGET = 2 * 1024 ** 3  # Bytes of model weights kept resident
+
+
+def _load_generator(config_path, checkpoint_path, backend=DEFAULT_BACKEND):
+    # Imported here so importing the registry doesn't pull in torch
+    from animation_generator import FaceAnimationGenerator
+    return FaceAnimationGenerator(config_path=config_path, checkpoint_path=checkpoint_path,
+                                  backend=backend)
+
+
+def estimate_model_bytes(generator):
+    """Bytes held by the parameters and buffers of a loaded generator"""
+    total = 0
+    for module in (generator.generator, generator.kp_detector):
+        if module is None:
+            continue
+        if hasattr(module, 'model_bytes'):
+            # onnxruntime session; its weights aren't torch tensors
+            total += module.model_bytes
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget=MEMORY_BUDGET, loader=_load_generator,
+                 size_estimator=estimate_model_bytes, backend=DEFAULT_BACKEND):
+        """
+        Thread-safe LRU cache of loaded FaceAnimationGenerator instances
+
+        Args:
+            memory_budget: Maximum bytes of resident model weights
+            loader: Callable (config_path, checkpoint_path, backend) -> generator
+            size_estimator: Callable returning the bytes a generator occupies
+            backend: Execution backend used when get() isn't given one
+        """
+        self.memory_budget = memory_budget
+        self.backend = backend
+        self._loader = loader
+        self._size_estimator = size_estimator
+
+        self._models = OrderedDict()  # key -> (generator, size), most recent last
+        self._lock = threading.Lock()
+        self._loading = {}            # key -> Lock held while that model loads
+
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def get(self, config_path=DEFAULT_CONFIG_PATH, checkpoint_path=DEFAULT_CHECKPOINT_PATH, backend=None):
+        """
+        Return a warm generator for the config/checkpoint/backend, loading it once
+
+        Concurrent callers asking for the same model wait for a single load.
+
+        Returns:
+            FaceAnimationGenerator: Shared, already-loaded generator
+        """
+        backend = backend or self.backend
+        key = (config_path, checkpoint_path, backend)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key][0]
+
+            started = time.perf_counter()
+            try:
+                generator = self._loader(config_path, checkpoint_path, backend)
+                if generator.generator is None or generator.kp_detector is None:
+                    raise RuntimeError(f"Failed to load model from {checkpoint_path}")
+            except Exception:
+                MODEL_LOAD_DURATION.observe(time.perf_counter() - started, backend=backend, outcome='failed')
+                raise
+            MODEL_LOAD_DURATION.observe(time.perf_counter() - started, backend=backend, outcome='loaded')
+            size = self._size_estimator(generator)
+
+            with self._lock:
+                self._models[key] = (generator, size)
+                self._loading.pop(key, None)
+                self.loads += 1
+                self._evict_over_budget(keep=key)
+
+            print(f"Model resident: {checkpoint_path} [{backend}] ({size / 1024 ** 2:.0f} MB)")
+            return generator
+
+    def preload(self, models=None):
+        """
+        Load models ahead of the first job, e.g. at worker startup
+
+        Args:
+            models: List of (config_path, checkpoint_path); defaults to the
+                    standard vox-256 model
+        """
+        for config_path, checkpoint_path in models or [(DEFAULT_CONFIG_PATH, DEFAULT_CHECKPOINT_PATH)]:
+            try:
+                self.get(config_path, checkpoint_path)
+            except Exception as e:
+                print(f"Error preloading model {checkpoint_path}: {e}")
+
+    def evict(self, config_path, checkpoint_path, backend=None):
+        """Drop a model from the registry"""
+        with self._lock:
+            if self._models.pop((config_path, checkpoint_path, backend or self.backend), None) is not None:
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every resident model"""
+        with self._lock:
+            self.evictions += len(self._models)
+            self._models.clear()
+
+    def stats(self):
+        """Snapshot of registry counters"""
+        with self._lock:
+            return {
+                'resident': len(self._models),
+                'resident_bytes': sum(size for _, size in self._models.values()),
+                'memory_budget': self.memory_budget,
+                'backend': self.backend,
+                'loads': self.loads,
+                'hits': self.hits,
+                'evictions': self.evictions
+            }
+
+    def _evict_over_budget(self, keep):
+        # Caller holds self._lock. The model just loaded is never evicted,
+        # even if it alone exceeds the budget.
+        total = sum(size for _, size in self._models.values())
+        for key in list(self._models):
+            if total <= self.memory_budget:
+                break
+            if key == keep:
+                continue
+            _, size = self._models.pop(key)
+            total -= size
+            self.evictions += 1
+            print(f"Model evicted: {key[1]}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+    """Return the process-wide ModelRegistry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+            register_collector('model_registry', lambda: stats_families(
+                'animation_model_registry', _registry.stats(), counters=('loads', 'hits', 'evictions'),
+                gauges=('resident', 'resident_bytes', 'memory_budget'), ratio=('hits', 'loads')))
+        return _registry
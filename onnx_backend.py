@@ -0,0 +1,257 @@
+"""
+ONNX Runtime Backend
+
+Exports the keypoint detector and generator loaded by load_checkpoints to
+ONNX graphs, and runs them with onnxruntime's CPU execution provider in
+place of the torch modules:
+
+    cache/onnx/<checkpoint hash>/
+        kp_detector.onnx   image (N, 3, 256, 256) -> value [, jacobian]
+        generator.onnx     source, source keypoints, driving keypoints -> prediction
+        meta.json          keypoint output names, opset, PSNR against eager
+
+Driving keypoints are plain graph inputs, so keypoints precomputed by the
+keypoint cache (or saved with an avatar) feed the generator directly.
+Inputs and outputs are bound to the tensors' own CPU buffers with IO
+binding, so nothing is copied between numpy and torch around each run.
+
+Once exported, FaceAnimationGenerator(backend='onnx') loads the graphs
+without loading the torch checkpoint. Export ahead of time with:
+
+    python onnx_backend.py
+
+Thread counts come from ONNX_INTRA_OP_THREADS / ONNX_INTER_OP_THREADS
+(0 lets onnxruntime decide).
+"""
+
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from content_hash import cached_file_hash
+
+ONNX_DIR = './cache/onnx'
+OPSET = 17  # GridSample needs opset 16 or later
+INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', 0))
+INTER_OP_THREADS = int(os.environ.get('ONNX_INTER_OP_THREADS', 0))
+
+
+def onnx_dir(checkpoint_path, output_dir=ONNX_DIR):
+    """Folder holding the exported graphs for a checkpoint"""
+    return os.path.join(output_dir, cached_file_hash(checkpoint_path)[:16])
+
+
+def is_exported(checkpoint_path, output_dir=ONNX_DIR):
+    """Whether a checkpoint has already been exported"""
+    return os.path.exists(os.path.join(onnx_dir(checkpoint_path, output_dir), 'meta.json'))
+
+
+class _KPDetectorAdapter(nn.Module):
+    def __init__(self, kp_detector, names):
+        """Tuple outputs around the keypoint detector, as export requires"""
+        super().__init__()
+        self.kp_detector = kp_detector
+        self.names = names
+
+    def forward(self, image):
+        kp = self.kp_detector(image)
+        return tuple(kp[name] for name in self.names)
+
+
+def _inverse_2x2(matrices):
+    # Closed form for the 2x2 jacobians; ONNX has no matrix inverse op
+    a, b = matrices[..., 0, 0], matrices[..., 0, 1]
+    c, d = matrices[..., 1, 0], matrices[..., 1, 1]
+    det = (a * d - b * c)[..., None, None]
+    return torch.stack([torch.stack([d, -b], -1), torch.stack([-c, a], -1)], -2) / det
+
+
+@contextmanager
+def _exportable_inverse():
+    inverse = torch.inverse
+    torch.inverse = _inverse_2x2
+    try:
+        yield
+    finally:
+        torch.inverse = inverse
+
+
+def export_onnx(face_generator, output_dir=ONNX_DIR, opset=OPSET, min_psnr=None, force=False):
+    """
+    Export a loaded model's keypoint detector and generator to ONNX
+
+    The exported generator is checked against eager on stock driving frames
+    (see inference_backends.check_backend_quality) before it is published.
+
+    Args:
+        face_generator: FaceAnimationGenerator with the eager torch models loaded
+        output_dir: Folder for exported checkpoints
+        opset: ONNX opset version
+        min_psnr: Reject the export below this PSNR against eager
+                  (default: inference_backends.MIN_PSNR)
+        force: Export even if graphs for this checkpoint already exist
+
+    Returns:
+        str: Folder holding the graphs
+    """
+    from inference_backends import (MIN_PSNR, GeneratorAdapter, check_backend_quality,
+                                    has_jacobian, sample_inputs, trace_inputs)
+
+    directory = onnx_dir(face_generator.checkpoint_path, output_dir)
+    if is_exported(face_generator.checkpoint_path, output_dir) and not force:
+        return directory
+
+    with_jacobian = has_jacobian(face_generator)
+    kp_names = ['value', 'jacobian'] if with_jacobian else ['value']
+    sample = sample_inputs(face_generator)
+    inputs = trace_inputs(sample, with_jacobian)
+    input_names = (['source', 'kp_source_value', 'kp_source_jacobian', 'kp_driving_value', 'kp_driving_jacobian']
+                   if with_jacobian else ['source', 'kp_source_value', 'kp_driving_value'])
+    batch_axis = {0: 'batch'}
+
+    scratch = f'{directory}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(scratch)
+    try:
+        with torch.no_grad(), _exportable_inverse():
+            torch.onnx.export(_KPDetectorAdapter(face_generator.kp_detector, kp_names).eval(),
+                              (inputs[0],), os.path.join(scratch, 'kp_detector.onnx'),
+                              input_names=['image'], output_names=kp_names,
+                              dynamic_axes={name: batch_axis for name in ['image'] + kp_names},
+                              opset_version=opset, do_constant_folding=True)
+            torch.onnx.export(GeneratorAdapter(face_generator.generator, with_jacobian).eval(),
+                              inputs, os.path.join(scratch, 'generator.onnx'),
+                              input_names=input_names, output_names=['prediction'],
+                              dynamic_axes={name: batch_axis for name in input_names + ['prediction']},
+                              opset_version=opset, do_constant_folding=True)
+
+        generator, _ = load_onnx_models(face_generator.checkpoint_path, directory=scratch)
+        score = check_backend_quality(face_generator.generator, generator, sample,
+                                      MIN_PSNR if min_psnr is None else min_psnr)
+
+        with open(os.path.join(scratch, 'meta.json'), 'w') as f:
+            json.dump({'kp_names': kp_names, 'opset': opset, 'psnr': score,
+                       'torch': torch.__version__}, f)
+        # Publish the export in one rename so workers never load half of it
+        os.replace(scratch, directory)
+    except OSError:
+        if not is_exported(face_generator.checkpoint_path, output_dir):
+            raise
+        # Another worker published the same export first
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(f"Exported ONNX graphs to {directory}")
+    return directory
+
+
+def create_session(path, intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS):
+    """onnxruntime CPU session with the configured thread pools"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    if inter_op_threads > 1:
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+class _OnnxModel:
+    def __init__(self, session, path):
+        self.session = session
+        self.input_names = [node.name for node in session.get_inputs()]
+        self.output_dims = {node.name: node.shape[1:] for node in session.get_outputs()}
+        # Read by model_registry.estimate_model_bytes
+        self.model_bytes = os.path.getsize(path)
+
+    def _run(self, inputs, batch_size):
+        binding = self.session.io_binding()
+        keep_alive = []
+        for name, tensor in zip(self.input_names, inputs):
+            tensor = tensor.detach().to('cpu', torch.float32).contiguous()
+            keep_alive.append(tensor)
+            binding.bind_input(name, 'cpu', 0, np.float32, list(tensor.shape), tensor.data_ptr())
+
+        outputs = {}
+        for name, dims in self.output_dims.items():
+            if all(isinstance(dim, int) for dim in dims):
+                # ORT writes straight into a torch buffer
+                output = torch.empty((batch_size, *dims), dtype=torch.float32)
+                binding.bind_output(name, 'cpu', 0, np.float32, list(output.shape), output.data_ptr())
+                outputs[name] = output
+            else:
+                binding.bind_output(name, 'cpu')
+
+        self.session.run_with_iobinding(binding)
+
+        if len(outputs) < len(self.output_dims):
+            for name, value in zip(self.output_dims, binding.copy_outputs_to_cpu()):
+                outputs.setdefault(name, torch.from_numpy(value))
+        return outputs
+
+    def eval(self):
+        return self
+
+
+class OnnxKPDetector(_OnnxModel):
+    """Stands in for KPDetector: image tensor -> dict of keypoint tensors"""
+
+    def __call__(self, image):
+        return self._run([image], image.shape[0])
+
+
+class OnnxGenerator(_OnnxModel):
+    """Stands in for OcclusionAwareGenerator; returns only the prediction"""
+
+    def __call__(self, source_image, kp_driving, kp_source):
+        with_jacobian = len(self.input_names) == 5
+        keypoints = [kp_source['value'], kp_driving['value']]
+        if with_jacobian:
+            keypoints = [kp_source['value'], kp_source['jacobian'], kp_driving['value'], kp_driving['jacobian']]
+        return self._run([source_image, *keypoints], source_image.shape[0])
+
+
+def load_onnx_models(checkpoint_path, output_dir=ONNX_DIR, directory=None,
+                     intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS):
+    """
+    Open onnxruntime sessions for an exported checkpoint
+
+    Returns:
+        tuple: (OnnxGenerator, OnnxKPDetector)
+    """
+    directory = directory or onnx_dir(checkpoint_path, output_dir)
+    generator_path = os.path.join(directory, 'generator.onnx')
+    kp_detector_path = os.path.join(directory, 'kp_detector.onnx')
+
+    generator = OnnxGenerator(create_session(generator_path, intra_op_threads, inter_op_threads),
+                              generator_path)
+    kp_detector = OnnxKPDetector(create_session(kp_detector_path, intra_op_threads, inter_op_threads),
+                                 kp_detector_path)
+    return generator, kp_detector
+
+
+if __name__ == '__main__':
+    import argparse
+    from model_registry import DEFAULT_CHECKPOINT_PATH, DEFAULT_CONFIG_PATH
+
+    parser = argparse.ArgumentParser(description='Export the First Order Model to ONNX')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH)
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH)
+    parser.add_argument('--output-dir', default=ONNX_DIR)
+    parser.add_argument('--opset', type=int, default=OPSET)
+    parser.add_argument('--force', action='store_true', help='Re-export even if graphs exist')
+    args = parser.parse_args()
+
+    from animation_generator import FaceAnimationGenerator
+
+    face_generator = FaceAnimationGenerator(args.config, args.checkpoint, backend='eager')
+    if face_generator.generator is None:
+        raise SystemExit("Model not loaded")
+    export_onnx(face_generator, args.output_dir, args.opset, force=args.force)
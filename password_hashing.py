@@ -0,0 +1,135 @@
+"""
+Password Hashing
+
+werkzeug's scrypt hashing is deliberately slow (tens of milliseconds of CPU
+per call). Running it on request threads lets a burst of logins occupy
+every thread and stall the rest of the API, so hashing and verification run
+on a small dedicated thread pool instead (hashlib.scrypt releases the GIL,
+so the pool uses real cores):
+
+    workers      calls hashing at the same time
+    max_queue    further calls allowed to wait for a worker; beyond that
+                 HashingBusyError is raised at once (the API answers 429)
+    timeout      seconds a caller waits for its result before
+                 HashingTimeoutError (the API answers 503)
+
+Stored hashes carry their method and parameters ('scrypt:32768:8:1$salt$...').
+When PASSWORD_HASH_METHOD changes, needs_rehash() spots hashes made with the
+old parameters and login re-hashes them with the password it just verified.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHOD = 'scrypt:32768:8:1'  # Full method spec, as stored in the hash prefix
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+HASH_QUEUE = 32    # Calls waiting for a worker before new ones are turned away
+HASH_TIMEOUT = 5   # Seconds a request waits for its hash
+
+
+class HashingBusyError(Exception):
+    """Raised when the hashing queue is full"""
+    pass
+
+
+class HashingTimeoutError(Exception):
+    """Raised when a hash isn't ready within the timeout"""
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers=HASH_WORKERS, max_queue=HASH_QUEUE, timeout=HASH_TIMEOUT,
+                 method=HASH_METHOD):
+        """
+        Bounded thread pool for password hashing and verification
+
+        Args:
+            workers: Threads hashing at the same time
+            max_queue: Calls allowed to wait for a free thread
+            timeout: Seconds a caller waits for its result
+            method: werkzeug method with explicit parameters, e.g.
+                    'scrypt:32768:8:1' or 'pbkdf2:sha256:1000000'
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.method = method
+
+        # Threads start on first use
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+
+    def hash(self, password):
+        """Hash a password with the configured method"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with other parameters than the configured method"""
+        return password_hash.split('$', 1)[0] != self.method
+
+    def upgrade(self, password_hash, password):
+        """
+        Re-hash a just-verified password if its stored hash uses old parameters
+
+        Returns:
+            str: The new hash, or None if the stored one is current
+        """
+        if not self.needs_rehash(password_hash):
+            return None
+        new_hash = self.hash(password)
+        self._count('rehashed')
+        return new_hash
+
+    def stats(self):
+        """Snapshot of hashing counters"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'rehashed': self.rehashed
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise HashingBusyError("Too many password checks in progress")
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drop the call if it hasn't started; nobody is waiting for it any more
+            future.cancel()
+            self._count('timeouts')
+            raise HashingTimeoutError(f"Password check not finished after {self.timeout}s")
+        self._count('completed')
+        return result
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
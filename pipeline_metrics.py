@@ -0,0 +1,285 @@
+"""
+Animation Pipeline Instrumentation
+
+Stage timers and memory high-water marks for one animation job. The
+generator marks its stages (decode, resize, keypoints, source, generator,
+to_uint8, encode, preview, ...) with ``stage()`` / ``timed_iter()``; they
+record into the StageTimer installed for the current thread with
+``use_timer()`` and cost nothing when none is installed.
+
+Stages nest and are timed exclusively: when the encoder pulls the next
+batch from the generator, which pulls keypoints, which pulls decoded
+frames, each second is charged to exactly one stage. Time spent outside
+any stage is reported as ``other``.
+
+process_animation_task returns the summary as ``result['metrics']`` and the
+worker stores it in ``animations.stage_metrics``.
+
+Benchmark the whole pipeline on synthetic input with:
+
+    python -m pipeline_metrics --width 512 --height 512 --frames 64 --backend eager
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # Peak rather than current outside Linux; still a valid high-water mark
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+class StageTimer:
+    def __init__(self):
+        """Exclusive wall-clock time, call counts and peak memory per stage"""
+        self.seconds = {}
+        self.calls = {}
+        self.peak_rss = {}
+        self.frames = 0
+        self.info = {}
+        self._stack = []
+        self._mark = None
+        self._started = time.perf_counter()
+        self._finished = None
+
+    @contextmanager
+    def stage(self, name):
+        """Charge the time spent in the block to ``name``"""
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(self._stack[-1], now)
+        self._stack.append(name)
+        self._mark = now
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._charge(self._stack.pop(), now)
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self._mark = now
+            rss = current_rss()
+            if rss is not None and rss > self.peak_rss.get(name, 0):
+                self.peak_rss[name] = rss
+
+    def timed_iter(self, name, iterable):
+        """Iterate, charging the time each item takes to produce to ``name``"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self, name, seconds, calls=1):
+        """Add time measured elsewhere, e.g. in a batching thread"""
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def add_frames(self, count):
+        self.frames += count
+
+    def merge(self, other):
+        """Add another timer's stages, e.g. a batch shared by several jobs"""
+        for name, seconds in other.seconds.items():
+            self.record(name, seconds, other.calls.get(name, 0))
+        for name, rss in other.peak_rss.items():
+            self.peak_rss[name] = max(rss, self.peak_rss.get(name, 0))
+        self.frames += other.frames
+        for key, value in other.info.items():
+            self.info.setdefault(key, value)
+
+    def finish(self):
+        self._finished = time.perf_counter()
+        return self
+
+    def summary(self):
+        """
+        Structured result for the job
+
+        Returns:
+            dict: total_seconds, frames, fps, peak_rss_mb, and per stage
+                  seconds, calls, share of the total, frames/s and peak_rss_mb
+        """
+        total = (self._finished or time.perf_counter()) - self._started
+        stages = {}
+        for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1]):
+            stages[name] = {
+                'seconds': round(seconds, 4),
+                'calls': self.calls.get(name, 0),
+                'share': round(seconds / total, 4) if total else 0.0,
+                'fps': round(self.frames / seconds, 2) if self.frames and seconds else None,
+                'peak_rss_mb': _mb(self.peak_rss.get(name))
+            }
+        other = total - sum(self.seconds.values())
+        if other > 0:
+            stages['other'] = {'seconds': round(other, 4), 'calls': None,
+                               'share': round(other / total, 4) if total else 0.0,
+                               'fps': None, 'peak_rss_mb': None}
+
+        peaks = [rss for rss in self.peak_rss.values() if rss]
+        return {
+            'total_seconds': round(total, 4),
+            'frames': self.frames,
+            'fps': round(self.frames / total, 2) if self.frames and total else None,
+            'peak_rss_mb': _mb(max(peaks)) if peaks else None,
+            'stages': stages,
+            **self.info
+        }
+
+    def _charge(self, name, now):
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - self._mark
+
+
+def _mb(value):
+    return round(value / 1024 ** 2, 1) if value else None
+
+
+class _NullTimer:
+    """Installed when nothing is measuring; every call is a no-op"""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def timed_iter(self, name, iterable):
+        return iterable
+
+    def record(self, name, seconds, calls=1):
+        pass
+
+    def add_frames(self, count):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+_local = threading.local()
+
+
+def current_timer():
+    """The StageTimer installed for this thread, or a no-op timer"""
+    return getattr(_local, 'timer', None) or _NULL_TIMER
+
+
+@contextmanager
+def use_timer(timer):
+    """Install a StageTimer for the current thread"""
+    previous = getattr(_local, 'timer', None)
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+def stage(name):
+    """Time a block as ``name`` in the current thread's timer"""
+    return current_timer().stage(name)
+
+
+def timed_iter(name, iterable):
+    """Charge producing each item of an iterable to ``name``"""
+    return current_timer().timed_iter(name, iterable)
+
+
+def _synthetic_inputs(directory, width, height, num_frames, fps):
+    # A bright blob drifting over a gradient: cheap to make, but decodes and
+    # compresses like real footage rather than noise
+    import imageio
+    import numpy as np
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = np.stack([x / width, y / height, 0.5 * np.ones_like(x)], axis=-1)
+
+    def frame(t):
+        cx = width * (0.3 + 0.4 * t)
+        cy = height * (0.5 + 0.1 * np.sin(2 * np.pi * t))
+        blob = np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * (0.1 * min(width, height)) ** 2))
+        return (np.clip(background + blob[..., None], 0, 1) * 255).astype(np.uint8)
+
+    image_path = os.path.join(directory, 'avatar.png')
+    video_path = os.path.join(directory, 'driving.mp4')
+    imageio.imwrite(image_path, frame(0.5))
+    imageio.mimwrite(video_path, [frame(i / max(1, num_frames - 1)) for i in range(num_frames)], fps=fps)
+    return image_path, video_path
+
+
+def _benchmark(width, height, num_frames, fps, backend, batch_size, repeats, output):
+    import json
+    import tempfile
+
+    from animation_generator import FaceAnimationGenerator
+    from model_registry import DEFAULT_CHECKPOINT_PATH, DEFAULT_CONFIG_PATH
+
+    generator = FaceAnimationGenerator(DEFAULT_CONFIG_PATH, DEFAULT_CHECKPOINT_PATH,
+                                       batch_size=batch_size, backend=backend)
+    if generator.generator is None:
+        raise SystemExit("Model not loaded")
+
+    with tempfile.TemporaryDirectory() as directory:
+        image_path, video_path = _synthetic_inputs(directory, width, height, num_frames, fps)
+        output_path = os.path.join(directory, 'output.mp4')
+
+        generator.generate_animation(image_path, video_path, output_path)  # warm up
+        runs = []
+        for _ in range(repeats):
+            timer = StageTimer()
+            with use_timer(timer):
+                generator.generate_animation(image_path, video_path, output_path)
+            runs.append(timer.finish().summary())
+
+    best = min(runs, key=lambda run: run['total_seconds'])
+    print(f"{num_frames} frames {width}x{height} -> 256x256, backend {generator.backend}, "
+          f"batch {generator.batch_size}: best {best['total_seconds']:.2f}s ({best['fps']} frames/s), "
+          f"peak RSS {best['peak_rss_mb']} MB")
+    print(f"{'stage':<12} {'seconds':>9} {'share':>7} {'frames/s':>10} {'peak MB':>9}")
+    for name, entry in best['stages'].items():
+        fps_text = f"{entry['fps']:10.1f}" if entry['fps'] else f"{'-':>10}"
+        print(f"{name:<12} {entry['seconds']:9.3f} {entry['share']:7.1%} {fps_text} "
+              f"{entry['peak_rss_mb'] or '-':>9}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'width': width, 'height': height, 'frames': num_frames,
+                       'backend': generator.backend, 'batch_size': generator.batch_size,
+                       'runs': runs}, f, indent=2)
+        print(f"Saved {output}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the animation pipeline stage by stage')
+    parser.add_argument('--width', type=int, default=512, help='Synthetic input width')
+    parser.add_argument('--height', type=int, default=512, help='Synthetic input height')
+    parser.add_argument('--frames', type=int, default=64, help='Driving video length')
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--backend', default='eager', help='Inference backend (see inference_backends.BACKENDS)')
+    parser.add_argument('--batch-size', default='auto')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='Also save every run as JSON to this file')
+    args = parser.parse_args()
+
+    # Run as a script this file is __main__; the generator records into the
+    # imported pipeline_metrics module, so time it with that module's timer
+    import pipeline_metrics
+    pipeline_metrics._benchmark(args.width, args.height, args.frames, args.fps, args.backend,
+                                args.batch_size, args.repeats, args.output)
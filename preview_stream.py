@@ -0,0 +1,197 @@
+"""
+Live Animation Previews
+
+While a job is generating, the worker publishes every frame it writes,
+downscaled and JPEG-encoded, to a per-animation spool file:
+
+    cache/previews/<animation_id>.mjpg
+
+Each record is a 4-byte big-endian length followed by one JPEG; a
+zero-length record marks the end of the stream. A plain file works whether
+the workers run inside the web process or as a separate process.
+
+The web process tails the spool and serves it as multipart MJPEG
+(``multipart/x-mixed-replace``), which browsers play directly in an
+``<img>`` tag, so the dashboard starts showing the animation within the
+first generated chunk while the full-quality MP4 is still being written.
+Kept free of the inference stack so the web process can use it without
+importing torch.
+"""
+
+import os
+import struct
+import time
+
+PREVIEW_DIR = './cache/previews'
+PREVIEW_SIZE = 128     # Preview frames are downscaled to at most this many pixels per side
+PREVIEW_QUALITY = 70   # JPEG quality of preview frames
+PREVIEW_STRIDE = 1     # Publish every Nth generated frame
+POLL_INTERVAL = 0.1    # Seconds a reader waits for the next frame
+CHECK_INTERVAL = 2     # Seconds between job status checks while a reader is idle
+IDLE_TIMEOUT = 60      # Seconds a reader waits without any new frame before giving up
+BOUNDARY = 'frame'
+
+_HEADER = struct.Struct('>I')
+
+
+def preview_path(animation_id, preview_dir=PREVIEW_DIR):
+    """Spool file for an animation's live preview"""
+    return os.path.join(preview_dir, f'{int(animation_id)}.mjpg')
+
+
+def downscale_batch(frames, size=PREVIEW_SIZE):
+    """
+    Shrink a block of uint8 frames by an integer factor with a box filter
+
+    Args:
+        frames: uint8 array of shape (N, H, W, 3)
+        size: Largest output side in pixels
+
+    Returns:
+        np.ndarray: uint8 array of shape (N, H // f, W // f, 3)
+    """
+    import numpy as np
+
+    frames = np.asarray(frames)
+    factor = -(-max(frames.shape[1:3]) // size)  # ceil
+    if factor <= 1:
+        return frames
+
+    n, height, width, channels = frames.shape
+    height, width = height // factor, width // factor
+    blocks = frames[:, :height * factor, :width * factor].reshape(
+        n, height, factor, width, factor, channels)
+    return blocks.mean(axis=(2, 4), dtype=np.float32).round().astype(np.uint8)
+
+
+class PreviewWriter:
+    def __init__(self, animation_id, preview_dir=PREVIEW_DIR, size=PREVIEW_SIZE,
+                 quality=PREVIEW_QUALITY, stride=PREVIEW_STRIDE):
+        """
+        Frame callback that publishes generated frames to a preview spool
+
+        Call it with each block of uint8 frames as they are written to the
+        output video, then close() it once the job is over.
+
+        Args:
+            animation_id: Animation the frames belong to
+            preview_dir: Folder holding the spool files
+            size: Largest preview side in pixels
+            quality: JPEG quality
+            stride: Publish every Nth frame
+        """
+        self.path = preview_path(animation_id, preview_dir)
+        self.size = size
+        self.quality = quality
+        self.stride = max(1, stride)
+        self._seen = 0
+
+        os.makedirs(preview_dir, exist_ok=True)
+        # Truncates the spool of an earlier, failed attempt
+        self._file = open(self.path, 'wb')
+
+    def __call__(self, frames):
+        if self._file is None:
+            return
+
+        import imageio
+
+        skip = (-self._seen) % self.stride
+        self._seen += len(frames)
+        selected = frames[skip::self.stride]
+        if len(selected) == 0:
+            return
+
+        try:
+            for frame in downscale_batch(selected, self.size):
+                jpeg = imageio.imwrite('<bytes>', frame, format='JPEG', quality=self.quality)
+                # One write per record so readers rarely see a partial one
+                self._file.write(_HEADER.pack(len(jpeg)) + jpeg)
+            self._file.flush()
+        except Exception as e:
+            # A broken preview must never fail the job itself
+            print(f"Disabling preview {self.path}: {e}")
+            self.close(remove=True)
+
+    def close(self, remove=True):
+        """
+        End the stream and, by default, delete the spool
+
+        Readers that already opened the file still read it to the end
+        marker; later requests find no preview and use the finished video.
+        """
+        if self._file is not None:
+            try:
+                self._file.write(_HEADER.pack(0))
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def iter_preview_frames(animation_id, is_active, preview_dir=PREVIEW_DIR,
+                        poll_interval=POLL_INTERVAL, check_interval=CHECK_INTERVAL,
+                        idle_timeout=IDLE_TIMEOUT):
+    """
+    Follow an animation's preview spool, yielding JPEG frames as they arrive
+
+    Args:
+        animation_id: Animation to follow
+        is_active: Callable returning False once the job is no longer
+                   queued or processing; checked only while idle
+        preview_dir: Folder holding the spool files
+
+    Yields:
+        bytes: One JPEG per frame
+    """
+    path = preview_path(animation_id, preview_dir)
+    last_frame = last_check = time.monotonic()
+    spool = None
+
+    try:
+        while True:
+            if spool is None:
+                try:
+                    spool = open(path, 'rb')
+                except FileNotFoundError:
+                    pass
+
+            if spool is not None:
+                position = spool.tell()
+                header = spool.read(_HEADER.size)
+                if len(header) == _HEADER.size:
+                    (length,) = _HEADER.unpack(header)
+                    if length == 0:
+                        return  # End of stream
+                    jpeg = spool.read(length)
+                    if len(jpeg) == length:
+                        last_frame = time.monotonic()
+                        yield jpeg
+                        continue
+                # Record still being written
+                spool.seek(position)
+
+            now = time.monotonic()
+            if now - last_frame > idle_timeout:
+                return
+            if now - last_check > check_interval:
+                last_check = now
+                if not is_active():
+                    return
+            time.sleep(poll_interval)
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+def mjpeg_stream(frames, boundary=BOUNDARY):
+    """Wrap JPEG frames as the parts of a multipart/x-mixed-replace body"""
+    for jpeg in frames:
+        yield (f'--{boundary}\r\nContent-Type: image/jpeg\r\n'
+               f'Content-Length: {len(jpeg)}\r\n\r\n').encode() + jpeg + b'\r\n'
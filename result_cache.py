@@ -0,0 +1,243 @@
+"""
+Content-Addressed Animation Result Cache
+
+Animating the same avatar image with the same driving video, checkpoint and
+generation flags always produces the same video, so finished animations are
+indexed in the ``animation_results`` table by a key built from:
+
+    avatar content hash | driving video hash | model id | backend | flags
+
+The checkpoint is named by its configured model id (ANIMATION_MODEL_ID)
+rather than hashed, so web processes never read the weights and don't need
+a copy of them.
+
+A request whose key is already present links its new ``animations`` row to
+the existing file and completes immediately, without queueing a job.
+
+Each result counts the ``animations`` rows that point at it. Deleting an
+avatar or a user releases those references instead of deleting shared
+files. Results nobody references stay on disk as cache entries and are
+removed least-recently-used first once the folder exceeds its size budget.
+"""
+
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+from content_hash import cached_file_hash
+from expression_catalog import expression_video_path
+from model_registry import DEFAULT_MODEL_ID
+
+MEDIA_ROOT = 'static'
+MAX_CACHE_BYTES = 5 * 1024 ** 3  # Size budget for cached animation files
+EVICTION_BATCH = 100
+
+
+def result_key(avatar_hash, driving_video_path, model_id=DEFAULT_MODEL_ID,
+               backend='eager', relative=True, adapt_movement_scale=True):
+    """
+    Cache key for one generation request
+
+    Args:
+        avatar_hash: SHA-256 of the avatar image contents
+        driving_video_path: Path to the driving video
+        model_id: Configured name of the checkpoint used for generation
+        backend: Inference backend; quantized and ONNX backends only
+                 approximate eager output, so each gets its own results
+        relative: Relative keypoint movement flag
+        adapt_movement_scale: Movement scale adaptation flag
+
+    Returns:
+        str: Hex SHA-256 key
+    """
+    parts = [
+        avatar_hash,
+        cached_file_hash(driving_video_path),
+        f'model={model_id}',
+        f'relative={int(bool(relative))}',
+        f'adapt_movement_scale={int(bool(adapt_movement_scale))}'
+    ]
+    if backend != 'eager':
+        # Eager results are keyed without a backend part
+        parts.insert(3, f'backend={backend}')
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def expression_result_key(avatar_hash, expression_name, model_id=DEFAULT_MODEL_ID, backend='eager'):
+    """Key for an expression job, or None if it can't be computed"""
+    if not avatar_hash:
+        return None
+    try:
+        return result_key(avatar_hash, expression_video_path(expression_name), model_id, backend)
+    except (OSError, ValueError):
+        # Missing driving video: the job itself will report it
+        return None
+
+
+def driving_video_result_key(avatar_hash, driving_video_path, model_id=DEFAULT_MODEL_ID, backend='eager'):
+    """Key for a job driven by an uploaded video, or None if it can't be computed"""
+    if not avatar_hash:
+        return None
+    try:
+        return result_key(avatar_hash, driving_video_path, model_id, backend)
+    except (OSError, ValueError):
+        return None
+
+
+class ResultCache:
+    def __init__(self, db_manager, media_root=MEDIA_ROOT, max_bytes=MAX_CACHE_BYTES):
+        """
+        Reference-counted index of generated animation files
+
+        Methods taking ``db`` run on the caller's connection so they commit
+        together with the caller's own changes.
+
+        Args:
+            db_manager: DatabaseConnection used for eviction
+            media_root: Folder that animation paths are relative to
+            max_bytes: Size budget for all cached animation files
+        """
+        self.db_manager = db_manager
+        self.media_root = media_root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, db, key):
+        """
+        Take a reference to a cached result
+
+        Returns:
+            str: Existing animation_path, or None on a cache miss
+        """
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT animation_path FROM animation_results WHERE result_key = %s", (key,))
+        row = cursor.fetchone()
+
+        if row and os.path.exists(os.path.join(self.media_root, row['animation_path'])):
+            # Fails if the entry was evicted since the SELECT
+            cursor.execute("""
+                UPDATE animation_results SET ref_count = ref_count + 1, last_used_at = %s
+                WHERE result_key = %s
+            """, (datetime.now(), key))
+            if cursor.rowcount == 1:
+                self._count('hits')
+                return row['animation_path']
+        elif row:
+            # File vanished from disk; forget the entry
+            cursor.execute("DELETE FROM animation_results WHERE result_key = %s", (key,))
+
+        self._count('misses')
+        return None
+
+    def register(self, db, key, animation_path):
+        """
+        Record a freshly generated animation under its key
+
+        If an identical job finished first, the reference goes to that
+        file instead and the caller should drop its own copy.
+
+        Returns:
+            str: The animation_path the caller's row should point at
+        """
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT animation_path FROM animation_results WHERE result_key = %s", (key,))
+        row = cursor.fetchone()
+
+        if row is None:
+            full_path = os.path.join(self.media_root, animation_path)
+            size = os.path.getsize(full_path) if os.path.exists(full_path) else 0
+            now = datetime.now()
+            try:
+                cursor.execute("""
+                    INSERT INTO animation_results (result_key, animation_path, size_bytes, ref_count,
+                                                   created_at, last_used_at)
+                    VALUES (%s, %s, %s, 1, %s, %s)
+                """, (key, animation_path, size, now, now))
+                return animation_path
+            except Exception:
+                # Lost a race with an identical job; fall through and share its file
+                cursor.execute("SELECT animation_path FROM animation_results WHERE result_key = %s", (key,))
+                row = cursor.fetchone()
+                if row is None:
+                    raise
+
+        cursor.execute("""
+            UPDATE animation_results SET ref_count = ref_count + 1, last_used_at = %s
+            WHERE result_key = %s
+        """, (datetime.now(), key))
+        return row['animation_path']
+
+    def release(self, db, keys):
+        """Drop one reference per key (one key per deleted animations row)"""
+        cursor = db.cursor()
+        for key in keys:
+            if key:
+                cursor.execute("""
+                    UPDATE animation_results SET ref_count = ref_count - 1
+                    WHERE result_key = %s AND ref_count > 0
+                """, (key,))
+
+    def evict(self):
+        """
+        Delete unreferenced results, oldest use first, until under budget
+
+        Returns:
+            int: Number of files removed
+        """
+        removed = 0
+        with self.db_manager.get_connection() as db:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("SELECT COALESCE(SUM(size_bytes), 0) AS total FROM animation_results")
+            total = int(cursor.fetchone()['total'])
+
+            while total > self.max_bytes:
+                cursor.execute("""
+                    SELECT result_key, animation_path, size_bytes FROM animation_results
+                    WHERE ref_count = 0
+                    ORDER BY last_used_at
+                    LIMIT %s
+                """, (EVICTION_BATCH,))
+                candidates = cursor.fetchall()
+                if not candidates:
+                    break  # Everything left is still in use
+
+                for entry in candidates:
+                    if total <= self.max_bytes:
+                        break
+                    # Re-check the count so a concurrent acquire keeps its file
+                    cursor.execute("DELETE FROM animation_results WHERE result_key = %s AND ref_count = 0",
+                                   (entry['result_key'],))
+                    db.commit()
+                    if cursor.rowcount != 1:
+                        continue
+
+                    full_path = os.path.join(self.media_root, entry['animation_path'])
+                    if os.path.exists(full_path):
+                        os.remove(full_path)
+                    total -= entry['size_bytes'] or 0
+                    removed += 1
+
+        if removed:
+            self._count('evictions', removed)
+            print(f"Evicted {removed} cached animations")
+        return removed
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions
+            }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
@@ -0,0 +1,276 @@
+"""
+Service Metrics
+
+Counters and histograms for the web process and animation workers,
+exposed in the Prometheus text format at ``/metrics``:
+
+    http_request_duration_seconds      per endpoint, method and status (app.py hooks)
+    db_pool_wait_seconds               time to check out a pooled connection
+    db_query_duration_seconds          statement execution time per SQL verb
+    animation_jobs_total               finished jobs per outcome
+    animation_job_duration_seconds     whole job, per outcome
+    animation_stage_duration_seconds   per pipeline stage (see pipeline_metrics)
+    model_load_duration_seconds        each model load, per backend and outcome
+
+Values that already live in a component's ``stats()`` (pool occupancy,
+registry residency, cache hits and misses, batch sizes, event bus
+subscribers, queue depth) are read when the endpoint is scraped, through
+collectors registered with ``register_collector``.
+
+Recording is a dict lookup and a few additions under a lock, so metrics
+stay on in production. Label values must come from small fixed sets
+(endpoint names, SQL verbs, stage names), never IDs or paths.
+
+A worker running as its own process serves its metrics with
+``serve_metrics(port)`` (``animation_worker.py --metrics-port``).
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+JOB_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        """Monotonic count per combination of label values"""
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(zip(self.labels, key))} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        """Observation counts per bucket, sum and count per combination of label values"""
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count)
+                      in sorted(self._series.items())]
+        for key, counts, total, count in series:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f'{self.name}_bucket{_labels(pairs + [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(pairs)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(pairs)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Metrics recorded by this process plus collectors read at scrape time"""
+        self._metrics = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def register_collector(self, name, collector):
+        """
+        Read extra values on every scrape
+
+        Args:
+            name: Registering again under the same name replaces the collector
+            collector: Callable returning a list of (metric name, 'counter' or
+                       'gauge', help text, [(labels dict, value), ...])
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def unregister_collector(self, name):
+        with self._lock:
+            self._collectors.pop(name, None)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                # One broken component shouldn't hide every other metric
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            for metric_name, kind, help_text, samples in families:
+                lines.append(f'# HELP {metric_name} {help_text}')
+                lines.append(f'# TYPE {metric_name} {kind}')
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f'{metric_name}{_labels(labels.items())} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+def stats_families(prefix, stats, counters=(), gauges=(), ratio=None, labels=None):
+    """
+    Turn a component's stats() snapshot into collector output
+
+    Args:
+        prefix: Metric name prefix, e.g. 'animation_result_cache'
+        stats: The stats() dict
+        counters: Keys exported as ``<prefix>_<key>_total`` counters
+        gauges: Keys exported as ``<prefix>_<key>`` gauges
+        ratio: Optional (hits key, misses key) exported as ``<prefix>_hit_ratio``
+        labels: Labels added to every sample
+    """
+    labels = labels or {}
+    families = []
+    for key in counters:
+        families.append((f'{prefix}_{key}_total', 'counter', f'{key} since process start',
+                         [(labels, stats.get(key))]))
+    for key in gauges:
+        families.append((f'{prefix}_{key}', 'gauge', f'current {key}', [(labels, stats.get(key))]))
+    if ratio:
+        hits, misses = stats.get(ratio[0], 0), stats.get(ratio[1], 0)
+        families.append((f'{prefix}_hit_ratio', 'gauge', 'hits / (hits + misses) since process start',
+                         [(labels, hits / (hits + misses) if hits + misses else 0.0)]))
+    return families
+
+
+def _labels(pairs):
+    text = ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return f'{{{text}}}' if text else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    """Return the process-wide MetricsRegistry"""
+    return _registry
+
+
+def register_collector(name, collector):
+    """Add a scrape-time collector to the process-wide registry"""
+    _registry.register_collector(name, collector)
+
+
+REQUEST_LATENCY = _registry.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, per endpoint',
+    ('endpoint', 'method', 'status'))
+DB_POOL_WAIT = _registry.histogram(
+    'db_pool_wait_seconds', 'Time spent waiting to check out a pooled connection',
+    buckets=QUERY_BUCKETS)
+DB_QUERY_DURATION = _registry.histogram(
+    'db_query_duration_seconds', 'Time to execute a statement, per SQL verb', ('verb',),
+    buckets=QUERY_BUCKETS)
+JOBS_FINISHED = _registry.counter(
+    'animation_jobs_total', 'Animation job attempts by outcome (completed, retried, failed)', ('outcome',))
+JOB_DURATION = _registry.histogram(
+    'animation_job_duration_seconds', 'Time to run one animation job attempt', ('outcome',),
+    buckets=JOB_BUCKETS)
+STAGE_DURATION = _registry.histogram(
+    'animation_stage_duration_seconds', 'Time per pipeline stage of one animation job', ('stage',),
+    buckets=JOB_BUCKETS)
+MODEL_LOAD_DURATION = _registry.histogram(
+    'model_load_duration_seconds', 'Time to load a generator into the model registry', ('backend', 'outcome'),
+    buckets=JOB_BUCKETS)
+
+
+def record_job(metrics, outcome, seconds):
+    """Record one finished job attempt and its stage timings (pipeline_metrics summary)"""
+    JOBS_FINISHED.inc(outcome=outcome)
+    JOB_DURATION.observe(seconds, outcome=outcome)
+    for name, entry in ((metrics or {}).get('stages') or {}).items():
+        STAGE_DURATION.observe(entry['seconds'], stage=name)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = _registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host='0.0.0.0'):
+    """Serve /metrics from a background thread, for processes without the web app"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,125 @@
+"""
+Web Startup Benchmark
+
+Measures how long a fresh web process takes to become ready: interpreter
+start, ``import app``, ``create_app()`` and the first request, each in a new
+subprocess so nothing is warm:
+
+    python startup_benchmark.py --runs 10 --budget 1.0
+
+It also lists any heavy inference modules (torch, numpy, scipy, ...) the
+web process imported; only animation workers should load those. The exit
+status is non-zero when the median cold start exceeds the budget or a heavy
+module was imported, so the check can gate a deploy. Use
+``python -X importtime -c "import app"`` to see where import time goes.
+
+The app runs against a throwaway SQLite database, so no MySQL is needed.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules a web replica should never need
+HEAVY_MODULES = ('torch', 'numpy', 'scipy', 'skimage', 'matplotlib', 'imageio', 'cv2',
+                 'onnxruntime', 'yaml', 'animation_generator')
+
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app(sys.argv[1], SQLITE_PATH=sys.argv[2], ANIMATION_WORKERS_INLINE=False)
+created = time.perf_counter()
+status = app.test_client().get(sys.argv[3]).status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import_app': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'status': status,
+    'heavy_modules': [name for name in json.loads(sys.argv[4]) if name in sys.modules],
+}))
+'''
+
+
+def measure(config, sqlite_path, path):
+    """
+    Start one fresh process and time each step
+
+    Returns:
+        dict: Seconds for the whole process and each step, plus any heavy modules imported
+    """
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', CHILD, config, sqlite_path, path,
+                                json.dumps(HEAVY_MODULES)],
+                               cwd=REPO_DIR, capture_output=True, text=True, timeout=120)
+    total = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{completed.stderr}")
+
+    # The app may print while starting; the timings are the last line
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['total'] = total
+    return result
+
+
+def run_benchmark(runs, config, path):
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_path = os.path.join(directory, 'startup.db')
+        # The first run creates the schema; don't count it
+        measure(config, sqlite_path, path)
+        return [measure(config, sqlite_path, path) for _ in range(runs)]
+
+
+def summarise(results):
+    steps = ('total', 'import_app', 'create_app', 'first_request')
+    return {
+        step: {
+            'median': round(statistics.median(r[step] for r in results), 4),
+            'max': round(max(r[step] for r in results), 4)
+        }
+        for step in steps
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Time cold starts of the web app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--config', default='production', help='Settings name from config.CONFIGS')
+    parser.add_argument('--path', default='/login', help='URL of the first request')
+    parser.add_argument('--budget', type=float, default=1.0, help='Maximum median cold start in seconds')
+    parser.add_argument('--output', help='Also save the runs as JSON to this file')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.runs, args.config, args.path)
+    summary = summarise(results)
+    heavy = sorted({name for r in results for name in r['heavy_modules']})
+
+    print(f"{args.runs} cold starts ({args.config} config, first request {args.path}):")
+    print(f"{'step':<14} {'median':>9} {'max':>9}")
+    for step, stats in summary.items():
+        print(f"{step:<14} {stats['median']:8.3f}s {stats['max']:8.3f}s")
+    print(f"Heavy modules imported: {', '.join(heavy) or 'none'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': args.config, 'path': args.path, 'summary': summary,
+                       'heavy_modules': heavy, 'runs': results}, f, indent=2)
+        print(f"Saved {args.output}")
+
+    failures = []
+    if summary['total']['median'] > args.budget:
+        failures.append(f"median cold start {summary['total']['median']:.3f}s exceeds {args.budget}s")
+    if heavy:
+        failures.append(f"web process imported {', '.join(heavy)}")
+    if failures:
+        raise SystemExit('FAIL: ' + '; '.join(failures))
@@ -3,6 +3,67 @@ function showMessage(message, type = 'info') {
   alert(message);
 }
 
+const PAGE_SIZE = 20;
+
+// Cursor-paginated list that loads the next page when its end scrolls into view
+function createPagedList(url, itemsKey, container, renderItem) {
+  let cursor = null;
+  let done = false;
+  let loading = false;
+  let generation = 0;
+  
+  const sentinel = document.createElement('div');
+  sentinel.className = 'load-more-sentinel';
+  container.after(sentinel);
+  
+  const observer = new IntersectionObserver((entries) => {
+    if (entries[0].isIntersecting) loadMore();
+  });
+  
+  async function loadMore() {
+    if (loading || done) return;
+    loading = true;
+    const requested = generation;
+    
+    try {
+      const params = new URLSearchParams({ limit: PAGE_SIZE });
+      if (cursor) params.set('cursor', cursor);
+      
+      const response = await fetch(`${url}?${params}`);
+      const data = await response.json();
+      
+      // Drop a page that was in flight when the list was reset
+      if (data.success && requested === generation) {
+        data[itemsKey].forEach(renderItem);
+        cursor = data.next_cursor;
+        done = !cursor;
+      }
+    } catch (error) {
+      console.error(`Error loading ${itemsKey}:`, error);
+    } finally {
+      loading = false;
+    }
+    
+    if (requested !== generation) return loadMore();
+    
+    // Re-observing fires again if the end of the list is still visible
+    if (!done) {
+      observer.unobserve(sentinel);
+      observer.observe(sentinel);
+    }
+  }
+  
+  function reset() {
+    generation++;
+    cursor = null;
+    done = false;
+    return loadMore();
+  }
+  
+  observer.observe(sentinel);
+  return { loadMore, reset };
+}
+
 // ============================================
 // LOGIN PAGE
 // ============================================
@@ -175,39 +236,35 @@ if (window.location.pathname.includes('user.html') || window.location.pathname =
     });
   }
   
-  // Load avatars
-  async function loadAvatars() {
-    try {
-      const response = await fetch('/api/avatars');
-      const data = await response.json();
-      
-      if (data.success) {
-        const avatarList = document.getElementById('avatarList');
-        const avatarSelect = document.getElementById('avatarSelect');
-        
-        avatarList.innerHTML = '';
-        avatarSelect.innerHTML = '<option value="">--Select Avatar--</option>';
-        
-        data.avatars.forEach(avatar => {
-          // Add to gallery
-          const avatarDiv = document.createElement('div');
-          avatarDiv.className = 'avatar-item';
-          avatarDiv.innerHTML = `
-            <img src="/static/${avatar.avatar_path}" alt="Avatar">
-            <button class="btn small-btn danger-btn" onclick="deleteAvatar(${avatar.avatar_id})">Delete</button>
-          `;
-          avatarList.appendChild(avatarDiv);
-          
-          // Add to select
-          const option = document.createElement('option');
-          option.value = avatar.avatar_id;
-          option.textContent = `Avatar ${avatar.avatar_id}`;
-          avatarSelect.appendChild(option);
-        });
-      }
-    } catch (error) {
-      console.error('Error loading avatars:', error);
+  // Load avatars (one page at a time as the gallery scrolls)
+  const avatarList = document.getElementById('avatarList');
+  const avatarSelect = document.getElementById('avatarSelect');
+  
+  const avatarPages = createPagedList('/api/avatars', 'avatars', avatarList, avatar => {
+    // Add to gallery (the worker's thumbnail once ready, the original until then)
+    const avatarDiv = document.createElement('div');
+    avatarDiv.className = 'avatar-item';
+    avatarDiv.innerHTML = `
+      <img src="/static/${avatar.thumbnail_path || avatar.avatar_path}" alt="Avatar" loading="lazy">
+      <button class="btn small-btn danger-btn" onclick="deleteAvatar(${avatar.avatar_id})">Delete</button>
+    `;
+    avatarList.appendChild(avatarDiv);
+    
+    // Add to select
+    const option = document.createElement('option');
+    option.value = avatar.avatar_id;
+    option.textContent = `Avatar ${avatar.avatar_id}`;
+    if (avatar.features_status === 'invalid') {
+      option.disabled = true;
+      option.textContent += ' (unreadable image)';
     }
+    avatarSelect.appendChild(option);
+  });
+  
+  function loadAvatars() {
+    avatarList.innerHTML = '';
+    avatarSelect.innerHTML = '<option value="">--Select Avatar--</option>';
+    return avatarPages.reset();
   }
   
   // Delete avatar
@@ -258,11 +315,26 @@ if (window.location.pathname.includes('user.html') || window.location.pathname =
         if (data.success) {
           showMessage(data.message, 'success');
           
-          // Show preview
+          // Show live frames while generating, then swap in the finished video
           const preview = document.getElementById('animationPreview');
           const video = document.getElementById('previewVideo');
-          video.src = `/static/${data.animation_path}`;
-          preview.style.display = 'block';
+          const livePreview = showLivePreview(preview, video, data.animation_id, data.status);
+          
+          const heading = preview.querySelector('h4');
+          const job = await waitForAnimation(data.animation_id, update => {
+            if (heading) heading.textContent = `Generating... ${update.progress || 0}%`;
+          });
+          livePreview.remove();
+          if (heading) heading.textContent = 'Preview Animation';
+          
+          if (job && job.status === 'completed') {
+            video.src = `/api/animation/${job.animation_id}/media`;
+            video.style.display = '';
+            preview.style.display = 'block';
+          } else if (job && job.status === 'failed') {
+            preview.style.display = 'none';
+            showMessage('Animation failed: ' + (job.error_message || 'Unknown error'), 'error');
+          }
           
           loadAnimations();
         } else {
@@ -274,6 +346,109 @@ if (window.location.pathname.includes('user.html') || window.location.pathname =
     });
   }
   
+  // Play the MJPEG preview stream in place of the video while a job runs
+  function showLivePreview(preview, video, animationId, status) {
+    const img = document.createElement('img');
+    img.className = 'live-preview';
+    img.alt = 'Generating...';
+    if (status === 'completed') return img;
+    
+    img.src = `/api/animation/${animationId}/preview`;
+    video.removeAttribute('src');
+    video.style.display = 'none';
+    video.parentNode.insertBefore(img, video);
+    preview.style.display = 'block';
+    return img;
+  }
+  
+  // Job status pushed by the server over one event stream shared by all waiting jobs
+  const jobWaiters = new Map();
+  const JOB_RECHECK_MS = 30000;  // Re-check waiting jobs after this long without a status event
+  let jobEvents = null;
+  let lastJobEvent = 0;
+  
+  function openJobEvents() {
+    if (jobEvents || !window.EventSource) return jobEvents;
+    
+    jobEvents = new EventSource('/api/animations/events');
+    jobEvents.addEventListener('status', event => {
+      lastJobEvent = Date.now();
+      const job = JSON.parse(event.data);
+      const waiter = jobWaiters.get(job.animation_id);
+      if (!waiter) return;
+      
+      if (job.status === 'completed' || job.status === 'failed') {
+        jobWaiters.delete(job.animation_id);
+        waiter.resolve(job);
+      } else if (waiter.onProgress) {
+        waiter.onProgress(job);
+      }
+    });
+    // A job may have finished while the stream was (re)connecting
+    jobEvents.addEventListener('open', () => {
+      jobWaiters.forEach((waiter, animationId) => checkAnimation(animationId));
+    });
+    // Safety net in case status events stop arriving on an open stream
+    setInterval(() => {
+      if (jobWaiters.size && Date.now() - lastJobEvent >= JOB_RECHECK_MS) {
+        lastJobEvent = Date.now();
+        jobWaiters.forEach((waiter, animationId) => checkAnimation(animationId));
+      }
+    }, JOB_RECHECK_MS);
+    return jobEvents;
+  }
+  
+  async function checkAnimation(animationId) {
+    try {
+      const response = await fetch(`/api/animation/${animationId}/status`);
+      const data = await response.json();
+      const waiter = jobWaiters.get(animationId);
+      
+      if (!waiter) return;
+      if (!data.success) {
+        jobWaiters.delete(animationId);
+        waiter.resolve(null);
+      } else if (data.animation.status === 'completed' || data.animation.status === 'failed') {
+        jobWaiters.delete(animationId);
+        waiter.resolve(data.animation);
+      }
+    } catch (error) {
+      console.error('Error checking animation status:', error);
+    }
+  }
+  
+  // Resolve once an animation job completes or fails
+  function waitForAnimation(animationId, onProgress) {
+    if (!window.EventSource) return pollAnimation(animationId);
+    
+    return new Promise(resolve => {
+      jobWaiters.set(animationId, { resolve, onProgress });
+      if (jobEvents && jobEvents.readyState === EventSource.OPEN) {
+        checkAnimation(animationId);
+      }
+      openJobEvents();
+    });
+  }
+  
+  // Poll an animation job until it completes or fails (browsers without EventSource)
+  async function pollAnimation(animationId, intervalMs = 2000) {
+    while (true) {
+      try {
+        const response = await fetch(`/api/animation/${animationId}/status`);
+        const data = await response.json();
+        
+        if (!data.success) return null;
+        if (data.animation.status === 'completed' || data.animation.status === 'failed') {
+          return data.animation;
+        }
+      } catch (error) {
+        console.error('Error checking animation status:', error);
+        return null;
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  }
+  
   // Cancel preview
   if (document.getElementById('cancelPreviewBtn')) {
     document.getElementById('cancelPreviewBtn').addEventListener('click', () => {
@@ -281,34 +456,50 @@ if (window.location.pathname.includes('user.html') || window.location.pathname =
     });
   }
   
-  // Load animations
-  async function loadAnimations() {
+  // Load animations (one page at a time as the history scrolls)
+  const animationList = document.getElementById('animationList');
+  
+  const animationPages = createPagedList('/api/animations', 'animations', animationList, animation => {
+    const animDiv = document.createElement('div');
+    animDiv.className = 'animation-item';
+    animDiv.innerHTML = `
+      <video src="/api/animation/${animation.animation_id}/media" controls preload="metadata"></video>
+      <p>${animation.expression_name || 'Custom'}</p>
+      <p>${new Date(animation.created_at).toLocaleDateString()}</p>
+    `;
+    animationList.appendChild(animDiv);
+  });
+  
+  function loadAnimations() {
+    animationList.innerHTML = '';
+    return animationPages.reset();
+  }
+  
+  // Load expression choices (the browser revalidates them with the ETag)
+  async function loadExpressions() {
     try {
-      const response = await fetch('/api/animations');
+      const response = await fetch('/api/expressions', { cache: 'no-cache' });
       const data = await response.json();
       
       if (data.success) {
-        const animationList = document.getElementById('animationList');
-        animationList.innerHTML = '';
+        const expressionSelect = document.getElementById('expressionSelect');
+        expressionSelect.innerHTML = '<option value="">--Choose Expression--</option>';
         
-        data.animations.forEach(animation => {
-          const animDiv = document.createElement('div');
-          animDiv.className = 'animation-item';
-          animDiv.innerHTML = `
-            <video src="/static/${animation.animation_path}" controls></video>
-            <p>${animation.expression_name || 'Custom'}</p>
-            <p>${new Date(animation.created_at).toLocaleDateString()}</p>
-          `;
-          animationList.appendChild(animDiv);
+        data.expressions.forEach(expression => {
+          const option = document.createElement('option');
+          option.value = expression.expression_id;
+          option.textContent = expression.expression_name;
+          expressionSelect.appendChild(option);
         });
       }
     } catch (error) {
-      console.error('Error loading animations:', error);
+      console.error('Error loading expressions:', error);
     }
   }
   
   // Initialize
   loadProfile();
+  loadExpressions();
   loadAvatars();
   loadAnimations();
 }
@@ -349,31 +540,24 @@ if (window.location.pathname.includes('subscriber.html') || window.location.path
 // ADMIN DASHBOARD
 // ============================================
 if (window.location.pathname.includes('admin.html') || window.location.pathname === '/admin') {
-  // Load all users
-  async function loadUsers() {
-    try {
-      const response = await fetch('/api/admin/users');
-      const data = await response.json();
-      
-      if (data.success) {
-        const userList = document.getElementById('userList');
-        userList.innerHTML = '<h4>All Users</h4>';
-        
-        data.users.forEach(user => {
-          const userDiv = document.createElement('div');
-          userDiv.style.cssText = 'padding:10px; margin:5px 0; background:#f0f0f0; border-radius:5px;';
-          userDiv.innerHTML = `
-            <p><strong>${user.fullname}</strong> (${user.email})</p>
-            <p>Role: ${user.role} | Status: ${user.subscription_status}</p>
-            <button class="btn small-btn danger-btn" onclick="suspendUser(${user.user_id})">Suspend</button>
-            <button class="btn small-btn" onclick="activateUser(${user.user_id})">Activate</button>
-          `;
-          userList.appendChild(userDiv);
-        });
-      }
-    } catch (error) {
-      console.error('Error loading users:', error);
-    }
+  // Load all users (one page at a time as the list scrolls)
+  const userList = document.getElementById('userList');
+  
+  const userPages = createPagedList('/api/admin/users', 'users', userList, user => {
+    const userDiv = document.createElement('div');
+    userDiv.style.cssText = 'padding:10px; margin:5px 0; background:#f0f0f0; border-radius:5px;';
+    userDiv.innerHTML = `
+      <p><strong>${user.fullname}</strong> (${user.email})</p>
+      <p>Role: ${user.role} | Status: ${user.subscription_status}</p>
+      <button class="btn small-btn danger-btn" onclick="suspendUser(${user.user_id})">Suspend</button>
+      <button class="btn small-btn" onclick="activateUser(${user.user_id})">Activate</button>
+    `;
+    userList.appendChild(userDiv);
+  });
+  
+  function loadUsers() {
+    userList.innerHTML = '<h4>All Users</h4>';
+    return userPages.reset();
   }
   
   window.suspendUser = async (userId) => {
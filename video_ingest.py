@@ -0,0 +1,275 @@
+"""
+Driving Video Ingest
+
+Custom driving videos are usually far larger than one request may carry,
+so they are uploaded in chunks that can be resumed after a dropped
+connection:
+
+    POST  /api/driving-videos                   {filename, size, sha256?}
+    PATCH /api/driving-videos/<id>              raw chunk, with headers
+                                                Upload-Offset: <bytes so far>
+                                                Upload-Checksum: sha256 <hex>
+    GET   /api/driving-videos/<id>              current offset, to resume
+    POST  /api/driving-videos/<id>/finalize     queue the transcode
+
+Each chunk is streamed straight into the partial file at its offset while
+its checksum is computed, so no request holds a whole chunk in memory. A
+chunk whose checksum doesn't match is cut off again and has to be resent.
+
+After finalize, the background worker pool checks the whole-file checksum
+(when the client sent one), makes sure the file decodes as a video and
+transcodes it once with ffmpeg to what the generator consumes:
+
+    <upload>_256.mp4    256x256 RGB, at most MAX_FPS and MAX_DURATION
+
+so jobs driven by it never decode and resize a full-HD clip frame by frame.
+The original upload is deleted once the transcode is in place.
+"""
+
+import hashlib
+import os
+import subprocess
+import uuid
+from contextlib import contextmanager
+
+from content_hash import file_hash
+
+VIDEO_SIZE = 256           # Model input resolution
+MAX_FPS = 30               # Faster sources are resampled down; slower ones keep their rate
+MAX_DURATION = 30          # Seconds kept from the start of the upload
+STREAM_BLOCK_SIZE = 64 * 1024  # Bytes read from the request at a time
+TRANSCODE_CRF = 18         # x264 quality; visually lossless at this size
+TRANSCODE_TIMEOUT = 10 * 60
+
+# Leading bytes of the containers accepted for upload; QuickTime files may
+# start with any top-level atom
+MP4_ATOMS = (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip')
+
+
+class InvalidVideoError(Exception):
+    """Raised when an upload can't be used as a driving video"""
+    pass
+
+
+class ChunkChecksumError(Exception):
+    """Raised when a chunk doesn't match the checksum sent with it"""
+    pass
+
+
+class ChunkConflictError(Exception):
+    """Raised when another request is writing to the same upload"""
+    pass
+
+
+def sniff_video_format(header):
+    """
+    Identify a video container from its first 12 bytes, without decoding it
+
+    Returns:
+        str: 'mp4' (also QuickTime) or 'avi', or None if unrecognised
+    """
+    if header[4:8] in MP4_ATOMS:
+        return 'mp4'
+    if header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+        return 'avi'
+    return None
+
+
+def parse_checksum(value):
+    """
+    Read an ``Upload-Checksum: sha256 <hex>`` header
+
+    Returns:
+        str: Lower-case hex digest, or None if no header was sent
+
+    Raises:
+        ValueError: If the header names another algorithm or isn't hex
+    """
+    if not value:
+        return None
+    algorithm, _, digest = value.strip().partition(' ')
+    digest = digest.strip().lower()
+    if algorithm.lower() != 'sha256' or len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        raise ValueError("Expected 'sha256 <64 hex digits>'")
+    return digest
+
+
+@contextmanager
+def locked_upload(path):
+    """
+    Open a partial upload for writing, held by one request at a time
+
+    Hold it while checking the recorded offset, writing a chunk and
+    recording the new offset, so two requests can't interleave. The lock
+    is flock on POSIX and a lock on the first byte on Windows.
+
+    Raises:
+        ChunkConflictError: If another request has the upload open
+    """
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        fcntl = None
+        import msvcrt
+
+    with open(path, 'r+b') as f:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            raise ChunkConflictError("Another chunk is being written to this upload")
+        try:
+            yield f
+        finally:
+            if fcntl is None:
+                # msvcrt locks from the current position
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_chunk(f, offset, stream, max_bytes, expected_sha256=None):
+    """
+    Stream one chunk into a partial upload at ``offset``
+
+    Anything after ``offset`` left by an interrupted earlier attempt is
+    overwritten or cut off.
+
+    Args:
+        f: Upload opened with locked_upload
+        offset: Byte position the chunk starts at
+        stream: File-like object the chunk is read from
+        max_bytes: Most bytes the chunk may contain
+        expected_sha256: Hex digest the chunk must match, if known
+
+    Returns:
+        int: Bytes written
+
+    Raises:
+        ChunkChecksumError: If the chunk doesn't match expected_sha256
+        ValueError: If the chunk is longer than max_bytes
+    """
+    digest = hashlib.sha256()
+    written = 0
+
+    f.seek(offset)
+    try:
+        for block in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b''):
+            written += len(block)
+            if written > max_bytes:
+                raise ValueError(f"Chunk exceeds {max_bytes} bytes")
+            digest.update(block)
+            f.write(block)
+
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            raise ChunkChecksumError("Chunk does not match its checksum")
+    except Exception:
+        # Drop the partial chunk so the file ends at the last good offset
+        f.truncate(offset)
+        raise
+
+    f.truncate(offset + written)
+    f.flush()
+    return written
+
+
+def probe_video(path):
+    """
+    Read a video's frame rate, duration and size, decoding its first frame
+
+    Returns:
+        dict: fps, duration (seconds) and size (width, height)
+
+    Raises:
+        InvalidVideoError: If the file can't be decoded as a video
+    """
+    import imageio
+
+    try:
+        reader = imageio.get_reader(path, format='ffmpeg')
+        try:
+            meta = reader.get_meta_data()
+            reader.get_next_data()
+        finally:
+            reader.close()
+    except (OSError, RuntimeError, ValueError, IndexError, StopIteration) as e:
+        raise InvalidVideoError(f"Not a readable video: {e}")
+
+    if not meta.get('fps') or not meta.get('size'):
+        raise InvalidVideoError("Video has no frame rate or frame size")
+    return {'fps': float(meta['fps']), 'duration': meta.get('duration'), 'size': tuple(meta['size'])}
+
+
+def transcode_driving_video(input_path, output_path, fps):
+    """
+    Write the model-ready copy of a driving video with ffmpeg
+
+    Frames are squashed to VIDEO_SIZE x VIDEO_SIZE like resize_batch does
+    (area averaging approximates its anti-aliased bilinear downscale), the
+    frame rate is capped at MAX_FPS and only the first MAX_DURATION seconds
+    are kept. Audio is dropped.
+    """
+    from imageio_ffmpeg import get_ffmpeg_exe
+
+    target_fps = min(fps, MAX_FPS)
+    scratch = f'{output_path}.{uuid.uuid4().hex}.tmp.mp4'
+    command = [
+        get_ffmpeg_exe(), '-nostdin', '-v', 'error', '-y',
+        '-i', input_path,
+        '-t', str(MAX_DURATION),
+        '-vf', f'fps={target_fps:g},scale={VIDEO_SIZE}:{VIDEO_SIZE}:flags=area',
+        '-an', '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(TRANSCODE_CRF),
+        '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+        scratch
+    ]
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=TRANSCODE_TIMEOUT)
+        if completed.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {completed.stderr.strip()[-500:]}")
+        # Write then rename so a job never reads a half-written file
+        os.replace(scratch, output_path)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+
+def process_video_ingest(upload_path, output_path, expected_sha256=None):
+    """
+    Ingest task run by the worker pool for a finalized driving video upload
+
+    Args:
+        upload_path: Assembled upload
+        output_path: Where the model-ready video is written
+        expected_sha256: Whole-file digest sent by the client, if any
+
+    Returns:
+        dict: Result with status ('success', 'failed' or 'invalid'), and on
+              success video_path, fps, duration, width and height
+    """
+    try:
+        if expected_sha256 and file_hash(upload_path) != expected_sha256:
+            raise InvalidVideoError("Upload does not match its checksum")
+        probe = probe_video(upload_path)
+        transcode_driving_video(upload_path, output_path, probe['fps'])
+        transcoded = probe_video(output_path)
+    except Exception as e:
+        return {
+            'status': 'invalid' if isinstance(e, InvalidVideoError) else 'failed',
+            'error': str(e),
+            'message': 'Driving video ingest failed'
+        }
+
+    # Jobs only ever read the transcoded copy
+    os.remove(upload_path)
+
+    width, height = probe['size']
+    return {
+        'status': 'success',
+        'video_path': output_path,
+        'fps': transcoded['fps'],
+        'duration': transcoded['duration'],
+        'width': width,
+        'height': height,
+        'message': 'Driving video ingested successfully'
+    }